@@ -1,22 +1,35 @@
-from flask import Flask, jsonify
+from flask import Flask, jsonify, abort
 from flask_cors import CORS
 from config import Config
-from models import db, TokenBlocklist
+from models import db
 from flask_jwt_extended import JWTManager, get_jwt
 from flask_migrate import Migrate
-from extensions import limiter
+from extensions import limiter, ride_snapshot, route_geometry_cache, pickup_order_cache, revocation_cache, location_buffer, recommendation_cache, response_cache, recurring_materializer, journey_estimator, request_metrics, request_profiler
+from request_metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from spatial_index import rebuild_spatial_index, verify_spatial_index
+from place_index import rebuild_place_index, verify_place_index
+from token_revocation import purge_expired_tokens
+from ratings import rebuild_driver_rating_index, recompute_aggregates
+from trip_patterns import rebuild_trip_patterns
+from recurring_materializer import materialize_recurring_rides
+import batch_matcher
+from seed_data import generate_with_report
 import os
+import click
+import json
 # Import Blueprints
 from routes.users_routes import users_bp
 from routes.rides_routes import rides_bp
 from routes.features_routes import features_bp
+from routes.admin_routes import admin_bp
 
 # --- App Initialization ---
 app = Flask(__name__)
 app.config.from_object(Config)
 
 # --- Enable CORS ---
-CORS(app, origins=["http://localhost:5173", "https://fccpool.netlify.app"], supports_credentials=True)
+CORS(app, origins=["http://localhost:5173", "https://fccpool.netlify.app"], supports_credentials=True,
+     expose_headers=["X-Next-Cursor"])
 
 
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
@@ -26,21 +39,40 @@ ssl_key_path = os.path.join(BASE_DIR, "privkey.pem")
 
 # --- Extensions Initialization ---
 db.init_app(app)
+# First, so their request hooks also cover requests rejected by later ones (e.g. rate limits)
+request_metrics.init_app(app)
+request_profiler.init_app(app)
 jwt = JWTManager(app)
 migrate = Migrate(app, db)
 limiter.init_app(app)
+ride_snapshot.init_app(app)
+route_geometry_cache.init_app(app)
+pickup_order_cache.init_app(app)
+revocation_cache.init_app(app)
+location_buffer.init_app(app)
+recommendation_cache.init_app(app)
+response_cache.init_app(app)
+request_metrics.add_collector(response_cache.metrics)
+request_metrics.add_collector(route_geometry_cache.metrics)
+request_metrics.add_collector(pickup_order_cache.metrics)
+recurring_materializer.init_app(app)
+journey_estimator.init_app(app)
+# The R*Tree and place index are keyed on ride rowids, which a VACUUM may
+# renumber; the first request checks them and rebuilds them if needed
+app.before_request(verify_spatial_index)
+app.before_request(verify_place_index)
 
 # --- JWT Blocklist Loader ---
 @jwt.token_in_blocklist_loader
 def check_if_token_revoked(jwt_header, jwt_payload: dict) -> bool:
-    jti = jwt_payload["jti"]
-    token = db.session.query(TokenBlocklist.id).filter_by(jti=jti).scalar()
-    return token is not None
+    return revocation_cache.is_revoked(jwt_payload["jti"]) or \
+        revocation_cache.is_outdated(jwt_payload["sub"], jwt_payload.get("ver"))
 
 # --- Register Blueprints ---
 app.register_blueprint(users_bp)
 app.register_blueprint(rides_bp)
 app.register_blueprint(features_bp)
+app.register_blueprint(admin_bp)
 
 # --- Global Error Handlers ---
 @app.errorhandler(404)
@@ -64,6 +96,127 @@ def init_db_command():
         db.create_all()
     print("Initialized the database.")
 
+@app.cli.command("rebuild_spatial_index")
+def rebuild_spatial_index_command():
+    """Rebuilds the R*Tree indexes used by coordinate and en-route ride search."""
+    with app.app_context():
+        indexed = rebuild_spatial_index()
+    if indexed is None:
+        print("Spatial index is only used on SQLite; nothing to rebuild.")
+    else:
+        print(f"Spatial index rebuilt with {indexed} ride points and routes.")
+
+@app.cli.command("rebuild_place_index")
+def rebuild_place_index_command():
+    """Rebuilds the place name index used by text ride search and autocomplete."""
+    with app.app_context():
+        places = rebuild_place_index()
+    if places is None:
+        print("Place index needs SQLite 3.34+ with FTS5; nothing to rebuild.")
+    else:
+        print(f"Place index rebuilt with {places} places.")
+
+@app.cli.command("rebuild_driver_rating_index")
+def rebuild_driver_rating_index_command():
+    """Recopies drivers' ratings onto their active rides, used by rating-ordered ride search."""
+    with app.app_context():
+        updated = rebuild_driver_rating_index()
+    if updated is None:
+        print("Driver ratings are only copied onto rides on SQLite; nothing to rebuild.")
+    else:
+        print(f"Driver rating index rebuilt over {updated} rides.")
+
+@app.cli.command("purge_token_blocklist")
+def purge_token_blocklist_command():
+    """Deletes blocklist entries for tokens that have already expired."""
+    with app.app_context():
+        purged = purge_expired_tokens(revocation_cache.max_token_lifetime)
+    print(f"Purged {purged} expired blocklist entries.")
+
+@app.cli.command("recompute_rating_aggregates")
+@click.option("--dry-run", is_flag=True, help="Only report drift, don't rewrite the aggregates.")
+def recompute_rating_aggregates_command(dry_run):
+    """Recomputes every user's rating aggregates from the ratings table."""
+    with app.app_context():
+        drift = recompute_aggregates(dry_run=dry_run)
+    for user_id, rating_type, stored, actual in drift[:20]:
+        print(f"  - {user_id} {rating_type}: stored (sum, count) {stored}, actual {actual}")
+    if len(drift) > 20:
+        print(f"  ... and {len(drift) - 20} more")
+    action = "found" if dry_run else "corrected"
+    print(f"Rating aggregates recomputed: {len(drift)} drifted aggregates {action}.")
+
+@app.cli.command("backfill_trip_patterns")
+@click.option("--batch-size", default=5000, show_default=True, help="Rows inserted per batch.")
+def backfill_trip_patterns_command(batch_size):
+    """Rebuilds all trip patterns from completed rides and bookings."""
+    with app.app_context():
+        written = rebuild_trip_patterns(batch_size=batch_size)
+    print(f"Trip patterns rebuilt: {written} patterns written.")
+
+@app.cli.command("materialize_recurring_rides")
+@click.option("--horizon-days", type=int, default=None, help="Days ahead to generate (default: RECURRING_HORIZON_DAYS).")
+@click.option("--batch-size", type=int, default=None, help="Templates per batch (default: RECURRING_MATERIALIZE_BATCH_SIZE).")
+def materialize_recurring_rides_command(horizon_days, batch_size):
+    """Generates missing ride instances for every active recurring template."""
+    with app.app_context():
+        inserted = materialize_recurring_rides(
+            horizon_days or app.config['RECURRING_HORIZON_DAYS'],
+            batch_size or app.config['RECURRING_MATERIALIZE_BATCH_SIZE']
+        )
+    print(f"Recurring rides materialized: {inserted} rides created.")
+
+@app.cli.command("batch_match")
+@click.argument("requests_file", type=click.File())
+@click.option("--dry-run", is_flag=True, help="Only report the assignment, don't book.")
+@click.option("--max-detour-km", type=float, default=None, help="Largest allowed detour (default: BATCH_MATCH_MAX_DETOUR_KM).")
+def batch_match_command(requests_file, dry_run, max_detour_km):
+    """Assigns the rider requests in a JSON file (a list of objects) to scheduled rides."""
+    if not batch_matcher.available():
+        raise click.ClickException("Batch matching requires numpy.")
+    try:
+        requests = batch_matcher.parse_requests(json.load(requests_file))
+    except (ValueError, batch_matcher.InvalidRequest) as e:
+        raise click.ClickException(str(e))
+    with app.app_context():
+        summary = batch_matcher.run_batch(
+            requests,
+            max_detour_km=max_detour_km or app.config['BATCH_MATCH_MAX_DETOUR_KM'],
+            km_per_minute=app.config['BATCH_MATCH_KM_PER_MINUTE'],
+            candidates=app.config['BATCH_MATCH_CANDIDATES'],
+            dry_run=dry_run
+        )
+    action = "would be booked" if dry_run else "booked"
+    print(f"{summary['assigned']} of {summary['requests']} riders {action} on {summary['rides_considered']} candidate rides "
+          f"(total detour {summary['total_detour_km']} km, mean gap {summary['mean_gap_minutes']} min); "
+          f"{len(summary['unassigned'])} unassigned, {len(summary['rejected'])} rejected.")
+
+@app.cli.command("generate_data")
+@click.option("--users", default=10_000, show_default=True, help="Number of users.")
+@click.option("--rides", default=50_000, show_default=True, help="Number of rides (bookings and ratings scale with it).")
+@click.option("--seed", default=42, show_default=True, help="Random seed; the same seed produces the same data.")
+@click.option("--password", default="Password123", show_default=True, help="Password of every generated user.")
+@click.option("--reset", is_flag=True, help="Drop and recreate all tables first.")
+@click.option("--skip-search-indexes", is_flag=True,
+              help="Leave the spatial, place and driver rating indexes to the rebuild_* commands.")
+def generate_data_command(users, rides, seed, password, reset, skip_search_indexes):
+    """Bulk-generates synthetic users, rides, bookings, ratings and patterns."""
+    with app.app_context():
+        if reset:
+            db.drop_all()
+        db.create_all()
+        generate_with_report(users=users, rides=rides, seed=seed, password=password,
+                             search_indexes=not skip_search_indexes)
+    if skip_search_indexes:
+        print("Search indexes skipped: run rebuild_spatial_index, rebuild_place_index "
+              "and rebuild_driver_rating_index before serving searches.")
+
+@app.route('/metrics', methods=['GET'])
+@limiter.exempt
+def metrics_endpoint():
+    if not request_metrics.enabled:
+        abort(404)
+    return request_metrics.render(), 200, {'Content-Type': METRICS_CONTENT_TYPE}
 
 @app.route('/test', methods=['GET'])
 def test_endpoint():
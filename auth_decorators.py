@@ -1,17 +1,33 @@
 # auth_decorators.py
+import hmac
 from functools import wraps
-from flask import jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import User
+from flask import current_app, g, jsonify, request
+from flask_jwt_extended import jwt_required, get_jwt, get_jwt_identity
+from models import db, User
+
+def current_user():
+    """The authenticated User, loaded at most once per request."""
+    if 'current_user' not in g:
+        g.current_user = db.session.get(User, get_jwt_identity())
+    return g.current_user
+
+def current_role():
+    """
+    The caller's role, taken from the token's `role` claim. Tokens issued
+    before the claim existed fall back to loading the user.
+    """
+    role = get_jwt().get('role')
+    if role is None:
+        user = current_user()
+        role = user.role if user else None
+    return role
 
 def role_required(allowed_roles):
     def decorator(fn):
         @wraps(fn)
         @jwt_required()
         def wrapper(*args, **kwargs):
-            current_user_id = get_jwt_identity()
-            user = User.query.get(current_user_id)
-            if not user or user.role not in allowed_roles:
+            if current_role() not in allowed_roles:
                 return jsonify({"error": f"Access forbidden: Requires one of {allowed_roles}"}), 403
             return fn(*args, **kwargs)
         return wrapper
@@ -19,4 +35,19 @@ def role_required(allowed_roles):
 
 # Specific role decorators for convenience
 driver_required = role_required(['driver', 'both'])
-rider_required = role_required(['rider', 'both'])
\ No newline at end of file
+rider_required = role_required(['rider', 'both'])
+
+def admin_required(fn):
+    """
+    Operator endpoints: the X-Admin-Token header must match ADMIN_TOKEN.
+    Without ADMIN_TOKEN configured they answer 404, as if they did not exist.
+    """
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        token = current_app.config.get('ADMIN_TOKEN')
+        if not token:
+            return jsonify({"error": "Resource not found"}), 404
+        if not hmac.compare_digest(request.headers.get('X-Admin-Token', '').encode(), token.encode()):
+            return jsonify({"error": "Access forbidden: admin token required"}), 403
+        return fn(*args, **kwargs)
+    return wrapper
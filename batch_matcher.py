@@ -0,0 +1,387 @@
+# batch_matcher.py
+"""
+Batch assignment of riders to scheduled rides.
+
+Given rider requests (pickup, drop-off, preferred time +/- window) and the
+scheduled rides with free seats, `match` picks at most one ride per rider,
+never exceeding a ride's seats, so that the total cost is low. The cost of
+a (rider, ride) pair is the driver's detour, approximated by the distance
+from the ride's origin to the pickup plus from the drop-off to the ride's
+destination, plus BATCH_MATCH_KM_PER_MINUTE for every minute between the
+departure and the preferred time. Pairs outside the time window, above
+BATCH_MATCH_MAX_DETOUR_KM, or where the rider drives the ride are
+infeasible.
+
+Cost matrices are computed with NumPy one block of riders at a time, in
+time order, against the rides departing within the block's windows; each
+rider keeps its cheapest BATCH_MATCH_CANDIDATES rides. The assignment is a
+greedy pass over all kept pairs in increasing cost, repeated for riders
+left out (their candidates filled up) against the rides that still have
+seats, then a repair pass: a rider still left out takes a seat on a full
+ride whose passenger can move to a ride with free seats. `book_assignments`
+then reserves the seats with conditional UPDATEs (one per seat count and
+chunk of rides) and inserts the bookings in bulk, in one transaction.
+
+Needs NumPy, which is optional: without it `available()` is False.
+"""
+import math
+import uuid
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta
+from sqlalchemy import insert, select, update
+from models import db, Booking, Ride, User
+from signals import notify_ride_changed
+from spatial_index import EARTH_RADIUS_KM
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is an optional dependency
+    np = None
+
+_EPOCH = datetime(1970, 1, 1)
+# IN lists are split into chunks of this size
+_CHUNK = 500
+
+class InvalidRequest(ValueError):
+    pass
+
+# Column arrays; times are epoch seconds
+Riders = namedtuple('Riders', ['pickup_lat', 'pickup_lng', 'dropoff_lat', 'dropoff_lng', 'time', 'window'])
+Rides = namedtuple('Rides', ['origin_lat', 'origin_lng', 'destination_lat', 'destination_lng', 'departure', 'seats'])
+_Projected = namedtuple('_Projected', ['pickup_x', 'pickup_y', 'dropoff_x', 'dropoff_y', 'time', 'window'])
+_ProjectedRides = namedtuple('_ProjectedRides', ['origin_x', 'origin_y', 'destination_x', 'destination_y', 'departure'])
+Assignment = namedtuple('Assignment', ['rider', 'ride', 'detour_km', 'gap_minutes'])
+RiderRequest = namedtuple('RiderRequest', [
+    'rider_id', 'pickup_lat', 'pickup_lng', 'dropoff_lat', 'dropoff_lng', 'time', 'window_minutes', 'pickup_point_name'
+])
+
+def available():
+    return np is not None
+
+def _to_epoch(dt):
+    return (dt - _EPOCH).total_seconds()
+
+# --- Matching ---
+
+def _block_costs(riders, rides, rows, cols, max_detour_km, km_per_minute):
+    """
+    Cost, detour (km) and gap (minutes) matrices of riders `rows` x rides
+    `cols`; infeasible pairs cost inf. Inputs are projected to km and
+    minutes (see `match`).
+    """
+    detour = np.subtract.outer(riders.pickup_x[rows], rides.origin_x[cols])
+    np.square(detour, out=detour)
+    dy = np.subtract.outer(riders.pickup_y[rows], rides.origin_y[cols])
+    np.square(dy, out=dy)
+    detour += dy
+    np.sqrt(detour, out=detour)
+    dx = np.subtract.outer(riders.dropoff_x[rows], rides.destination_x[cols])
+    np.square(dx, out=dx)
+    np.subtract.outer(riders.dropoff_y[rows], rides.destination_y[cols], out=dy)
+    np.square(dy, out=dy)
+    dx += dy
+    np.sqrt(dx, out=dx)
+    detour += dx
+
+    gap = np.subtract.outer(riders.time[rows], rides.departure[cols])
+    np.abs(gap, out=gap)
+    cost = np.multiply(gap, km_per_minute, out=dy)
+    cost += detour
+    cost[(detour > max_detour_km) | (gap > riders.window[rows, None])] = np.inf
+    return cost, detour, gap
+
+def match(riders, rides, max_detour_km=3.0, km_per_minute=0.1, candidates=8, excluded=None,
+          block_size=512, max_rounds=20):
+    """
+    Assigns riders (a `Riders` of arrays) to rides (a `Rides`); returns the
+    `Assignment`s, with rider and ride as indices into the arrays.
+    `excluded` maps a rider index to ride indices it cannot take.
+    """
+    excluded = excluded or {}
+    if not len(riders.time) or not len(rides.seats):
+        return []
+    # Rides in departure order, so a block of riders with close times only
+    # looks at the rides departing within their windows
+    by_departure = np.argsort(rides.departure, kind='stable')
+    position = np.empty_like(by_departure)
+    position[by_departure] = np.arange(len(by_departure))
+    excluded = {rider: position[np.asarray(blocked)] for rider, blocked in excluded.items() if len(blocked)}
+
+    # Equirectangular projection to km around the mean latitude (fine at city
+    # scale), times in minutes from the earliest request, all float32
+    km_per_degree = math.pi / 180 * EARTH_RADIUS_KM
+    mean_lat = float(np.mean(np.concatenate([riders.pickup_lat, rides.origin_lat])))
+    x_scale = km_per_degree * math.cos(math.radians(mean_lat))
+    base = float(np.min(riders.time))
+
+    def projected(values, scale, offset=0.0):
+        return ((values - offset) * scale).astype(np.float32)
+
+    rider_cols = _Projected(
+        pickup_x=projected(riders.pickup_lng, x_scale), pickup_y=projected(riders.pickup_lat, km_per_degree),
+        dropoff_x=projected(riders.dropoff_lng, x_scale), dropoff_y=projected(riders.dropoff_lat, km_per_degree),
+        time=projected(riders.time, 1 / 60, base), window=projected(riders.window, 1 / 60),
+    )
+    ride_cols = _ProjectedRides(
+        origin_x=projected(rides.origin_lng[by_departure], x_scale),
+        origin_y=projected(rides.origin_lat[by_departure], km_per_degree),
+        destination_x=projected(rides.destination_lng[by_departure], x_scale),
+        destination_y=projected(rides.destination_lat[by_departure], km_per_degree),
+        departure=projected(rides.departure[by_departure], 1 / 60, base),
+    )
+    seats = rides.seats[by_departure].astype(np.int64)
+    count = len(riders.time)
+    ride_of = np.full(count, -1)
+    cost_of, detour_of, gap_of = np.zeros(count), np.zeros(count), np.zeros(count)
+    passengers = defaultdict(list)  # ride -> riders
+
+    def assign(rider, ride, cost, detour, gap):
+        ride_of[rider] = ride
+        cost_of[rider], detour_of[rider], gap_of[rider] = cost, detour, gap
+        passengers[ride].append(rider)
+        seats[ride] -= 1
+
+    def pairs(rows, open_rides, k):
+        """Each of `rows`' k cheapest feasible rides among `open_rides`, as
+        (cost, rider, ride, detour, gap) arrays in increasing cost."""
+        rows = rows[np.argsort(rider_cols.time[rows], kind='stable')]
+        found = []
+        for start in range(0, len(rows), block_size):
+            block = rows[start:start + block_size]
+            earliest = float(np.min(rider_cols.time[block] - rider_cols.window[block]))
+            latest = float(np.max(rider_cols.time[block] + rider_cols.window[block]))
+            lo = int(np.searchsorted(ride_cols.departure, earliest, side='left'))
+            hi = int(np.searchsorted(ride_cols.departure, latest, side='right'))
+            cols = lo + np.flatnonzero(open_rides[lo:hi])
+            if not len(cols):
+                continue
+            cost, detour, gap = _block_costs(rider_cols, ride_cols, block, cols, max_detour_km, km_per_minute)
+            for offset, rider in enumerate(block):
+                blocked = excluded.get(rider)
+                if blocked is not None:
+                    at = np.searchsorted(cols, blocked)
+                    at = at[at < len(cols)]
+                    cost[offset, at[np.isin(cols[at], blocked)]] = np.inf
+            best = np.argpartition(cost, k - 1, axis=1)[:, :k] if k < len(cols) else \
+                np.broadcast_to(np.arange(len(cols)), cost.shape)
+            block_rows = np.broadcast_to(np.arange(len(block))[:, None], best.shape)
+            best_cost = cost[block_rows, best]
+            keep = np.isfinite(best_cost)
+            found.append((best_cost[keep], block[block_rows[keep]], cols[best[keep]],
+                          detour[block_rows, best][keep], gap[block_rows, best][keep]))
+        if not found:
+            return None
+        cost, rider_idx, ride_idx, detour, gap = (np.concatenate(column) for column in zip(*found))
+        # Ties broken by rider, then ride, for stable results
+        order = np.lexsort((ride_idx, rider_idx, cost))
+        return cost[order], rider_idx[order], ride_idx[order], detour[order], gap[order]
+
+    # Greedy: cheapest pairs first, repeated for the riders whose candidates
+    # filled up against the rides that still have seats
+    for _ in range(max_rounds):
+        found = pairs(np.flatnonzero(ride_of < 0), seats > 0, candidates)
+        if found is None:
+            break
+        made = 0
+        for cost, rider, ride, detour, gap in zip(*(column.tolist() for column in found)):
+            if ride_of[rider] < 0 and seats[ride] > 0:
+                assign(rider, ride, cost, detour, gap)
+                made += 1
+        if not made:
+            break
+
+    # Repair: a rider left out takes a seat on a full ride whose passenger
+    # moves to a ride that still has seats, at the least extra cost
+    waiting = np.flatnonzero(ride_of < 0)
+    if len(waiting) and np.any(seats > 0):
+        wanted = pairs(waiting, np.ones(len(seats), dtype=bool), candidates)
+        moves = pairs(np.flatnonzero(ride_of >= 0), seats > 0, candidates)
+        alternatives = defaultdict(list)  # passenger -> (cost, ride, detour, gap), cheapest first
+        if moves is not None:
+            for cost, rider, ride, detour, gap in zip(*(column.tolist() for column in moves)):
+                alternatives[rider].append((cost, ride, detour, gap))
+        moved = set()
+        for cost, rider, ride, detour, gap in zip(*(column.tolist() for column in wanted or ())):
+            if ride_of[rider] >= 0 or seats[ride] > 0:
+                continue
+            best = None
+            for passenger in passengers[ride]:
+                if passenger in moved:
+                    continue
+                for alternative in alternatives.get(passenger, ()):
+                    if seats[alternative[1]] > 0:
+                        extra = alternative[0] - cost_of[passenger]
+                        if best is None or extra < best[0]:
+                            best = (extra, passenger, alternative)
+                        break
+            if best is None:
+                continue
+            _, passenger, (alt_cost, alt_ride, alt_detour, alt_gap) = best
+            passengers[ride].remove(passenger)
+            seats[ride] += 1
+            assign(passenger, alt_ride, alt_cost, alt_detour, alt_gap)
+            assign(rider, ride, cost, detour, gap)
+            moved.update((passenger, rider))
+
+    return [
+        Assignment(rider, int(by_departure[ride_of[rider]]), float(detour_of[rider]), float(gap_of[rider]))
+        for rider in np.flatnonzero(ride_of >= 0).tolist()
+    ]
+
+# --- Database ---
+
+def parse_requests(items):
+    """`RiderRequest`s from JSON objects; raises InvalidRequest naming the bad item."""
+    requests = []
+    for index, item in enumerate(items):
+        try:
+            requests.append(RiderRequest(
+                rider_id=str(item['rider_id']),
+                pickup_lat=float(item['pickup_lat']), pickup_lng=float(item['pickup_lng']),
+                dropoff_lat=float(item['dropoff_lat']), dropoff_lng=float(item['dropoff_lng']),
+                time=datetime.fromisoformat(item['time']),
+                window_minutes=float(item.get('window_minutes', 30)),
+                pickup_point_name=str(item.get('pickup_point_name') or "Pickup point"),
+            ))
+        except (KeyError, TypeError, ValueError) as e:
+            raise InvalidRequest(f"Request {index}: {e!r}") from e
+    return requests
+
+def _chunks(values):
+    for start in range(0, len(values), _CHUNK):
+        yield values[start:start + _CHUNK]
+
+def run_batch(requests, max_detour_km, km_per_minute, candidates, dry_run=False):
+    """
+    Matches `requests` against the scheduled rides with free seats in their
+    time windows and, unless `dry_run`, books the assignments. Returns a
+    summary dict. Requests from unknown users or users who cannot ride, and
+    repeated requests from one rider, are rejected.
+    """
+    rejected = {}
+    rider_ids = list(dict.fromkeys(r.rider_id for r in requests))
+    allowed = set()
+    for chunk in _chunks(rider_ids):
+        allowed.update(db.session.execute(
+            select(User.id).where(User.id.in_(chunk), User.role.in_(['rider', 'both']))
+        ).scalars())
+    valid, seen = [], set()
+    for r in requests:
+        if r.rider_id not in allowed:
+            rejected[r.rider_id] = "not a rider"
+        elif r.rider_id in seen:
+            rejected[r.rider_id] = "duplicate request"
+        else:
+            seen.add(r.rider_id)
+            valid.append(r)
+    if not valid:
+        return _summary(requests, [], [], [], rejected, dry_run)
+
+    start = min(r.time - timedelta(minutes=r.window_minutes) for r in valid)
+    end = max(r.time + timedelta(minutes=r.window_minutes) for r in valid)
+    ride_rows = db.session.execute(
+        select(Ride.id, Ride.driver_id, Ride.origin_lat, Ride.origin_lng, Ride.destination_lat,
+               Ride.destination_lng, Ride.departure_time, Ride.available_seats)
+        .where(Ride.status == 'scheduled', Ride.available_seats > 0,
+               Ride.departure_time.between(start, end),
+               Ride.origin_lat != None, Ride.origin_lng != None,
+               Ride.destination_lat != None, Ride.destination_lng != None)
+        .order_by(Ride.departure_time, Ride.id)
+    ).all()
+
+    # Pairs that cannot be booked: own rides, and rides the rider already has a booking on
+    rider_index = {r.rider_id: i for i, r in enumerate(valid)}
+    ride_index = {ride.id: j for j, ride in enumerate(ride_rows)}
+    excluded = {}
+    for j, ride in enumerate(ride_rows):
+        if ride.driver_id in rider_index:
+            excluded.setdefault(rider_index[ride.driver_id], []).append(j)
+    for chunk in _chunks(list(rider_index)):
+        for ride_id, rider_id in db.session.execute(
+            select(Booking.ride_id, Booking.rider_id)
+            .where(Booking.rider_id.in_(chunk), Booking.ride_id.in_(select(Ride.id).where(
+                Ride.status == 'scheduled', Ride.departure_time.between(start, end))))
+        ):
+            if ride_id in ride_index:
+                excluded.setdefault(rider_index[rider_id], []).append(ride_index[ride_id])
+
+    riders = Riders(
+        pickup_lat=np.array([r.pickup_lat for r in valid]), pickup_lng=np.array([r.pickup_lng for r in valid]),
+        dropoff_lat=np.array([r.dropoff_lat for r in valid]), dropoff_lng=np.array([r.dropoff_lng for r in valid]),
+        time=np.array([_to_epoch(r.time) for r in valid]), window=np.array([r.window_minutes * 60 for r in valid]),
+    )
+    rides = Rides(
+        origin_lat=np.array([r.origin_lat for r in ride_rows]), origin_lng=np.array([r.origin_lng for r in ride_rows]),
+        destination_lat=np.array([r.destination_lat for r in ride_rows]),
+        destination_lng=np.array([r.destination_lng for r in ride_rows]),
+        departure=np.array([_to_epoch(r.departure_time) for r in ride_rows]),
+        seats=np.array([r.available_seats for r in ride_rows], dtype=np.int64),
+    )
+    assignments = match(riders, rides, max_detour_km, km_per_minute, candidates, excluded)
+    booking_ids = [None] * len(assignments)
+    if not dry_run:
+        assignments, booking_ids = book_assignments(valid, ride_rows, assignments)
+    return _summary(requests, valid, ride_rows, list(zip(assignments, booking_ids)), rejected, dry_run)
+
+def book_assignments(requests, ride_rows, assignments):
+    """
+    Reserves the seats and inserts the bookings in one transaction. Rides
+    that lost seats to concurrent bookings since they were read keep their
+    riders unassigned. Returns the assignments made and their booking ids.
+    """
+    by_ride = {}
+    for assignment in assignments:
+        by_ride.setdefault(assignment.ride, []).append(assignment)
+    # One conditional UPDATE per (seats taken, chunk of rides); RETURNING
+    # gives the rides that still had the seats
+    by_count = {}
+    for ride, ride_assignments in by_ride.items():
+        by_count.setdefault(len(ride_assignments), []).append(ride_rows[ride].id)
+    reserved = set()
+    for count, ride_ids in by_count.items():
+        for chunk in _chunks(ride_ids):
+            reserved.update(db.session.execute(
+                update(Ride.__table__)
+                .where(Ride.__table__.c.id.in_(chunk), Ride.__table__.c.status == 'scheduled',
+                       Ride.__table__.c.available_seats >= count)
+                .values(available_seats=Ride.__table__.c.available_seats - count,
+                        version=Ride.__table__.c.version + 1)
+                .returning(Ride.__table__.c.id)
+            ).scalars())
+    made = [a for ride, ride_assignments in by_ride.items() if ride_rows[ride].id in reserved
+            for a in ride_assignments]
+    booking_ids = [str(uuid.uuid4()) for _ in made]
+    if made:
+        db.session.execute(insert(Booking), [
+            {
+                "id": booking_id, "ride_id": ride_rows[a.ride].id, "rider_id": requests[a.rider].rider_id,
+                "pickup_point_name": requests[a.rider].pickup_point_name,
+                "pickup_point_lat": requests[a.rider].pickup_lat, "pickup_point_lng": requests[a.rider].pickup_lng,
+                "status": 'confirmed',
+            }
+            for a, booking_id in zip(made, booking_ids)
+        ])
+    db.session.commit()
+    for ride in {a.ride for a in made}:
+        notify_ride_changed(ride_rows[ride].id)
+    return made, booking_ids
+
+def _summary(requests, valid, ride_rows, booked, rejected, dry_run):
+    matched = {valid[a.rider].rider_id for a, _ in booked}
+    return {
+        "dry_run": dry_run,
+        "requests": len(requests),
+        "rides_considered": len(ride_rows),
+        "assigned": len(booked),
+        "total_detour_km": round(sum(a.detour_km for a, _ in booked), 3),
+        "mean_gap_minutes": round(sum(a.gap_minutes for a, _ in booked) / len(booked), 1) if booked else None,
+        "bookings": [
+            {
+                "rider_id": valid[a.rider].rider_id, "ride_id": ride_rows[a.ride].id, "booking_id": booking_id,
+                "detour_km": round(a.detour_km, 3), "gap_minutes": round(a.gap_minutes, 1),
+            }
+            for a, booking_id in booked
+        ],
+        "unassigned": [r.rider_id for r in valid if r.rider_id not in matched],
+        "rejected": [{"rider_id": rider_id, "reason": reason} for rider_id, reason in rejected.items()],
+    }
@@ -0,0 +1,216 @@
+# bench.py
+"""
+In-process load benchmark.
+
+Seeds a SQLite database per data size (see seed_data.py), then drives the app through the Flask
+test client and reports p50/p95/p99 latency and requests per second for the
+hot endpoints. Each data size runs in its own process, because the database
+URL is bound when `app` is imported.
+
+    python bench.py --sizes 1k,100k --save baseline.json
+    python bench.py --sizes 1k,100k --compare baseline.json
+
+The response cache is off by default, so repeated searches measure the
+queries rather than cache hits. `--response-cache on` measures with it, and
+`--response-cache both` runs every size twice and reports the cached run
+separately (as "<size>+cache").
+
+Seeded databases are kept in --data-dir and reused by later runs (--reseed
+forces a fresh one). Write scenarios (bookings, location pings) change the
+data, so compare runs against freshly seeded databases when it matters.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+BENCH_PASSWORD = "BenchPassword123"
+
+def parse_size(text):
+    text = text.strip().lower()
+    multiplier = {"k": 1_000, "m": 1_000_000}.get(text[-1], 1)
+    return int(float(text.rstrip("km")) * multiplier)
+
+# --- Measuring ---
+
+def measure(client, make_request, requests_count, warmup=20):
+    """Runs `make_request(client)` and returns latency percentiles (ms), throughput and status counts."""
+    for _ in range(warmup):
+        make_request(client)
+    latencies, statuses = [], {}
+    started = time.perf_counter()
+    for _ in range(requests_count):
+        t0 = time.perf_counter()
+        status = make_request(client).status_code
+        latencies.append((time.perf_counter() - t0) * 1000)
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    elapsed = time.perf_counter() - started
+    cuts = statistics.quantiles(latencies, n=100)
+    return {
+        "p50_ms": round(cuts[49], 3), "p95_ms": round(cuts[94], 3), "p99_ms": round(cuts[98], 3),
+        "rps": round(requests_count / elapsed, 1), "requests": requests_count, "statuses": statuses,
+    }
+
+def run_size(ride_count, data_dir, requests_count, reseed, rng_seed):
+    """Seeds (or reuses) the database for one size and benchmarks every scenario in this process."""
+    db_path = os.path.join(data_dir, f"bench_{ride_count}_{rng_seed}.db")
+    if reseed and os.path.exists(db_path):
+        os.remove(db_path)
+    fresh = not os.path.exists(db_path)
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    # The background materializer would compete with the measured requests
+    os.environ.setdefault("RECURRING_MATERIALIZE_INTERVAL_SECONDS", "0")
+    # Set by main(): the cache is bound when `app` is imported
+    os.environ.setdefault("RESPONSE_CACHE_ENABLED", "false")
+
+    from sqlalchemy import select
+    from app import app
+    from extensions import limiter
+    from models import db, User, Ride
+    from seed_data import CAMPUS, PLACES, generate
+    limiter.enabled = False
+
+    with app.app_context():
+        if fresh:
+            db.create_all()
+            t0 = time.perf_counter()
+            generate(users=max(200, ride_count // 5), rides=ride_count, seed=rng_seed, password=BENCH_PASSWORD)
+            print(f"  seeded {ride_count} rides in {time.perf_counter() - t0:.1f}s", file=sys.stderr)
+        riders = db.session.execute(select(User.email).where(User.role == "rider").limit(200)).scalars().all()
+        drivers = db.session.execute(select(User.email).where(User.role == "driver").limit(50)).scalars().all()
+        open_rides = db.session.execute(
+            select(Ride.id).where(Ride.status == "scheduled", Ride.available_seats > 0).limit(5000)
+        ).scalars().all()
+        any_rides = db.session.execute(select(Ride.id).limit(5000)).scalars().all()
+
+    rng = random.Random(rng_seed)
+    client = app.test_client()
+
+    def login(email):
+        return client.post("/auth/login", json={"email": email, "password": BENCH_PASSWORD})
+
+    def headers(email):
+        return {"Authorization": "Bearer " + login(email).get_json()["access_token"]}
+
+    rider_headers = [headers(email) for email in riders[:50]]
+    driver_headers = [headers(email) for email in drivers[:20]]
+
+    places = [CAMPUS] + [(name, lat, lng) for name, lat, lng, _ in PLACES]
+
+    def place():
+        return rng.choice(places)
+
+    scenarios = {
+        "login": lambda c: login(rng.choice(riders)),
+        "search_text": lambda c: c.get("/rides", query_string={"origin": place()[0], "destination": place()[0]}),
+        "search_coords": lambda c: c.get("/rides", query_string=dict(zip(
+            ("origin_lat", "origin_lng", "dest_lat", "dest_lng"), (*place()[1:], *place()[1:])))),
+        "search_time_window": lambda c: c.get("/rides", query_string={
+            "destination": place()[0],
+            "time": (datetime.utcnow() + timedelta(days=rng.randint(0, 30), hours=rng.randint(0, 23))).isoformat()}),
+        "ride_details": lambda c: c.get(f"/rides/{rng.choice(any_rides)}", headers=rng.choice(rider_headers)),
+        "book_seat": lambda c: c.post(f"/rides/{rng.choice(open_rides)}/bookings",
+                                      json={"pickup_point_name": "Bench Gate"}, headers=rng.choice(rider_headers)),
+        "update_my_location": lambda c: c.put("/users/me/location", json={
+            "lat": 31.5 + rng.random() / 10, "lng": 74.3 + rng.random() / 10}, headers=rng.choice(driver_headers)),
+        "pattern_recommendations": lambda c: c.get("/ai/recommendations/patterns", headers=rng.choice(rider_headers)),
+        "recommendations": lambda c: c.get("/ai/recommendations", headers=rng.choice(rider_headers)),
+    }
+
+    results = {}
+    for name, make_request in scenarios.items():
+        # Password hashing makes logins orders of magnitude slower than the rest
+        count = max(20, requests_count // 10) if name == "login" else requests_count
+        results[name] = measure(client, make_request, count)
+        print(f"  {name:<24} p50 {results[name]['p50_ms']:>8.2f}ms  p95 {results[name]['p95_ms']:>8.2f}ms  "
+              f"p99 {results[name]['p99_ms']:>8.2f}ms  {results[name]['rps']:>8.1f} req/s", file=sys.stderr)
+    return results
+
+# --- Baselines ---
+
+def compare(current, baseline, tolerance):
+    """Prints p95/throughput changes against a baseline; returns the regressed (size, scenario) pairs."""
+    regressions = []
+    for size, scenarios in current["results"].items():
+        for name, now in scenarios.items():
+            before = baseline.get("results", {}).get(size, {}).get(name)
+            if before is None:
+                continue
+            p95_change = (now["p95_ms"] - before["p95_ms"]) / before["p95_ms"]
+            rps_change = (now["rps"] - before["rps"]) / before["rps"]
+            regressed = p95_change > tolerance or rps_change < -tolerance
+            if regressed:
+                regressions.append((size, name))
+            print(f"{size:>8} {name:<24} p95 {p95_change:+7.1%}  req/s {rps_change:+7.1%}"
+                  f"{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the carpool API in-process at several data sizes.")
+    parser.add_argument("--sizes", default="1k,100k,1M", help="Comma-separated ride counts, e.g. 1k,100k,1M.")
+    parser.add_argument("--requests", type=int, default=500, help="Measured requests per scenario.")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed for data and request mix.")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "carpool-bench"))
+    parser.add_argument("--reseed", action="store_true", help="Recreate the seeded databases.")
+    parser.add_argument("--save", metavar="PATH", help="Write the results as a JSON baseline.")
+    parser.add_argument("--compare", metavar="PATH", help="Compare against a saved baseline.")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed relative regression (default 10%%).")
+    parser.add_argument("--response-cache", choices=("off", "on", "both"), default="off",
+                        help="Run with the response cache off (default), on, or both, reported separately.")
+    parser.add_argument("--single-size", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--output", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    os.makedirs(args.data_dir, exist_ok=True)
+
+    if args.single_size is not None:
+        results = run_size(args.single_size, args.data_dir, args.requests, args.reseed, args.seed)
+        with open(args.output, "w") as f:
+            json.dump(results, f)
+        return 0
+
+    current = {
+        "created_at": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "requests_per_scenario": args.requests,
+        "seed": args.seed,
+        "response_cache": args.response_cache,
+        "results": {},
+    }
+    cache_modes = {"off": [False], "on": [True], "both": [False, True]}[args.response_cache]
+    for size_text in args.sizes.split(","):
+        size = parse_size(size_text)
+        for cached in cache_modes:
+            label = f"{size}+cache" if cached else str(size)
+            print(f"== {size} rides, response cache {'on' if cached else 'off'}", file=sys.stderr)
+            output = os.path.join(args.data_dir, f"results_{label}.json")
+            command = [sys.executable, os.path.abspath(__file__), "--single-size", str(size), "--output", output,
+                       "--requests", str(args.requests), "--seed", str(args.seed), "--data-dir", args.data_dir]
+            # Only the first run of a size reseeds; the cached run reuses its database
+            if args.reseed and not (cached and len(cache_modes) > 1):
+                command.append("--reseed")
+            environment = dict(os.environ, RESPONSE_CACHE_ENABLED="true" if cached else "false")
+            subprocess.run(command, check=True, env=environment)
+            with open(output) as f:
+                current["results"][label] = json.load(f)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(current, f, indent=2)
+        print(f"Baseline written to {args.save}", file=sys.stderr)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(current, baseline, args.tolerance):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,168 @@
+# bench_matcher.py
+"""
+Benchmark for the batch rider matcher (batch_matcher.py).
+
+Builds a synthetic morning commute around Lahore: rides from residential
+areas to campus between 7:00 and 9:30 and riders wanting to get there
+between 7:30 and 9:00. Then:
+  1. times `match` on the arrays alone and compares its total cost with
+     first-come, first-served booking (each rider in turn takes the
+     cheapest ride that still has a seat, as one-at-a-time search does),
+  2. unless --no-db, runs the whole batch (loading, matching, bulk booking)
+     against a temporary SQLite database.
+
+    python bench_matcher.py --riders 10000 --rides 2000
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+def synthetic(riders_count, rides_count, seed):
+    """(rider requests, rides) as plain dicts, deterministic for a seed."""
+    from seed_data import CAMPUS, PLACES
+    rng = random.Random(seed)
+    day = datetime.combine(datetime.utcnow().date() + timedelta(days=1), datetime.min.time())
+    areas = rng.choices(PLACES, [p[3] for p in PLACES], k=rides_count + riders_count)
+
+    def jitter(value, spread):
+        return value + (rng.random() - 0.5) * spread
+
+    rides = [{
+        "origin_lat": jitter(area[1], 0.02), "origin_lng": jitter(area[2], 0.02),
+        "destination_lat": jitter(CAMPUS[1], 0.004), "destination_lng": jitter(CAMPUS[2], 0.004),
+        "departure_time": day + timedelta(hours=7, minutes=rng.randrange(0, 150, 5)),
+        "seats": rng.randint(1, 4),
+    } for area in areas[:rides_count]]
+    requests = [{
+        "pickup_lat": jitter(area[1], 0.03), "pickup_lng": jitter(area[2], 0.03),
+        "dropoff_lat": jitter(CAMPUS[1], 0.004), "dropoff_lng": jitter(CAMPUS[2], 0.004),
+        "time": day + timedelta(hours=7, minutes=30 + rng.randrange(0, 90)),
+        "window_minutes": 30,
+    } for area in areas[rides_count:]]
+    return requests, rides
+
+def as_arrays(requests, rides):
+    import numpy as np
+    from batch_matcher import Riders, Rides, _to_epoch
+    riders = Riders(
+        *(np.array([r[key] for r in requests]) for key in ('pickup_lat', 'pickup_lng', 'dropoff_lat', 'dropoff_lng')),
+        time=np.array([_to_epoch(r["time"]) for r in requests]),
+        window=np.array([r["window_minutes"] * 60.0 for r in requests]),
+    )
+    ride_columns = Rides(
+        *(np.array([r[key] for r in rides]) for key in ('origin_lat', 'origin_lng', 'destination_lat', 'destination_lng')),
+        departure=np.array([_to_epoch(r["departure_time"]) for r in rides]),
+        seats=np.array([r["seats"] for r in rides]),
+    )
+    return riders, ride_columns
+
+def first_come(riders, rides, max_detour_km, km_per_minute):
+    """Each rider in order books the cheapest feasible ride with a free seat: (assigned, total cost)."""
+    import numpy as np
+    from batch_matcher import EARTH_RADIUS_KM
+    km_per_degree = math.pi / 180 * EARTH_RADIUS_KM
+    mean_lat = float(np.mean(np.concatenate([riders.pickup_lat, rides.origin_lat])))
+    x_scale = km_per_degree * math.cos(math.radians(mean_lat))
+    seats = rides.seats.copy()
+    assigned, total = 0, 0.0
+    for rider in range(len(riders.time)):
+        detour = np.hypot((riders.pickup_lng[rider] - rides.origin_lng) * x_scale,
+                          (riders.pickup_lat[rider] - rides.origin_lat) * km_per_degree) + \
+            np.hypot((riders.dropoff_lng[rider] - rides.destination_lng) * x_scale,
+                     (riders.dropoff_lat[rider] - rides.destination_lat) * km_per_degree)
+        gap = np.abs(riders.time[rider] - rides.departure)
+        cost = detour + gap / 60 * km_per_minute
+        cost[(detour > max_detour_km) | (gap > riders.window[rider]) | (seats <= 0)] = np.inf
+        best = int(np.argmin(cost))
+        if np.isfinite(cost[best]):
+            seats[best] -= 1
+            assigned += 1
+            total += float(cost[best])
+    return assigned, total
+
+def bench_arrays(requests, rides, max_detour_km, km_per_minute, candidates):
+    from batch_matcher import match
+    riders, ride_columns = as_arrays(requests, rides)
+    t0 = time.perf_counter()
+    assignments = match(riders, ride_columns, max_detour_km, km_per_minute, candidates)
+    elapsed = time.perf_counter() - t0
+    total = sum(a.detour_km + km_per_minute * a.gap_minutes for a in assignments)
+    print(f"match:       {elapsed * 1000:8.1f} ms  {len(assignments):6d} assigned  total cost {total:10.1f}  "
+          f"mean {total / max(len(assignments), 1):.3f}")
+
+    t0 = time.perf_counter()
+    assigned, total = first_come(riders, ride_columns, max_detour_km, km_per_minute)
+    elapsed = time.perf_counter() - t0
+    print(f"first-come:  {elapsed * 1000:8.1f} ms  {assigned:6d} assigned  total cost {total:10.1f}  "
+          f"mean {total / max(assigned, 1):.3f}")
+
+def bench_database(requests, rides, seed):
+    """Loads the synthetic data into a temporary SQLite database and times run_batch on it."""
+    data_dir = tempfile.mkdtemp(prefix="carpool-match-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(data_dir, 'match.db')}"
+    os.environ.setdefault("RECURRING_MATERIALIZE_INTERVAL_SECONDS", "0")
+    os.environ.setdefault("JOURNEY_ESTIMATOR_REFRESH_SECONDS", "0")
+    from sqlalchemy import func, insert, select
+    from app import app
+    from models import db, User, Ride, Booking
+    from batch_matcher import parse_requests, run_batch
+    from seed_data import _uuid_factory
+
+    new_id = _uuid_factory(random.Random(seed))
+    driver_ids = [new_id() for _ in rides]
+    rider_ids = [new_id() for _ in requests]
+    with app.app_context():
+        db.create_all()
+        db.session.execute(insert(User), [
+            {"id": user_id, "email": f"{role}{i}@fccollege.edu.pk", "full_name": f"{role} {i}",
+             "password_hash": "-", "role": role}
+            for role, ids in (("driver", driver_ids), ("rider", rider_ids)) for i, user_id in enumerate(ids)
+        ])
+        db.session.execute(insert(Ride), [
+            {"id": new_id(), "driver_id": driver_id, "origin_name": "Area", "origin_lat": r["origin_lat"],
+             "origin_lng": r["origin_lng"], "destination_name": "FCC Main Gate", "destination_lat": r["destination_lat"],
+             "destination_lng": r["destination_lng"], "departure_time": r["departure_time"],
+             "total_seats": r["seats"], "available_seats": r["seats"]}
+            for driver_id, r in zip(driver_ids, rides)
+        ])
+        db.session.commit()
+
+        parsed = parse_requests([
+            {**r, "rider_id": rider_id, "time": r["time"].isoformat()} for rider_id, r in zip(rider_ids, requests)
+        ])
+        config = app.config
+        t0 = time.perf_counter()
+        summary = run_batch(parsed, config['BATCH_MATCH_MAX_DETOUR_KM'], config['BATCH_MATCH_KM_PER_MINUTE'],
+                            config['BATCH_MATCH_CANDIDATES'])
+        elapsed = time.perf_counter() - t0
+        bookings = db.session.execute(select(func.count()).select_from(Booking)).scalar()
+        oversold = db.session.execute(select(func.count()).where(Ride.available_seats < 0)).scalar()
+    print(f"run_batch:   {elapsed * 1000:8.1f} ms  {summary['assigned']:6d} booked ({bookings} rows, "
+          f"{oversold} oversold rides), total detour {summary['total_detour_km']} km, "
+          f"mean gap {summary['mean_gap_minutes']} min")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the batch rider matcher.")
+    parser.add_argument("--riders", type=int, default=10_000)
+    parser.add_argument("--rides", type=int, default=2_000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--max-detour-km", type=float, default=3.0)
+    parser.add_argument("--km-per-minute", type=float, default=0.1)
+    parser.add_argument("--candidates", type=int, default=8)
+    parser.add_argument("--no-db", action="store_true", help="Skip the end-to-end run against SQLite.")
+    args = parser.parse_args()
+
+    requests, rides = synthetic(args.riders, args.rides, args.seed)
+    print(f"{len(requests)} riders x {len(rides)} rides ({sum(r['seats'] for r in rides)} seats)")
+    bench_arrays(requests, rides, args.max_detour_km, args.km_per_minute, args.candidates)
+    if not args.no_db:
+        bench_database(requests, rides, args.seed)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,201 @@
+# check_query_plans.py
+"""
+Query-plan regression check.
+
+Seeds a small SQLite database (see seed_data.py), calls every route through
+the Flask test client, captures the SQL each one runs and checks its
+`EXPLAIN QUERY PLAN`. Exits with status 1 when a query reads one of the hot
+tables with a full table scan, so a dropped index or a rewritten filter that
+no longer matches one shows up before it reaches a large database.
+
+    python check_query_plans.py
+    python check_query_plans.py --verbose    # print every plan
+
+Scans that are expected (small tables, deliberate) are listed in ALLOWED_SCANS
+with the reason.
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+CHECK_PASSWORD = "PlanCheck123"
+
+# Tables that grow with usage; a full scan of any of them is a regression
+HOT_TABLES = {
+    "users", "rides", "bookings", "ratings", "user_rating_aggregates",
+    "user_trip_patterns", "token_blocklist", "recurring_rides",
+}
+
+# (route, table) -> why a full scan is fine there
+ALLOWED_SCANS = {
+}
+
+# "SCAN rides", "SCAN r" (alias) or "SCAN rides AS r"; index and virtual table scans are fine
+_SCAN = re.compile(r"^SCAN (?P<name>\w+)(?: AS (?P<alias>\w+))?(?P<rest>.*)$")
+
+def full_scans(plan, aliases):
+    """The hot tables read with a full table scan in an EXPLAIN QUERY PLAN result."""
+    tables = []
+    for _, _, _, detail in plan:
+        match = _SCAN.match(detail)
+        if match is None or "INDEX" in match["rest"] or "VIRTUAL TABLE" in match["rest"]:
+            continue
+        table = aliases.get(match["name"], match["name"])
+        if table in HOT_TABLES:
+            tables.append(table)
+    return tables
+
+def table_aliases(statement):
+    """Maps the aliases in a statement (`rides AS rides_1`) to their tables."""
+    return {alias: table for table, alias in re.findall(r"\b(\w+) AS (\w+)\b", statement)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Fail when a route's query falls back to a full table scan.")
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--rides", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--verbose", action="store_true", help="Print the plan of every captured query.")
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(prefix="carpool-plans-"), "plans.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    os.environ["RECURRING_MATERIALIZE_INTERVAL_SECONDS"] = "0"
+
+    from sqlalchemy import event, func, select
+    from app import app
+    from extensions import limiter
+    from models import db, User, Ride, Booking, Rating
+    from seed_data import generate
+    limiter.enabled = False
+
+    with app.app_context():
+        db.create_all()
+        generate(users=args.users, rides=args.rides, seed=args.seed, password=CHECK_PASSWORD)
+        # ANALYZE gives the planner the same statistics a long-running database would have
+        db.session.execute(db.text("ANALYZE"))
+        db.session.commit()
+
+        driver_id, driver_email = db.session.execute(
+            select(User.id, User.email).join(Ride, Ride.driver_id == User.id)
+            .where(Ride.status == "scheduled").group_by(User.id).having(func.count() >= 2).limit(1)
+        ).one()
+        ride_to_complete, ride_to_cancel = db.session.execute(
+            select(Ride.id).where(Ride.driver_id == driver_id, Ride.status == "scheduled").limit(2)
+        ).scalars().all()
+        rider_id, rider_email, booked_ride_id, booking_id = db.session.execute(
+            select(User.id, User.email, Booking.ride_id, Booking.id).join(Booking, Booking.rider_id == User.id)
+            .join(Ride, Ride.id == Booking.ride_id)
+            .where(Booking.status == "confirmed", Ride.status == "scheduled").limit(1)
+        ).one()
+        open_ride_id = db.session.execute(
+            select(Ride.id).where(Ride.status == "scheduled", Ride.available_seats > 0,
+                                  Ride.driver_id != rider_id, Ride.id != booked_ride_id).limit(1)
+        ).scalar_one()
+        completed_ride_id, completed_driver_id = db.session.execute(
+            select(Ride.id, Ride.driver_id).where(
+                Ride.status == "completed", Ride.driver_id != rider_id,
+                ~select(Rating.id).where(Rating.ride_id == Ride.id, Rating.reviewer_id == rider_id).exists()
+            ).limit(1)
+        ).one()
+
+        captured = []
+        engine = db.engine
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if captured is not None:
+            captured.append((statement, parameters[0] if executemany and parameters else parameters))
+
+    client = app.test_client()
+
+    def login(email):
+        return client.post("/auth/login", json={"email": email, "password": CHECK_PASSWORD})
+
+    def auth(email):
+        return {"Authorization": "Bearer " + login(email).get_json()["access_token"]}
+
+    driver, rider = auth(driver_email), auth(rider_email)
+    tomorrow = (datetime.utcnow() + timedelta(days=1)).replace(hour=9, minute=0, second=0, microsecond=0)
+
+    # The driver-location stream is long-lived; its polling query is the one in driver-location
+    routes = [
+        ("POST /auth/register", lambda: client.post("/auth/register", json={
+            "email": "plans@fccollege.edu.pk", "password": CHECK_PASSWORD, "fullName": "Plan Check"})),
+        ("POST /auth/login", lambda: login(rider_email)),
+        ("POST /auth/refresh", lambda: client.post("/auth/refresh", headers={
+            "Authorization": "Bearer " + login(rider_email).get_json()["refresh_token"]})),
+        ("GET /users/me", lambda: client.get("/users/me", headers=rider)),
+        ("PUT /users/me", lambda: client.put("/users/me", json={"major": "CS"}, headers=rider)),
+        ("PUT /users/me/location", lambda: client.put("/users/me/location", json={"lat": 31.52, "lng": 74.35}, headers=driver)),
+        ("GET /users/<id>", lambda: client.get(f"/users/{driver_id}", headers=rider)),
+        ("GET /users/me/rides (driver)", lambda: client.get("/users/me/rides", headers=driver)),
+        ("GET /users/me/rides (rider)", lambda: client.get("/users/me/rides", headers=rider)),
+        ("GET /rides (text)", lambda: client.get("/rides", query_string={"origin": "Model Town", "destination": "FCCU"})),
+        ("GET /rides (coords)", lambda: client.get("/rides", query_string={
+            "origin_lat": 31.48, "origin_lng": 74.32, "dest_lat": 31.52, "dest_lng": 74.33})),
+        ("GET /rides (time)", lambda: client.get("/rides", query_string={"destination": "FCCU", "time": tomorrow.isoformat()})),
+        ("GET /rides (rating)", lambda: client.get("/rides", query_string={"sort_by": "rating"})),
+        ("GET /rides (en route)", lambda: client.get("/rides", query_string={
+            "match": "corridor", "origin_lat": 31.48, "origin_lng": 74.32, "dest_lat": 31.52, "dest_lng": 74.33,
+            "time": tomorrow.isoformat()})),
+        ("GET /places/autocomplete", lambda: client.get("/places/autocomplete", query_string={"q": "town"})),
+        ("GET /places/autocomplete (prefix)", lambda: client.get("/places/autocomplete", query_string={"q": "fc"})),
+        ("GET /rides/<id>", lambda: client.get(f"/rides/{booked_ride_id}", headers=rider)),
+        ("POST /rides", lambda: client.post("/rides", json={
+            "origin_name": "Model Town", "destination_name": "FCCU", "departure_time": tomorrow.isoformat(),
+            "total_seats": 3, "origin_lat": 31.48, "origin_lng": 74.32, "destination_lat": 31.52,
+            "destination_lng": 74.33}, headers=driver)),
+        ("POST /rides/recurring", lambda: client.post("/rides/recurring", json={
+            "origin_name": "Model Town", "destination_name": "FCCU", "departure_time_of_day": "08:00:00",
+            "days_of_week": "0,1,2,3,4", "total_seats": 3}, headers=driver)),
+        ("POST /rides/<id>/bookings", lambda: client.post(f"/rides/{open_ride_id}/bookings",
+                                                         json={"pickup_point_name": "Gate 2"}, headers=rider)),
+        ("GET /rides/<id>/driver-location", lambda: client.get(f"/rides/{booked_ride_id}/driver-location", headers=rider)),
+        ("GET /rides/<id>/pickup-order", lambda: client.get(f"/rides/{ride_to_complete}/pickup-order", headers=driver)),
+        ("POST /ratings", lambda: client.post("/ratings", json={
+            "ride_id": completed_ride_id, "reviewee_id": completed_driver_id, "rating_value": 4}, headers=rider)),
+        ("GET /ai/recommendations", lambda: client.get("/ai/recommendations", headers=rider)),
+        ("GET /ai/recommendations/patterns", lambda: client.get("/ai/recommendations/patterns", headers=rider)),
+        ("DELETE /bookings/<id>", lambda: client.delete(f"/bookings/{booking_id}", headers=rider)),
+        ("PUT /rides/<id>", lambda: client.put(f"/rides/{ride_to_complete}", json={"status": "completed"}, headers=driver)),
+        ("DELETE /rides/<id>", lambda: client.delete(f"/rides/{ride_to_cancel}", headers=driver)),
+        ("POST /auth/logout", lambda: client.post("/auth/logout", headers=rider)),
+    ]
+
+    failures = []
+    with app.app_context():
+        raw = db.engine.raw_connection()
+        try:
+            cursor = raw.cursor()
+            for route, call in routes:
+                captured = []
+                response = call()
+                statements, captured = captured, None
+                if response.status_code >= 500:
+                    failures.append((route, f"returned {response.status_code}", ""))
+                    continue
+                for statement, parameters in statements:
+                    if not statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE", "INSERT", "WITH")):
+                        continue
+                    plan = cursor.execute("EXPLAIN QUERY PLAN " + statement, parameters or ()).fetchall()
+                    if args.verbose:
+                        print(f"{route}: {' '.join(statement.split())}")
+                        for row in plan:
+                            print(f"    {row[3]}")
+                    for table in full_scans(plan, table_aliases(statement)):
+                        if (route, table) in ALLOWED_SCANS:
+                            continue
+                        failures.append((route, f"full scan of {table}", statement))
+        finally:
+            raw.close()
+
+    print(f"Checked {len(routes)} routes.")
+    for route, problem, statement in failures:
+        print(f"FAIL {route}: {problem}\n    {' '.join(statement.split())}")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,5 @@
 # cleardb.py
+import argparse
 import os
 import sys
 
@@ -7,7 +8,19 @@ sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 # Now we can import the app and db
 from app import app, db
-from models import User # Import User model
+from seed_data import generate_with_report
+
+parser = argparse.ArgumentParser(description="Reset the database and seed the test users.")
+parser.add_argument("--users", type=int, default=0, help="Also generate this many synthetic users.")
+parser.add_argument("--rides", type=int, default=0, help="Also generate this many synthetic rides.")
+parser.add_argument("--seed", type=int, default=42, help="Random seed for the synthetic data.")
+args = parser.parse_args()
+
+# Test accounts: (email, full name, role, password)
+TEST_USERS = [
+    ('driver@test.com', 'Test Driver', 'driver', '123'),
+    ('rider@test.com', 'Test Rider', 'rider', '123'),
+]
 
 print("--- Database Reset Script---")
 
@@ -23,35 +36,13 @@ with app.app_context():
 
     print("\n--- Seeding Test Users ---")
     try:
-        # Create Driver User
-        driver_email = 'driver@test.com'
-        if not User.query.filter_by(email=driver_email).first():
-            test_driver = User(
-                email=driver_email,
-                full_name='Test Driver',
-                role='driver'
-            )
-            test_driver.set_password('123')
-            db.session.add(test_driver)
-            print(f"  - Created user: {driver_email}")
-
-        # Create Rider User
-        rider_email = 'rider@test.com'
-        if not User.query.filter_by(email=rider_email).first():
-            test_rider = User(
-                email=rider_email,
-                full_name='Test Rider',
-                role='rider' # The default is 'rider', but being explicit is good
-            )
-            test_rider.set_password('123')
-            db.session.add(test_rider)
-            print(f"  - Created user: {rider_email}")
-            
-        db.session.commit()
+        generate_with_report(users=args.users, rides=args.rides, seed=args.seed, test_users=TEST_USERS)
+        for email, *_ in TEST_USERS:
+            print(f"  - Created user: {email}")
         print("Test users seeded successfully.")
     except Exception as e:
         db.session.rollback()
         print(f"An error occurred while seeding users: {e}")
 
 
-print("\n✅ Database has been successfully reset and seeded.")
\ No newline at end of file
+print("\n✅ Database has been successfully reset and seeded.")
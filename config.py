@@ -8,6 +8,96 @@ class Config:
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     RATELIMIT_ENABLED = False
 
+    # List endpoints return pages of DEFAULT_PAGE_SIZE rows; `limit` is capped at MAX_PAGE_SIZE
+    DEFAULT_PAGE_SIZE = int(os.environ.get('DEFAULT_PAGE_SIZE', 20))
+    MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 100))
+
+    # Driver location pings: 'write_behind' buffers them in memory and flushes every
+    # LOCATION_FLUSH_INTERVAL_SECONDS; 'write_through' commits each ping
+    LOCATION_DURABILITY = os.environ.get('LOCATION_DURABILITY', 'write_behind')
+    LOCATION_FLUSH_INTERVAL_SECONDS = float(os.environ.get('LOCATION_FLUSH_INTERVAL_SECONDS', 5))
+    # Live location stream: keep-alive interval for idle connections and maximum
+    # lifetime before the client has to reconnect (and re-authorize)
+    LOCATION_STREAM_HEARTBEAT_SECONDS = float(os.environ.get('LOCATION_STREAM_HEARTBEAT_SECONDS', 15))
+    LOCATION_STREAM_MAX_SECONDS = float(os.environ.get('LOCATION_STREAM_MAX_SECONDS', 900))
+
+    # Optional in-process NumPy snapshot that serves GET /rides (requires numpy)
+    SEARCH_SNAPSHOT_ENABLED = os.environ.get('SEARCH_SNAPSHOT_ENABLED', 'false').lower() == 'true'
+    # Seconds between background full rebuilds of the snapshot (bounds how stale it gets)
+    SEARCH_SNAPSHOT_MAX_STALENESS_SECONDS = int(os.environ.get('SEARCH_SNAPSHOT_MAX_STALENESS_SECONDS', 30))
+
+    # En-route search (GET /rides?match=corridor, requires numpy): default corridor
+    # width around the ride's route, and how many decoded routes are kept in memory
+    # (16 bytes per route point)
+    ROUTE_CORRIDOR_KM = float(os.environ.get('ROUTE_CORRIDOR_KM', 1.0))
+    # Largest corridor_km a search may ask for; wider ones would decode every route
+    ROUTE_CORRIDOR_MAX_KM = float(os.environ.get('ROUTE_CORRIDOR_MAX_KM', 5.0))
+    ROUTE_GEOMETRY_CACHE_MAX_ENTRIES = int(os.environ.get('ROUTE_GEOMETRY_CACHE_MAX_ENTRIES', 100000))
+
+    # Computed pickup orders (GET /rides/<id>/pickup-order) kept per ride, until its bookings change
+    PICKUP_ORDER_CACHE_MAX_ENTRIES = int(os.environ.get('PICKUP_ORDER_CACHE_MAX_ENTRIES', 10000))
+
+    # Batch rider matching (POST /admin/batch-match, `flask batch_match`; requires numpy):
+    # pairs with a larger detour are infeasible, each minute between departure and the
+    # rider's preferred time costs as much as this many km of detour, and each rider
+    # keeps this many cheapest rides as candidates
+    BATCH_MATCH_MAX_DETOUR_KM = float(os.environ.get('BATCH_MATCH_MAX_DETOUR_KM', 3.0))
+    BATCH_MATCH_KM_PER_MINUTE = float(os.environ.get('BATCH_MATCH_KM_PER_MINUTE', 0.1))
+    BATCH_MATCH_CANDIDATES = int(os.environ.get('BATCH_MATCH_CANDIDATES', 8))
+
+    # Journey estimates (GET /ai/estimate-journey) come from completed rides, summed per
+    # origin/destination grid cell pair; the in-memory tables pick up newly completed
+    # rides this often (0 loads them once)
+    JOURNEY_ESTIMATOR_REFRESH_SECONDS = int(os.environ.get('JOURNEY_ESTIMATOR_REFRESH_SECONDS', 300))
+    JOURNEY_GRID_CELL_DEGREES = float(os.environ.get('JOURNEY_GRID_CELL_DEGREES', 0.01))
+    # Cell pairs with fewer rides fall back to a coarser grid, then to the overall figures
+    JOURNEY_MIN_SAMPLES = int(os.environ.get('JOURNEY_MIN_SAMPLES', 3))
+    # Used until there is enough history: road distance per great-circle km, and speed
+    JOURNEY_DEFAULT_DETOUR_FACTOR = float(os.environ.get('JOURNEY_DEFAULT_DETOUR_FACTOR', 1.3))
+    JOURNEY_DEFAULT_SPEED_KMH = float(os.environ.get('JOURNEY_DEFAULT_SPEED_KMH', 25))
+    # Great-circle km of the journey assumed for place names that can't be resolved yet
+    JOURNEY_DEFAULT_DISTANCE_KM = float(os.environ.get('JOURNEY_DEFAULT_DISTANCE_KM', 8))
+
+    # Per-user cache for GET /recommendations/patterns; entries are invalidated on
+    # relevant writes in this process, the TTL bounds staleness across processes
+    RECOMMENDATION_CACHE_TTL_SECONDS = int(os.environ.get('RECOMMENDATION_CACHE_TTL_SECONDS', 300))
+    RECOMMENDATION_CACHE_MAX_ENTRIES = int(os.environ.get('RECOMMENDATION_CACHE_MAX_ENTRIES', 10000))
+
+    # Cache for the anonymous GET /rides and GET /users/<id> responses; entries are
+    # invalidated on relevant writes in this process, the TTL bounds the rest
+    RESPONSE_CACHE_ENABLED = os.environ.get('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+    RESPONSE_CACHE_TTL_SECONDS = float(os.environ.get('RESPONSE_CACHE_TTL_SECONDS', 10))
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 5000))
+
+    # Recurring templates are materialized into rides up to this many days ahead;
+    # later occurrences are served virtually by search and created when booked
+    RECURRING_HORIZON_DAYS = int(os.environ.get('RECURRING_HORIZON_DAYS', 1))
+    # How often the in-process materializer runs; 0 disables it (use the CLI command from cron)
+    RECURRING_MATERIALIZE_INTERVAL_SECONDS = int(os.environ.get('RECURRING_MATERIALIZE_INTERVAL_SECONDS', 3600))
+    RECURRING_MATERIALIZE_BATCH_SIZE = int(os.environ.get('RECURRING_MATERIALIZE_BATCH_SIZE', 500))
+    # Ride search also lists template occurrences (without a ride row) up to this many days ahead
+    RECURRING_SEARCH_HORIZON_DAYS = int(os.environ.get('RECURRING_SEARCH_HORIZON_DAYS', 90))
+
+    # Per-endpoint latency and SQL metrics, served at /metrics in Prometheus format
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+    # Requests slower than this are logged with their SQL statements; 0 disables the log
+    SLOW_REQUEST_THRESHOLD_MS = float(os.environ.get('SLOW_REQUEST_THRESHOLD_MS', 500))
+    SLOW_REQUEST_MAX_STATEMENTS = int(os.environ.get('SLOW_REQUEST_MAX_STATEMENTS', 50))
+
+    # Shared secret for the /admin endpoints (sent as X-Admin-Token); unset disables them
+    ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+    # Sampling profiler for single requests: a request is profiled when it sends
+    # PROFILER_HEADER with the admin token, or at random with PROFILER_SAMPLE_RATE.
+    # Disabled by default; when off it adds no per-request work.
+    PROFILER_ENABLED = os.environ.get('PROFILER_ENABLED', 'false').lower() == 'true'
+    PROFILER_HEADER = os.environ.get('PROFILER_HEADER', 'X-Profile-Request')
+    PROFILER_SAMPLE_RATE = float(os.environ.get('PROFILER_SAMPLE_RATE', 0))
+    PROFILER_INTERVAL_MS = float(os.environ.get('PROFILER_INTERVAL_MS', 5))
+    # Profiles kept in memory for GET /admin/profiles; also written here as collapsed stacks if set
+    PROFILER_MAX_PROFILES = int(os.environ.get('PROFILER_MAX_PROFILES', 20))
+    PROFILER_OUTPUT_DIR = os.environ.get('PROFILER_OUTPUT_DIR')
+
     # Flask-JWT-Extended settings
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'another-super-secret-key')
     # Use shorter-lived access tokens for better security
@@ -16,4 +106,8 @@ class Config:
     JWT_REFRESH_TOKEN_EXPIRES = timedelta(days=30)
     # Enable blocklisting to allow for token revocation (logout)
     JWT_BLOCKLIST_ENABLED = True
-    JWT_BLOCKLIST_TOKEN_CHECKS = ['access', 'refresh']
\ No newline at end of file
+    JWT_BLOCKLIST_TOKEN_CHECKS = ['access', 'refresh']
+    # Revocations are served from memory and re-read from the table at most this often
+    JWT_BLOCKLIST_REFRESH_SECONDS = int(os.environ.get('JWT_BLOCKLIST_REFRESH_SECONDS', 5))
+    # How often a background thread purges expired rows from the blocklist table (0: only `flask purge_token_blocklist`)
+    JWT_BLOCKLIST_PURGE_SECONDS = int(os.environ.get('JWT_BLOCKLIST_PURGE_SECONDS', 3600))
\ No newline at end of file
@@ -0,0 +1,15 @@
+# db_utils.py
+from sqlalchemy.dialects import postgresql, sqlite
+from models import db
+
+def upsert_insert(table):
+    """
+    An INSERT construct for the bound database that supports
+    `.on_conflict_do_update()` / `.on_conflict_do_nothing()` (SQLite or PostgreSQL).
+    """
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert(table)
+    if dialect == 'sqlite':
+        return sqlite.insert(table)
+    raise NotImplementedError(f"Upserts are not supported on {dialect}")
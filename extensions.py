@@ -1,10 +1,33 @@
 # extensions.py
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+from search_snapshot import RideSearchSnapshot
+from route_corridor import RouteGeometryCache
+from pickup_order import PickupOrderCache
+from token_revocation import RevocationCache
+from location_buffer import LocationBuffer
+from recommendation_cache import RecommendationCache
+from response_cache import ResponseCache
+from recurring_materializer import RecurringMaterializer
+from journey_estimator import JourneyEstimator
+from request_metrics import RequestMetrics
+from request_profiler import RequestProfiler
 
 # Initialize extensions here, but don't bind them to the app yet.
 # The binding will happen in the main app.py file.
 limiter = Limiter(
     key_func=get_remote_address,
     default_limits=["200 per day", "50 per hour"]
-)
\ No newline at end of file
+)
+
+ride_snapshot = RideSearchSnapshot()
+route_geometry_cache = RouteGeometryCache()
+pickup_order_cache = PickupOrderCache()
+revocation_cache = RevocationCache()
+location_buffer = LocationBuffer()
+recommendation_cache = RecommendationCache()
+response_cache = ResponseCache()
+recurring_materializer = RecurringMaterializer()
+journey_estimator = JourneyEstimator()
+request_metrics = RequestMetrics()
+request_profiler = RequestProfiler()
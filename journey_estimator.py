@@ -0,0 +1,274 @@
+# journey_estimator.py
+"""
+Journey distance and duration estimates learned from completed rides.
+
+Every completed ride with coordinates and timings is a sample: its
+great-circle distance, its duration (started_at, or the departure time,
+to completed_at) and, when it has a `route_polyline`, its road distance.
+Samples are summed per (origin cell, destination cell) pair on a fine
+grid (JOURNEY_GRID_CELL_DEGREES) and a coarse one (5x larger), and overall.
+An estimate scales the query's great-circle distance by the best-matching
+pair's road/great-circle ratio and seconds per great-circle km: the fine
+pair, else the coarse pair, else the overall figures, else the configured
+defaults. Place names resolve to the average position rides used for them.
+
+The tables live in memory and are only read by requests, so an estimate is
+a handful of dict lookups. `JourneyEstimator` loads them in a background
+thread and then adds the rides completed since its last pass every
+JOURNEY_ESTIMATOR_REFRESH_SECONDS; each worker process keeps its own copy.
+"""
+import logging
+import math
+import threading
+import time
+from datetime import timedelta
+from sqlalchemy import and_, or_, select
+from models import db, Ride
+from route_corridor import InvalidPolyline, decode_polyline
+from spatial_index import great_circle_km
+
+logger = logging.getLogger(__name__)
+
+# The coarse grid's cells are this many fine cells wide
+COARSE_FACTOR = 5
+
+# Samples outside these bounds are data errors (rides completed long after,
+# or marked completed right away) and are skipped
+MIN_DURATION_SECONDS = 60
+MAX_DURATION_SECONDS = 4 * 3600
+MAX_SPEED_KMH = 120
+MIN_GREAT_CIRCLE_KM = 0.1
+
+# completed_at is set before the ride's transaction commits, so a ride can
+# become visible behind the newest one already added; each refresh re-reads
+# this much history and skips the rides it has seen.
+_COMPLETION_OVERLAP = timedelta(minutes=5)
+
+def _polyline_km(polyline):
+    """Length of an encoded polyline, or None if it cannot be decoded."""
+    try:
+        points = decode_polyline(polyline)
+    except InvalidPolyline:
+        return None
+    return sum(
+        great_circle_km(points[i], points[i + 1], points[i + 2], points[i + 3])
+        for i in range(0, len(points) - 2, 2)
+    )
+
+class _Stats:
+    """Sums over the samples of one cell pair; replaced, never mutated, so readers need no lock."""
+    __slots__ = ('samples', 'great_circle_km', 'seconds', 'routed_great_circle_km', 'road_km')
+
+    def __init__(self, samples=0, great_circle_km=0.0, seconds=0.0, routed_great_circle_km=0.0, road_km=0.0):
+        self.samples = samples
+        self.great_circle_km = great_circle_km
+        self.seconds = seconds
+        # Over the samples with a polyline only
+        self.routed_great_circle_km = routed_great_circle_km
+        self.road_km = road_km
+
+    def plus(self, great_circle_km, seconds, road_km):
+        routed = road_km is not None
+        return _Stats(
+            self.samples + 1, self.great_circle_km + great_circle_km, self.seconds + seconds,
+            self.routed_great_circle_km + (great_circle_km if routed else 0.0),
+            self.road_km + (road_km if routed else 0.0)
+        )
+
+class JourneyEstimator:
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._worker = None
+        self._app = None
+        self._fine = {}  # ((lat cell, lng cell), (lat cell, lng cell)) -> _Stats
+        self._coarse = {}
+        self._overall = _Stats()
+        self._places = {}  # lowercase name -> (lat sum, lng sum, count)
+        self._watermark = None  # newest completed_at seen
+        self._recent = {}  # ride id -> completed_at, for the rides seen within the overlap
+        self.interval = 300
+        self.cell_degrees = 0.01
+        self.min_samples = 3
+        self.batch_size = 5000
+        self.default_detour_factor = 1.3
+        self.default_speed_kmh = 25.0
+        self.default_distance_km = 8.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self._app = app
+        self.interval = app.config.get('JOURNEY_ESTIMATOR_REFRESH_SECONDS', 300)
+        self.cell_degrees = app.config.get('JOURNEY_GRID_CELL_DEGREES', 0.01)
+        self.min_samples = app.config.get('JOURNEY_MIN_SAMPLES', 3)
+        self.default_detour_factor = app.config.get('JOURNEY_DEFAULT_DETOUR_FACTOR', 1.3)
+        self.default_speed_kmh = app.config.get('JOURNEY_DEFAULT_SPEED_KMH', 25.0)
+        self.default_distance_km = app.config.get('JOURNEY_DEFAULT_DISTANCE_KM', 8.0)
+        # Started lazily so CLI commands and scripts don't spawn the worker
+        app.before_request(self._ensure_worker)
+
+    # --- Estimates ---
+
+    def place(self, name):
+        """
+        The average (lat, lng) rides used for a place name, or None. A name
+        with no exact match (typed as you go) resolves to the most used
+        place starting with it, else containing it.
+        """
+        key = name.strip().lower()
+        entry = self._places.get(key)
+        if entry is None and key:
+            # A snapshot: the refresh thread adds places concurrently
+            places = list(self._places.items())
+            matches = [item for item in places if item[0].startswith(key)] or \
+                [item for item in places if key in item[0]]
+            if matches:
+                entry = max(matches, key=lambda item: (item[1][2], item[0]))[1]
+        if entry is None:
+            return None
+        lat_sum, lng_sum, count = entry
+        return lat_sum / count, lng_sum / count
+
+    def _cells(self, lat, lng, size):
+        return math.floor(lat / size), math.floor(lng / size)
+
+    def estimate(self, origin, destination):
+        """
+        (distance km, duration minutes, samples) between two (lat, lng)
+        points; `samples` is the number of rides the figures come from, 0 for
+        the configured defaults.
+        """
+        distance = great_circle_km(*origin, *destination)
+        stats = None
+        for table, size in ((self._fine, self.cell_degrees), (self._coarse, self.cell_degrees * COARSE_FACTOR)):
+            candidate = table.get((self._cells(*origin, size), self._cells(*destination, size)))
+            if candidate is not None and candidate.samples >= self.min_samples:
+                stats = candidate
+                break
+        overall = self._overall
+        if stats is None and overall.samples >= self.min_samples:
+            stats = overall
+
+        if stats is None:
+            road_km = distance * self.default_detour_factor
+            return road_km, road_km / self.default_speed_kmh * 60, 0
+        return (*self._scaled(distance, stats), stats.samples)
+
+    def typical(self):
+        """
+        (distance km, duration minutes) of an average recorded ride, else of
+        the configured default journey; for places that can't be resolved.
+        """
+        overall = self._overall
+        if overall.samples < self.min_samples:
+            road_km = self.default_distance_km * self.default_detour_factor
+            return road_km, road_km / self.default_speed_kmh * 60
+        return self._scaled(overall.great_circle_km / overall.samples, overall)
+
+    def _scaled(self, distance, stats):
+        """Road km and minutes for a great-circle `distance`, at the detour and pace of `stats`."""
+        overall = self._overall
+        if stats.routed_great_circle_km > 0:
+            detour_factor = stats.road_km / stats.routed_great_circle_km
+        elif overall.routed_great_circle_km > 0:
+            detour_factor = overall.road_km / overall.routed_great_circle_km
+        else:
+            detour_factor = self.default_detour_factor
+        seconds_per_km = stats.seconds / stats.great_circle_km
+        return distance * detour_factor, distance * seconds_per_km / 60
+
+    # --- Loading ---
+
+    def refresh(self, batch_size=None):
+        """
+        Adds the rides completed since the last refresh to the tables; the
+        first call loads them all. Returns the number of samples added.
+        """
+        batch_size = batch_size or self.batch_size
+        since = None if self._watermark is None else self._watermark - _COMPLETION_OVERLAP
+        added = 0
+        after = None
+        while True:
+            query = select(
+                Ride.id, Ride.origin_name, Ride.origin_lat, Ride.origin_lng,
+                Ride.destination_name, Ride.destination_lat, Ride.destination_lng,
+                Ride.departure_time, Ride.started_at, Ride.completed_at, Ride.route_polyline
+            ).where(Ride.status == 'completed', Ride.completed_at != None)
+            if since is not None:
+                query = query.where(Ride.completed_at >= since)
+            if after is not None:
+                completed_at, ride_id = after
+                query = query.where(or_(
+                    Ride.completed_at > completed_at,
+                    and_(Ride.completed_at == completed_at, Ride.id > ride_id)
+                ))
+            rows = db.session.execute(query.order_by(Ride.completed_at, Ride.id).limit(batch_size)).all()
+            for row in rows:
+                if row.id in self._recent:
+                    continue
+                added += self._add(row)
+                self._recent[row.id] = row.completed_at
+                self._watermark = max(self._watermark or row.completed_at, row.completed_at)
+            db.session.rollback()
+            if rows:
+                after = (rows[-1].completed_at, rows[-1].id)
+            if len(rows) < batch_size:
+                break
+        # Rides behind the next refresh's window can't be read again
+        if self._watermark is not None:
+            cutoff = self._watermark - _COMPLETION_OVERLAP
+            self._recent = {ride_id: at for ride_id, at in self._recent.items() if at >= cutoff}
+        return added
+
+    def _add(self, row):
+        if None in (row.origin_lat, row.origin_lng, row.destination_lat, row.destination_lng):
+            return 0
+        self._add_place(row.origin_name, row.origin_lat, row.origin_lng)
+        self._add_place(row.destination_name, row.destination_lat, row.destination_lng)
+
+        distance = great_circle_km(row.origin_lat, row.origin_lng, row.destination_lat, row.destination_lng)
+        seconds = (row.completed_at - (row.started_at or row.departure_time)).total_seconds()
+        if distance < MIN_GREAT_CIRCLE_KM or not MIN_DURATION_SECONDS <= seconds <= MAX_DURATION_SECONDS \
+                or distance / seconds * 3600 > MAX_SPEED_KMH:
+            return 0
+        road_km = _polyline_km(row.route_polyline) if row.route_polyline else None
+        if road_km is not None and road_km < distance:
+            road_km = None
+
+        origin, destination = (row.origin_lat, row.origin_lng), (row.destination_lat, row.destination_lng)
+        for table, size in ((self._fine, self.cell_degrees), (self._coarse, self.cell_degrees * COARSE_FACTOR)):
+            key = (self._cells(*origin, size), self._cells(*destination, size))
+            table[key] = table.get(key, _Stats()).plus(distance, seconds, road_km)
+        self._overall = self._overall.plus(distance, seconds, road_km)
+        return 1
+
+    def _add_place(self, name, lat, lng):
+        key = name.strip().lower()
+        lat_sum, lng_sum, count = self._places.get(key, (0.0, 0.0, 0))
+        self._places[key] = (lat_sum + lat, lng_sum + lng, count + 1)
+
+    # --- Background refresh ---
+
+    def run_once(self):
+        with self._app.app_context():
+            try:
+                added = self.refresh()
+                logger.debug("Journey estimator added %d samples", added)
+            except Exception:
+                db.session.rollback()
+                logger.exception("Journey estimator refresh failed; will retry")
+
+    def _ensure_worker(self):
+        if self._worker is not None:
+            return
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name='journey-estimator', daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        self.run_once()
+        # With no interval the tables are loaded once
+        while self.interval > 0:
+            time.sleep(self.interval)
+            self.run_once()
@@ -0,0 +1,217 @@
+# location_buffer.py
+"""
+Write-behind store for driver GPS pings.
+
+`update_my_location` writes the latest position into memory and a background
+flusher persists the coalesced positions to `users` in one batched transaction
+every LOCATION_FLUSH_INTERVAL_SECONDS, so frequent pings no longer compete with
+booking writes for SQLite's single writer lock. Readers in this process see
+positions immediately; other worker processes see them after the next flush.
+A position is only served from memory until it is flushed: then it is evicted
+and readers go back to `users`, which also has any newer position another
+worker flushed, so memory holds at most the pending pings.
+
+LOCATION_DURABILITY = 'write_through' restores the old behaviour of committing
+every ping. Pending positions are flushed on interpreter shutdown.
+
+The buffer also fans updates out to live listeners (the driver location
+stream): each driver has a condition variable that every listener waits on, so
+one ping wakes all of that driver's riders without any per-rider DB read. A
+listener can also follow a ride, and is then woken by its `ride_changed`
+signal. Only pings and ride changes seen by this process are streamed.
+"""
+import atexit
+import logging
+import threading
+from sqlalchemy import bindparam, or_, update
+from models import db, User
+from signals import ride_changed
+
+logger = logging.getLogger(__name__)
+
+# Several workers flush on their own, so only a newer position may replace the stored one
+_users = User.__table__
+_FLUSH_STATEMENT = update(_users).where(
+    _users.c.id == bindparam('b_user_id'),
+    or_(_users.c.last_location_update.is_(None), _users.c.last_location_update < bindparam('b_at'))
+).values(
+    current_lat=bindparam('b_lat'),
+    current_lng=bindparam('b_lng'),
+    last_location_update=bindparam('b_at'),
+)
+
+class _Channel:
+    """Listeners waiting for one driver's next position."""
+    def __init__(self, lock):
+        self.changed = threading.Condition(lock)
+        self.listeners = set()
+
+class _Listener:
+    """
+    A live listener on one driver's position, registered until `close()`.
+    It starts from the position as of its creation, so pings arriving before
+    the first `wait` are still delivered. With a `ride_id`, changes to that
+    ride wake it as well.
+    """
+    def __init__(self, buffer, user_id, ride_id=None):
+        self._buffer = buffer
+        self.user_id = user_id
+        self.ride_id = ride_id
+        self.ride_changed = False
+        with buffer._lock:
+            self._seen = buffer._sequence.get(user_id, 0)
+            self._channel = buffer._channels.get(user_id)
+            if self._channel is None:
+                self._channel = buffer._channels[user_id] = _Channel(buffer._lock)
+            self._channel.listeners.add(self)
+
+    def wait(self, timeout):
+        """
+        Blocks until a newer position arrives, the ride changes, or `timeout`
+        seconds pass. Returns (position, ride_changed); the position is the
+        new (lat, lng, at), or None if there is none.
+        """
+        buffer = self._buffer
+        with buffer._lock:
+            self._channel.changed.wait_for(
+                lambda: self.ride_changed or buffer._sequence.get(self.user_id, 0) > self._seen, timeout
+            )
+            ride_changed, self.ride_changed = self.ride_changed, False
+            sequence = buffer._sequence.get(self.user_id, 0)
+            if sequence <= self._seen:
+                return None, ride_changed
+            self._seen = sequence
+            return buffer._latest.get(self.user_id), ride_changed
+
+    def close(self):
+        buffer = self._buffer
+        with buffer._lock:
+            self._channel.listeners.discard(self)
+            if not self._channel.listeners and buffer._channels.get(self.user_id) is self._channel:
+                del buffer._channels[self.user_id]
+                buffer._forget(self.user_id)
+
+class LocationBuffer:
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._latest = {}  # user id -> (lat, lng, at)
+        self._dirty = set()
+        self._flushing = set()  # taken out of _dirty by a flush still writing them
+        self._updates = 0
+        self._sequence = {}  # user id -> value of _updates at the user's last update
+        self._channels = {}  # user id -> _Channel, while someone is listening
+        self._stop = threading.Event()
+        self._flusher = None
+        self._app = None
+        self.write_behind = True
+        self.flush_interval = 5
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self._app = app
+        self.write_behind = app.config.get('LOCATION_DURABILITY', 'write_behind') == 'write_behind'
+        self.flush_interval = app.config.get('LOCATION_FLUSH_INTERVAL_SECONDS', 5)
+        if self.write_behind:
+            atexit.register(self.shutdown)
+        ride_changed.connect(self._on_ride_changed, sender=app, weak=False)
+
+    def _on_ride_changed(self, sender, ride_id=None, **extra):
+        with self._lock:
+            for channel in self._channels.values():
+                woken = [listener for listener in channel.listeners if listener.ride_id == ride_id]
+                for listener in woken:
+                    listener.ride_changed = True
+                if woken:
+                    channel.changed.notify_all()
+
+    def update(self, user_id, lat, lng, at):
+        """Records a position; persisted now in write-through mode, else on the next flush."""
+        with self._lock:
+            self._latest[user_id] = (lat, lng, at)
+            # Increasing across users, so it keeps increasing after an eviction
+            self._updates += 1
+            self._sequence[user_id] = self._updates
+            if self.write_behind:
+                self._dirty.add(user_id)
+            channel = self._channels.get(user_id)
+            if channel is not None:
+                channel.changed.notify_all()
+        if not self.write_behind:
+            self._write([(user_id, lat, lng, at)])
+            self._evict([user_id])
+            return
+        self._ensure_flusher()
+
+    def get(self, user_id):
+        """
+        The (lat, lng, at) this process received for a user and has not
+        persisted yet, or None: read `users` then.
+        """
+        with self._lock:
+            if user_id in self._dirty or user_id in self._flushing:
+                return self._latest.get(user_id)
+            return None
+
+    def listen(self, user_id, ride_id=None):
+        """A `_Listener` for a user's positions (and `ride_id`'s changes); close it when done."""
+        return _Listener(self, user_id, ride_id)
+
+    def flush(self):
+        """Persists every pending position in one transaction."""
+        with self._lock:
+            pending = [(user_id, *self._latest[user_id]) for user_id in self._dirty]
+            self._flushing, self._dirty = self._dirty, set()
+        if not pending:
+            return
+        user_ids = [user_id for user_id, *_ in pending]
+        try:
+            with self._app.app_context():
+                self._write(pending)
+        except Exception:
+            logger.exception("Failed to flush %d driver locations; will retry", len(pending))
+            with self._lock:
+                self._dirty.update(user_ids)
+                self._flushing = set()
+            return
+        with self._lock:
+            self._flushing = set()
+        self._evict(user_ids)
+
+    def shutdown(self):
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join(timeout=self.flush_interval)
+        self.flush()
+
+    def _write(self, positions):
+        with db.engine.begin() as conn:
+            conn.execute(_FLUSH_STATEMENT, [
+                {"b_user_id": user_id, "b_lat": lat, "b_lng": lng, "b_at": at}
+                for user_id, lat, lng, at in positions
+            ])
+
+    def _evict(self, user_ids):
+        """Forgets persisted positions, except those updated since or with listeners waiting."""
+        with self._lock:
+            for user_id in user_ids:
+                if user_id not in self._channels:
+                    self._forget(user_id)
+
+    def _forget(self, user_id):
+        """Drops a user's position unless it is still to be persisted; called with the lock held."""
+        if user_id not in self._dirty and user_id not in self._flushing:
+            self._latest.pop(user_id, None)
+            self._sequence.pop(user_id, None)
+
+    def _ensure_flusher(self):
+        if self._flusher is not None:
+            return
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._run, name='location-flusher', daemon=True)
+                self._flusher.start()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
@@ -0,0 +1,65 @@
+# lru.py
+"""
+Bounded least-recently-used map with hit/miss counters, shared by the
+in-process caches (route geometry, pickup order, responses) so they count
+and export the same way.
+
+Not thread-safe on its own: each cache calls it with its own lock held.
+"""
+from collections import OrderedDict
+
+_MISSING = object()
+
+class LRUCache:
+    def __init__(self, metric_name, max_entries):
+        self.metric_name = metric_name  # e.g. 'response_cache' -> carpool_response_cache_*
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # least recently used first
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None, fresh=None):
+        """
+        The value for `key`, marked most recently used, or `default`. A value
+        for which `fresh(value)` is false counts as a miss but stays stored;
+        the caller replaces or removes it.
+        """
+        value = self._entries.get(key, _MISSING)
+        if value is _MISSING or (fresh is not None and not fresh(value)):
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Stores `value` as most recently used; returns the (key, value) pairs evicted to make room."""
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        evicted = []
+        while len(self._entries) > self.max_entries:
+            evicted.append(self._entries.popitem(last=False))
+        return evicted
+
+    def pop(self, key, default=None):
+        return self._entries.pop(key, default)
+
+    def clear(self):
+        self._entries.clear()
+
+    def metrics(self, **counters):
+        """
+        Hit/miss counters, then any extra `counters` (name=value), and the
+        entry count as Prometheus text lines.
+        """
+        prefix = f"carpool_{self.metric_name}"
+        lines = []
+        for name, value in (('hits', self.hits), ('misses', self.misses), *counters.items()):
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {value}")
+        lines.append(f"# TYPE {prefix}_entries gauge")
+        lines.append(f"{prefix}_entries {len(self._entries)}")
+        return lines
@@ -0,0 +1,40 @@
+"""Composite indexes for the route queries
+
+Databases created with db.create_all() before these indexes were added to
+models.py get them from `flask db upgrade`; newer ones already have them,
+hence if_not_exists.
+
+Revision ID: 3f2a9c1d7b64
+Revises:
+Create Date: 2026-10-18 06:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '3f2a9c1d7b64'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+INDEXES = [
+    ('ix_rides_route_status_departure', 'rides', ['origin_name', 'destination_name', 'status', 'departure_time'], False),
+    ('ix_rides_recurring_departure', 'rides', ['recurring_id', 'departure_time'], True),
+    ('ix_rides_status_departure', 'rides', ['status', 'departure_time'], False),
+    ('ix_rides_driver_departure', 'rides', ['driver_id', 'departure_time'], False),
+    ('ix_bookings_rider_status', 'bookings', ['rider_id', 'status'], False),
+    ('ix_ratings_ride_reviewer', 'ratings', ['ride_id', 'reviewer_id'], False),
+    ('ix_user_trip_patterns_user_count', 'user_trip_patterns', ['user_id', 'trip_count'], False),
+]
+
+
+def upgrade():
+    for name, table, columns, unique in INDEXES:
+        op.create_index(name, table, columns, unique=unique, if_not_exists=True)
+
+
+def downgrade():
+    for name, table, _, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table, if_exists=True)
@@ -0,0 +1,23 @@
+"""Index token_blocklist.created_at for the revocation cache's polling
+
+Revision ID: 5d8f2b6e0a13
+Revises: c4e7a1f9b3d2
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '5d8f2b6e0a13'
+down_revision = 'c4e7a1f9b3d2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_token_blocklist_created_at', 'token_blocklist', ['created_at'], if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index('ix_token_blocklist_created_at', table_name='token_blocklist', if_exists=True)
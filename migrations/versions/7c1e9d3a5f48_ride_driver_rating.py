@@ -0,0 +1,40 @@
+"""Copy drivers' ratings onto active rides for rating-ordered ride search
+
+Adds rides.driver_rating and ix_rides_driver_rating. The triggers that keep
+the copy in sync are not part of the schema migration: run
+`flask rebuild_driver_rating_index` afterwards, which also fills the
+column (until then rating search joins the aggregates as before).
+
+Revision ID: 7c1e9d3a5f48
+Revises: e2b7d4a9c615
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c1e9d3a5f48'
+down_revision = 'e2b7d4a9c615'
+branch_labels = None
+depends_on = None
+
+
+TRIGGERS = ['rides_driver_rating_ai', 'rides_driver_rating_au',
+            'aggregates_driver_rating_ai', 'aggregates_driver_rating_au', 'aggregates_driver_rating_ad']
+
+
+def upgrade():
+    if 'driver_rating' not in {column['name'] for column in sa.inspect(op.get_bind()).get_columns('rides')}:
+        op.add_column('rides', sa.Column('driver_rating', sa.Float(), nullable=True))
+    op.create_index('ix_rides_driver_rating', 'rides', [sa.text('driver_rating DESC'), 'id'], if_not_exists=True)
+
+
+def downgrade():
+    # The triggers name the column
+    for name in TRIGGERS:
+        op.execute(f"DROP TRIGGER IF EXISTS {name}")
+    op.drop_index('ix_rides_driver_rating', table_name='rides', if_exists=True)
+    # Plain ALTER TABLE (SQLite 3.35+); a batch rebuild would drop the search triggers
+    op.drop_column('rides', 'driver_rating')
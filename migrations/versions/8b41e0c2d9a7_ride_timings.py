@@ -0,0 +1,37 @@
+"""Ride start/completion timestamps for the journey estimator
+
+Databases created with db.create_all() after these columns were added to
+models.py already have them, hence the checks.
+
+Revision ID: 8b41e0c2d9a7
+Revises: 3f2a9c1d7b64
+Create Date: 2026-10-18 07:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b41e0c2d9a7'
+down_revision = '3f2a9c1d7b64'
+branch_labels = None
+depends_on = None
+
+
+COLUMNS = ['started_at', 'completed_at']
+
+
+def upgrade():
+    existing = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('rides')}
+    for name in COLUMNS:
+        if name not in existing:
+            op.add_column('rides', sa.Column(name, sa.DateTime(), nullable=True))
+    op.create_index('ix_rides_completed_at', 'rides', ['completed_at'], if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index('ix_rides_completed_at', table_name='rides', if_exists=True)
+    # Plain ALTER TABLE (SQLite 3.35+): recreating the table would drop the index triggers
+    for name in reversed(COLUMNS):
+        op.drop_column('rides', name)
@@ -0,0 +1,24 @@
+"""Index active recurring templates by departure time of day for ride search
+
+Revision ID: 9a3c5e7f1b20
+Revises: 5d8f2b6e0a13
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '9a3c5e7f1b20'
+down_revision = '5d8f2b6e0a13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_recurring_rides_active_time', 'recurring_rides',
+                    ['is_active', 'departure_time_of_day', 'id'], if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index('ix_recurring_rides_active_time', table_name='recurring_rides', if_exists=True)
@@ -0,0 +1,100 @@
+"""Schema changes made before the migration chain existed
+
+Brings databases created from the original models (such as the committed
+instance/carpool.db) up to date:
+  - token_blocklist.expires_at, so expired revocations can be purged,
+  - users.token_version, the `ver` claim that revokes older tokens,
+  - rides.version, the ride detail ETag,
+  - user_rating_aggregates, filled from `ratings`, replacing the rating
+    columns on users,
+  - recurring_rides coordinates, missing from some older databases.
+Databases created with db.create_all() already have all of it, hence the
+checks. The ride search indexes are not part of the schema migration: run
+`flask rebuild_spatial_index` and `flask rebuild_place_index` afterwards.
+
+Revision ID: c4e7a1f9b3d2
+Revises: 8b41e0c2d9a7
+Create Date: 2026-10-18 08:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e7a1f9b3d2'
+down_revision = '8b41e0c2d9a7'
+branch_labels = None
+depends_on = None
+
+
+OLD_RATING_COLUMNS = [
+    ('avg_driver_rating', sa.Float(), 'driver_rating', 'avg_rating'),
+    ('driver_rating_count', sa.Integer(), 'driver_rating', 'rating_count'),
+    ('avg_rider_rating', sa.Float(), 'rider_rating', 'avg_rating'),
+    ('rider_rating_count', sa.Integer(), 'rider_rating', 'rating_count'),
+]
+COORDINATES = ['origin_lat', 'origin_lng', 'destination_lat', 'destination_lng']
+
+
+def _columns(table):
+    return {column['name'] for column in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def upgrade():
+    if 'expires_at' not in _columns('token_blocklist'):
+        op.add_column('token_blocklist', sa.Column('expires_at', sa.DateTime(), nullable=True))
+    op.create_index('ix_token_blocklist_expires_at', 'token_blocklist', ['expires_at'], if_not_exists=True)
+
+    if 'token_version' not in _columns('users'):
+        op.add_column('users', sa.Column('token_version', sa.BigInteger(), nullable=False, server_default='0'))
+    op.create_index('ix_users_token_version', 'users', ['token_version'], if_not_exists=True)
+
+    if 'version' not in _columns('rides'):
+        op.add_column('rides', sa.Column('version', sa.Integer(), nullable=False, server_default='1'))
+
+    existing = _columns('recurring_rides')
+    for name in COORDINATES:
+        if name not in existing:
+            op.add_column('recurring_rides', sa.Column(name, sa.Float(), nullable=True))
+
+    if not sa.inspect(op.get_bind()).has_table('user_rating_aggregates'):
+        op.create_table(
+            'user_rating_aggregates',
+            sa.Column('user_id', sa.String(length=36), sa.ForeignKey('users.id'), nullable=False),
+            sa.Column('rating_type', sa.Text(), sa.CheckConstraint("rating_type IN ('driver_rating', 'rider_rating')"),
+                      nullable=False),
+            sa.Column('rating_sum', sa.Integer(), nullable=False),
+            sa.Column('rating_count', sa.Integer(), nullable=False),
+            sa.Column('avg_rating', sa.Float(), nullable=False),
+            sa.PrimaryKeyConstraint('user_id', 'rating_type'),
+        )
+        # The same totals `flask recompute_rating_aggregates` computes
+        op.execute(
+            "INSERT INTO user_rating_aggregates (user_id, rating_type, rating_sum, rating_count, avg_rating) "
+            "SELECT reviewee_id, rating_type, sum(rating_value), count(*), CAST(sum(rating_value) AS FLOAT) / count(*) "
+            "FROM ratings GROUP BY reviewee_id, rating_type"
+        )
+    # Plain ALTER TABLE (SQLite 3.35+)
+    existing = _columns('users')
+    for name, _, _, _ in OLD_RATING_COLUMNS:
+        if name in existing:
+            op.drop_column('users', name)
+
+
+def downgrade():
+    for name, column_type, _, _ in OLD_RATING_COLUMNS:
+        op.add_column('users', sa.Column(name, column_type, nullable=True))
+    for name, _, rating_type, source in OLD_RATING_COLUMNS:
+        default = '5.0' if source == 'avg_rating' else '0'
+        op.execute(
+            f"UPDATE users SET {name} = coalesce((SELECT {source} FROM user_rating_aggregates a "
+            f"WHERE a.user_id = users.id AND a.rating_type = '{rating_type}'), {default})"
+        )
+    op.drop_table('user_rating_aggregates')
+    # The recurring_rides coordinates predate this revision on most databases; they stay
+    op.drop_column('rides', 'version')
+    op.drop_index('ix_users_token_version', table_name='users', if_exists=True)
+    op.drop_column('users', 'token_version')
+    op.drop_index('ix_token_blocklist_expires_at', table_name='token_blocklist', if_exists=True)
+    op.drop_column('token_blocklist', 'expires_at')
@@ -0,0 +1,59 @@
+"""Store the bounding box of each ride's route polyline for en-route search
+
+Existing polylines are decoded here to fill the new columns. The route
+R*Tree is not part of the schema migration: run `flask rebuild_spatial_index`
+afterwards (until then en-route search filters on the columns directly).
+
+Revision ID: e2b7d4a9c615
+Revises: 9a3c5e7f1b20
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2b7d4a9c615'
+down_revision = '9a3c5e7f1b20'
+branch_labels = None
+depends_on = None
+
+
+BOUNDS = ['route_min_lat', 'route_max_lat', 'route_min_lng', 'route_max_lng']
+
+
+def upgrade():
+    from route_corridor import InvalidPolyline, decode_polyline, route_bounds
+
+    existing = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('rides')}
+    for name in BOUNDS:
+        if name not in existing:
+            op.add_column('rides', sa.Column(name, sa.Float(), nullable=True))
+
+    bind = op.get_bind()
+    rides = sa.table('rides', sa.column('id'), sa.column('route_polyline'), *(sa.column(name) for name in BOUNDS))
+    rows = bind.execute(
+        sa.select(rides.c.id, rides.c.route_polyline)
+        .where(rides.c.route_polyline.isnot(None), rides.c.route_min_lat.is_(None))
+    ).all()
+    for ride_id, polyline in rows:
+        try:
+            points = decode_polyline(polyline)
+        except InvalidPolyline:
+            continue
+        if points:
+            bind.execute(
+                rides.update().where(rides.c.id == ride_id).values(dict(zip(BOUNDS, route_bounds(points))))
+            )
+
+
+def downgrade():
+    # The spatial triggers name the columns; `flask rebuild_spatial_index` restores the older ones
+    if op.get_bind().dialect.name == 'sqlite':
+        for suffix in ('ai', 'au', 'ad'):
+            op.execute(f"DROP TRIGGER IF EXISTS rides_spatial_{suffix}")
+        op.execute("DROP TABLE IF EXISTS ride_route_rtree")
+    # Plain ALTER TABLE (SQLite 3.35+); a batch rebuild would drop the other search triggers
+    for name in BOUNDS:
+        op.drop_column('rides', name)
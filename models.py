@@ -6,12 +6,18 @@ from werkzeug.security import generate_password_hash, check_password_hash
 
 db = SQLAlchemy()
 
+# Average shown for users who have not been rated yet
+DEFAULT_RATING = 5.0
+
 # New model to store revoked JWT tokens for logout functionality
 class TokenBlocklist(db.Model):
     __tablename__ = 'token_blocklist'
     id = db.Column(db.Integer, primary_key=True)
     jti = db.Column(db.String(36), nullable=False, index=True)
-    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # Polled by the revocation cache in other worker processes
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    # When the revoked token expires on its own; the row can be purged after that
+    expires_at = db.Column(db.DateTime, nullable=True, index=True)
 
 class User(db.Model):
     __tablename__ = 'users'
@@ -23,16 +29,14 @@ class User(db.Model):
     phone_number = db.Column(db.Text)
     password_hash = db.Column(db.String(128))
     role = db.Column(db.Text, db.CheckConstraint("role IN ('driver', 'rider', 'both')"), nullable=False, default='rider')
+    # Tokens carry this as their `ver` claim; raising it (e.g. on a role change) revokes older tokens
+    token_version = db.Column(db.BigInteger, nullable=False, default=0, index=True)
     
     # New fields for driver location
     current_lat = db.Column(db.Float, nullable=True)
     current_lng = db.Column(db.Float, nullable=True)
     last_location_update = db.Column(db.DateTime, nullable=True)
     
-    avg_driver_rating = db.Column(db.Float, default=5.0)
-    driver_rating_count = db.Column(db.Integer, default=0)
-    avg_rider_rating = db.Column(db.Float, default=5.0)
-    rider_rating_count = db.Column(db.Integer, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     # Relationships
@@ -40,6 +44,7 @@ class User(db.Model):
     bookings = db.relationship('Booking', backref='rider', lazy=True, foreign_keys='Booking.rider_id')
     ratings_given = db.relationship('Rating', backref='reviewer', lazy=True, foreign_keys='Rating.reviewer_id')
     ratings_received = db.relationship('Rating', backref='reviewee', lazy=True, foreign_keys='Rating.reviewee_id')
+    rating_aggregates = db.relationship('UserRatingAggregate', lazy=True)
     
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
@@ -47,8 +52,44 @@ class User(db.Model):
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
 
+    # Rating averages live in user_rating_aggregates; users without ratings show 5.0
+    def _rating_aggregate(self, rating_type):
+        return next((a for a in self.rating_aggregates if a.rating_type == rating_type), None)
+
+    @property
+    def avg_driver_rating(self):
+        aggregate = self._rating_aggregate('driver_rating')
+        return aggregate.avg_rating if aggregate else DEFAULT_RATING
+
+    @property
+    def driver_rating_count(self):
+        aggregate = self._rating_aggregate('driver_rating')
+        return aggregate.rating_count if aggregate else 0
+
+    @property
+    def avg_rider_rating(self):
+        aggregate = self._rating_aggregate('rider_rating')
+        return aggregate.avg_rating if aggregate else DEFAULT_RATING
+
+    @property
+    def rider_rating_count(self):
+        aggregate = self._rating_aggregate('rider_rating')
+        return aggregate.rating_count if aggregate else 0
+
 class Ride(db.Model):
     __tablename__ = 'rides'
+    __table_args__ = (
+        # Next scheduled rides on a route (pattern recommendations)
+        db.Index('ix_rides_route_status_departure', 'origin_name', 'destination_name', 'status', 'departure_time'),
+        # One instance per recurring template occurrence; the materializer relies on it
+        db.Index('ix_rides_recurring_departure', 'recurring_id', 'departure_time', unique=True),
+        # Ride search: status filter, ordered by departure
+        db.Index('ix_rides_status_departure', 'status', 'departure_time'),
+        # A driver's upcoming rides (my rides)
+        db.Index('ix_rides_driver_departure', 'driver_id', 'departure_time'),
+        # Rides completed since a point in time (journey estimator refresh)
+        db.Index('ix_rides_completed_at', 'completed_at'),
+    )
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     driver_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
     origin_name = db.Column(db.Text, nullable=False)
@@ -61,13 +102,28 @@ class Ride(db.Model):
     total_seats = db.Column(db.Integer, nullable=False)
     available_seats = db.Column(db.Integer, nullable=False)
     route_polyline = db.Column(db.Text)
+    # Bounding box of route_polyline, set with it; the corridor search index is built on it
+    route_min_lat = db.Column(db.Float)
+    route_max_lat = db.Column(db.Float)
+    route_min_lng = db.Column(db.Float)
+    route_max_lng = db.Column(db.Float)
     status = db.Column(db.Text, db.CheckConstraint("status IN ('scheduled', 'in_progress', 'completed', 'cancelled')"), default='scheduled')
     is_recurring = db.Column(db.Boolean, default=False)
     recurring_id = db.Column(db.String(36), db.ForeignKey('recurring_rides.id'), nullable=True)
+    # Set when the ride moves to in_progress / completed; the journey estimator learns from them
+    started_at = db.Column(db.DateTime)
+    completed_at = db.Column(db.DateTime)
+    # Bumped by every write that changes the ride detail payload; used as its ETag
+    version = db.Column(db.Integer, nullable=False, default=1)
+    # The driver's average driver rating while the ride is active, else NULL; kept by triggers (see ratings.py)
+    driver_rating = db.Column(db.Float)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     bookings = db.relationship('Booking', backref='ride', lazy=True, cascade="all, delete-orphan")
 
+# Ride search by rating: (driver_rating DESC, id) is its sort order, so a page reads the index in order
+db.Index('ix_rides_driver_rating', Ride.driver_rating.desc(), Ride.id)
+
 class Booking(db.Model):
     __tablename__ = 'bookings'
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
@@ -79,7 +135,12 @@ class Booking(db.Model):
     status = db.Column(db.Text, db.CheckConstraint("status IN ('requested', 'confirmed', 'cancelled_by_rider', 'completed')"), default='confirmed')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
-    __table_args__ = (db.UniqueConstraint('ride_id', 'rider_id', name='_ride_rider_uc'),)
+    # The unique constraint also serves lookups by ride_id (its leading column)
+    __table_args__ = (
+        db.UniqueConstraint('ride_id', 'rider_id', name='_ride_rider_uc'),
+        # A rider's confirmed bookings (my rides)
+        db.Index('ix_bookings_rider_status', 'rider_id', 'status'),
+    )
 
 class Rating(db.Model):
     __tablename__ = 'ratings'
@@ -92,6 +153,19 @@ class Rating(db.Model):
     review_text = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    # Ratings a user gave on a ride (ride details, duplicate check)
+    __table_args__ = (db.Index('ix_ratings_ride_reviewer', 'ride_id', 'reviewer_id'),)
+
+# Running sum/count of the ratings a user received, per rating type. Updated
+# with atomic increments (see ratings.py) instead of read-modify-write on users.
+class UserRatingAggregate(db.Model):
+    __tablename__ = 'user_rating_aggregates'
+    user_id = db.Column(db.String(36), db.ForeignKey('users.id'), primary_key=True)
+    rating_type = db.Column(db.Text, db.CheckConstraint("rating_type IN ('driver_rating', 'rider_rating')"), primary_key=True)
+    rating_sum = db.Column(db.Integer, nullable=False, default=0)
+    rating_count = db.Column(db.Integer, nullable=False, default=0)
+    avg_rating = db.Column(db.Float, nullable=False, default=DEFAULT_RATING)
+
 # NEW MODEL: To store the template for a recurring ride
 class RecurringRide(db.Model):
     __tablename__ = 'recurring_rides'
@@ -111,6 +185,11 @@ class RecurringRide(db.Model):
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        # Ride search reads the active templates of a day in departure order
+        db.Index('ix_recurring_rides_active_time', 'is_active', 'departure_time_of_day', 'id'),
+    )
+
 # NEW MODEL: For pattern recognition
 class UserTripPattern(db.Model):
     __tablename__ = 'user_trip_patterns'
@@ -120,4 +199,8 @@ class UserTripPattern(db.Model):
     destination_name = db.Column(db.Text, nullable=False)
     trip_count = db.Column(db.Integer, default=1)
     
-    __table_args__ = (db.UniqueConstraint('user_id', 'origin_name', 'destination_name', name='_user_trip_uc'),)
\ No newline at end of file
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'origin_name', 'destination_name', name='_user_trip_uc'),
+        # A user's most frequent routes, read in trip_count order
+        db.Index('ix_user_trip_patterns_user_count', 'user_id', 'trip_count'),
+    )
\ No newline at end of file
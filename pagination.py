@@ -0,0 +1,37 @@
+# pagination.py
+"""
+Opaque keyset cursors for list endpoints.
+
+A cursor encodes the sort key of the last row on a page, e.g.
+(departure_time, id); the next page filters on "after this key" instead of
+using OFFSET, so deep pages cost the same as the first one.
+"""
+import base64
+import json
+from datetime import datetime
+from flask import current_app
+
+class InvalidCursor(ValueError):
+    pass
+
+def encode_cursor(*values):
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor, *types):
+    """Decodes a cursor into values converted with `types` (datetime is parsed from ISO 8601)."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list) or len(values) != len(types):
+            raise InvalidCursor("Malformed cursor")
+        return [datetime.fromisoformat(v) if t is datetime else t(v) for v, t in zip(values, types)]
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor("Malformed cursor") from e
+
+def page_size(requested):
+    """The page size to use for a `limit` query parameter, capped by the server maximum."""
+    default = current_app.config['DEFAULT_PAGE_SIZE']
+    if requested is None or requested <= 0:
+        return default
+    return min(requested, current_app.config['MAX_PAGE_SIZE'])
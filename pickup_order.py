@@ -0,0 +1,96 @@
+# pickup_order.py
+"""
+Pickup order for a ride's confirmed bookings.
+
+The driver goes from the ride's origin through every pickup point to its
+destination; `order_stops` picks the visiting order with nearest-neighbour
+from the origin, improved by 2-opt (reversing a run of stops whenever that
+shortens the path) until no reversal helps. Distances are great-circle km,
+precomputed once into a matrix. A ride without origin (or destination)
+coordinates falls back to its route polyline's first (last) point, else the
+path starts (ends) anywhere. Rides have a handful of seats, so this is well
+under a millisecond and exact orders are not worth the factorial cost.
+
+`PickupOrderCache` keeps the computed order per ride together with the ride
+version it was computed at: booking and cancelling bump the version, so
+entries are never served stale, and in-process ride_changed signals also
+drop them right away.
+"""
+import threading
+from lru import LRUCache
+from signals import ride_changed
+from spatial_index import great_circle_km
+
+def distance_matrix(points):
+    """Great-circle km between every pair of (lat, lng) points; None is 0 km from everything."""
+    return [
+        [0.0 if a is None or b is None else great_circle_km(*a, *b) for b in points]
+        for a in points
+    ]
+
+def order_stops(start, stops, end):
+    """
+    The order to visit `stops` ((lat, lng) pairs) going from `start` to
+    `end` (either may be None), as (stop indices, km of each leg, from the
+    start to the first stop and on to the end).
+    """
+    points = [start, *stops, end]
+    distance = distance_matrix(points)
+    last = len(points) - 1
+
+    # Nearest neighbour from the start; ties go to the earlier stop
+    path = [0]
+    remaining = list(range(1, last))
+    while remaining:
+        here = distance[path[-1]]
+        nearest = min(remaining, key=lambda stop: (here[stop], stop))
+        path.append(nearest)
+        remaining.remove(nearest)
+    path.append(last)
+
+    # 2-opt with both ends fixed
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, last - 1):
+            for j in range(i + 1, last):
+                a, b, c, d = path[i - 1], path[i], path[j], path[j + 1]
+                if distance[a][c] + distance[b][d] < distance[a][b] + distance[c][d] - 1e-9:
+                    path[i:j + 1] = reversed(path[i:j + 1])
+                    improved = True
+    legs = [distance[a][b] for a, b in zip(path, path[1:])]
+    return [stop - 1 for stop in path[1:-1]], legs
+
+class PickupOrderCache:
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._entries = LRUCache('pickup_order_cache', 10000)  # ride id -> (ride version, payload)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self._entries.max_entries = app.config.get('PICKUP_ORDER_CACHE_MAX_ENTRIES', 10000)
+        ride_changed.connect(self._on_ride_changed, sender=app, weak=False)
+
+    def get(self, ride_id, version):
+        """The payload cached for the ride at `version`, or None."""
+        with self._lock:
+            entry = self._entries.get(ride_id, fresh=lambda entry: entry[0] == version)
+            return None if entry is None else entry[1]
+
+    def set(self, ride_id, version, payload):
+        with self._lock:
+            self._entries.put(ride_id, (version, payload))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _on_ride_changed(self, sender, ride_id=None, **extra):
+        with self._lock:
+            self._entries.pop(ride_id)
+
+    def metrics(self):
+        """Hit/miss counters as Prometheus text lines."""
+        with self._lock:
+            return self._entries.metrics()
@@ -0,0 +1,248 @@
+# place_index.py
+"""
+Substring index over place names, for ride text search and autocomplete.
+
+On SQLite (3.34+, with FTS5) triggers keep three structures in sync with
+`rides` and `recurring_rides`, so every write path (ORM or bulk Core inserts)
+maintains them:
+  - `ride_place_fts`: an FTS5 trigram index over the origin/destination names
+    of active rides (scheduled / in progress), keyed on the ride rowid. Text
+    search narrows candidates with an indexed LIKE on it before the exact
+    ILIKE check on `rides`.
+  - `places`: every distinct place name (case-insensitive) with the number of
+    rides and recurring templates that start or end there.
+  - `place_fts`: an FTS5 trigram index over `places.name` for autocomplete.
+Trigram lookups need at least three characters; shorter terms use a plain
+scan (search) or the case-insensitive prefix index on `places` (autocomplete).
+
+Other databases fall back to ILIKE on the base tables.
+"""
+import logging
+import sqlite3
+import threading
+from sqlalchemy import DDL, and_, column, event, func, literal_column, select, table, text, union_all
+from models import db, Ride, RecurringRide
+from spatial_index import INDEXED_STATUSES
+
+logger = logging.getLogger(__name__)
+
+# Trigrams: shorter terms cannot be looked up in the index
+MIN_INDEXED_TERM = 3
+
+_RIDE_FTS = table('ride_place_fts', column('rowid'), column('origin_name'), column('destination_name'))
+_PLACES = table('places', column('rowid'), column('name'), column('uses'))
+_PLACE_FTS = table('place_fts', column('rowid'), column('name'))
+
+# --- Schema: tables + triggers (SQLite only) ---
+
+def _supported(ddl, target, bind, **kw):
+    """FTS5's trigram tokenizer arrived in SQLite 3.34."""
+    if bind is None or bind.dialect.name != 'sqlite' or sqlite3.sqlite_version_info < (3, 34):
+        return False
+    options = bind.exec_driver_sql("PRAGMA compile_options").scalars().all()
+    return 'ENABLE_FTS5' in options
+
+def _ride_fts_insert_sql(row='new'):
+    statuses = ", ".join(f"'{s}'" for s in INDEXED_STATUSES)
+    return (
+        f"INSERT INTO ride_place_fts (rowid, origin_name, destination_name) "
+        f"SELECT {row}.rowid, {row}.origin_name, {row}.destination_name WHERE {row}.status IN ({statuses});"
+    )
+
+def _ride_fts_delete_sql(row='old'):
+    return f"DELETE FROM ride_place_fts WHERE rowid = {row}.rowid;"
+
+def _count_place_sql(row, delta):
+    if delta > 0:
+        return " ".join(
+            f"INSERT INTO places (name, uses) VALUES ({row}.{name}, 1) ON CONFLICT (name) DO UPDATE SET uses = uses + 1;"
+            for name in ('origin_name', 'destination_name')
+        )
+    return " ".join(
+        f"UPDATE places SET uses = uses - 1 WHERE name = {row}.{name};"
+        for name in ('origin_name', 'destination_name')
+    )
+
+def _create_statements():
+    return [
+        "CREATE TABLE IF NOT EXISTS places (name TEXT PRIMARY KEY COLLATE NOCASE, uses INTEGER NOT NULL DEFAULT 0)",
+        "CREATE VIRTUAL TABLE IF NOT EXISTS ride_place_fts USING fts5(origin_name, destination_name, tokenize='trigram')",
+        "CREATE VIRTUAL TABLE IF NOT EXISTS place_fts USING fts5(name, content='places', content_rowid='rowid', tokenize='trigram')",
+        # place_fts mirrors places; `uses` changes don't touch it
+        "CREATE TRIGGER IF NOT EXISTS places_fts_ai AFTER INSERT ON places "
+        "BEGIN INSERT INTO place_fts (rowid, name) VALUES (new.rowid, new.name); END",
+        "CREATE TRIGGER IF NOT EXISTS places_fts_ad AFTER DELETE ON places "
+        "BEGIN INSERT INTO place_fts (place_fts, rowid, name) VALUES ('delete', old.rowid, old.name); END",
+        "CREATE TRIGGER IF NOT EXISTS places_fts_au AFTER UPDATE OF name ON places "
+        "BEGIN INSERT INTO place_fts (place_fts, rowid, name) VALUES ('delete', old.rowid, old.name); "
+        "INSERT INTO place_fts (rowid, name) VALUES (new.rowid, new.name); END",
+        # Rides: the search index follows status and names, the place counts follow names
+        f"CREATE TRIGGER IF NOT EXISTS rides_places_ai AFTER INSERT ON rides "
+        f"BEGIN {_ride_fts_insert_sql()} {_count_place_sql('new', 1)} END",
+        f"CREATE TRIGGER IF NOT EXISTS rides_places_au AFTER UPDATE OF status, origin_name, destination_name ON rides "
+        f"BEGIN {_ride_fts_delete_sql()} {_ride_fts_insert_sql()} END",
+        f"CREATE TRIGGER IF NOT EXISTS rides_places_au_names AFTER UPDATE OF origin_name, destination_name ON rides "
+        f"BEGIN {_count_place_sql('old', -1)} {_count_place_sql('new', 1)} END",
+        f"CREATE TRIGGER IF NOT EXISTS rides_places_ad AFTER DELETE ON rides "
+        f"BEGIN {_ride_fts_delete_sql()} {_count_place_sql('old', -1)} END",
+        # Recurring templates only count towards place popularity
+        f"CREATE TRIGGER IF NOT EXISTS recurring_places_ai AFTER INSERT ON recurring_rides "
+        f"BEGIN {_count_place_sql('new', 1)} END",
+        f"CREATE TRIGGER IF NOT EXISTS recurring_places_au AFTER UPDATE OF origin_name, destination_name ON recurring_rides "
+        f"BEGIN {_count_place_sql('old', -1)} {_count_place_sql('new', 1)} END",
+        f"CREATE TRIGGER IF NOT EXISTS recurring_places_ad AFTER DELETE ON recurring_rides "
+        f"BEGIN {_count_place_sql('old', -1)} END",
+    ]
+
+def _drop_statements():
+    triggers = ['rides_places_ai', 'rides_places_au', 'rides_places_au_names', 'rides_places_ad',
+                'recurring_places_ai', 'recurring_places_au', 'recurring_places_ad']
+    statements = [f"DROP TRIGGER IF EXISTS {name}" for name in triggers]
+    statements += [f"DROP TABLE IF EXISTS {name}" for name in ('place_fts', 'ride_place_fts', 'places')]
+    return statements
+
+# recurring_rides is created before rides (rides references it), so both exist here
+for _statement in _create_statements():
+    event.listen(Ride.__table__, 'after_create', DDL(_statement).execute_if(callable_=_supported))
+for _statement in _drop_statements():
+    event.listen(Ride.__table__, 'before_drop', DDL(_statement).execute_if(dialect='sqlite'))
+
+def rebuild_place_index():
+    """
+    (Re)creates the place tables and triggers and repopulates them from
+    `rides` and `recurring_rides`. Use it on databases created before the
+    index existed; after a VACUUM, which may renumber ride rowids,
+    `verify_place_index` runs it by itself.
+    Returns the number of distinct places, or None where the index is not
+    supported.
+    """
+    connection = db.session.connection()
+    if not _supported(None, None, connection):
+        return None
+    for statement in _drop_statements() + _create_statements():
+        db.session.execute(text(statement))
+    statuses = ", ".join(f"'{s}'" for s in INDEXED_STATUSES)
+    db.session.execute(text(
+        f"INSERT INTO ride_place_fts (rowid, origin_name, destination_name) "
+        f"SELECT rowid, origin_name, destination_name FROM rides WHERE status IN ({statuses})"
+    ))
+    places = db.session.execute(text(
+        "INSERT INTO places (name, uses) "
+        "SELECT name, count(*) FROM ("
+        "  SELECT origin_name AS name FROM rides UNION ALL SELECT destination_name FROM rides"
+        "  UNION ALL SELECT origin_name FROM recurring_rides UNION ALL SELECT destination_name FROM recurring_rides"
+        ") GROUP BY name COLLATE NOCASE"
+    )).rowcount
+    db.session.commit()
+    _index_available.clear()
+    return places
+
+def drop_place_index():
+    """
+    Removes the place tables and triggers, e.g. ahead of a bulk load;
+    `rebuild_place_index` restores them. No-op on non-SQLite databases.
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return
+    for statement in _drop_statements():
+        db.session.execute(text(statement))
+    _index_available.clear()
+
+# Ride entries compared with `rides` when checking the rowids still line up
+_ROWID_SAMPLE = 100
+
+_verified = set()
+_verify_lock = threading.Lock()
+
+def verify_place_index():
+    """
+    Rebuilds the place index if its ride entries are out of step with
+    `rides`, whose rowids a VACUUM may renumber. Samples a few entries, once
+    per engine; run it before the session has pending changes (it is a
+    before_request hook).
+    """
+    engine = db.engine
+    if engine.url in _verified:
+        return
+    with _verify_lock:
+        if engine.url in _verified:
+            return
+        if _has_place_index():
+            statuses = ", ".join(f"'{s}'" for s in INDEXED_STATUSES)
+            stale = db.session.execute(text(
+                f"SELECT count(*) FROM (SELECT rowid AS ride_rowid, origin_name, destination_name "
+                f"FROM ride_place_fts LIMIT {_ROWID_SAMPLE}) AS entry "
+                f"WHERE NOT EXISTS (SELECT 1 FROM rides WHERE rides.rowid = entry.ride_rowid "
+                f"AND rides.status IN ({statuses}) AND rides.origin_name = entry.origin_name "
+                f"AND rides.destination_name = entry.destination_name)"
+            )).scalar()
+            if stale:
+                logger.warning("Place index entries no longer match ride rowids (after a VACUUM?); rebuilding it")
+                rebuild_place_index()
+        _verified.add(engine.url)
+
+# --- Query helpers ---
+
+def _like_prefix(term):
+    """A LIKE pattern (escape '/') for names starting with `term` taken literally."""
+    return term.replace('/', '//').replace('%', '/%').replace('_', '/_') + '%'
+
+_index_available = {}
+
+def _has_place_index():
+    """Whether the current database has the place index (checked once per engine)."""
+    engine = db.engine
+    if engine.url not in _index_available:
+        available = False
+        if engine.dialect.name == 'sqlite':
+            names = db.session.execute(
+                text("SELECT name FROM sqlite_master WHERE type = 'table' AND name IN ('places', 'ride_place_fts', 'place_fts')")
+            ).scalars().all()
+            available = len(names) == 3
+        _index_available[engine.url] = available
+    return _index_available[engine.url]
+
+def ride_name_contains(point, term):
+    """
+    Filter criterion for rides whose `point` ('origin' or 'destination') name
+    contains `term`, case-insensitively. Candidates come from the trigram
+    index, which only holds active rides, so use it together with a status
+    filter on those.
+    """
+    name = getattr(Ride, f"{point}_name")
+    match = name.icontains(term, autoescape=True)
+    if len(term) < MIN_INDEXED_TERM or not _has_place_index():
+        return match
+    # FTS5 only uses the index for LIKE without ESCAPE; a '%' or '_' in the
+    # term just widens the candidates, and `match` keeps the result exact
+    candidates = select(_RIDE_FTS.c.rowid).where(_RIDE_FTS.c[f"{point}_name"].like(f"%{term}%"))
+    return and_(literal_column("rides.rowid").in_(candidates), match)
+
+def autocomplete_places(term, limit):
+    """
+    Up to `limit` (name, popularity) pairs for place names containing `term`:
+    prefix matches first, then by the number of rides and templates using
+    the place. An empty term returns the most popular places.
+    """
+    if _has_place_index():
+        places = _PLACES
+        # One bound pattern (no concatenation) so SQLite can range-scan the index
+        prefix = places.c.name.like(_like_prefix(term), escape='/')
+        if len(term) >= MIN_INDEXED_TERM:
+            matches = and_(literal_column("places.rowid").in_(
+                select(_PLACE_FTS.c.rowid).where(_PLACE_FTS.c.name.like(f"%{term}%"))
+            ), places.c.name.icontains(term, autoescape=True))
+        else:
+            # Shorter terms use the NOCASE primary key for the prefix
+            matches = prefix
+        query = select(places.c.name, places.c.uses).where(matches, places.c.uses > 0)
+    else:
+        names = union_all(
+            select(Ride.origin_name.label('name')), select(Ride.destination_name),
+            select(RecurringRide.origin_name), select(RecurringRide.destination_name)
+        ).subquery()
+        prefix = names.c.name.istartswith(term, autoescape=True)
+        query = select(names.c.name, func.count().label('uses')) \
+            .where(names.c.name.icontains(term, autoescape=True)).group_by(names.c.name)
+    query = query.order_by(prefix.desc(), literal_column('uses').desc(), literal_column('name')).limit(limit)
+    return db.session.execute(query).all()
@@ -0,0 +1,191 @@
+# ratings.py
+"""
+Rating aggregates: each rating is folded into `user_rating_aggregates` with a
+single atomic upsert, so concurrent ratings cannot lose updates and no
+`users` row is locked. `recompute_aggregates` rebuilds the whole table from
+`ratings` in one set-based pass and reports how far it had drifted.
+
+On SQLite, active rides (scheduled / in progress) also carry their driver's
+average driver rating in `rides.driver_rating`, so rating-ordered search
+reads `ix_rides_driver_rating` in order instead of joining and sorting every
+active ride. Triggers keep the copy in sync from both sides: a ride gets it
+when inserted or reactivated and drops it (NULL) when it stops being
+searchable, and every change to a driver's aggregate is copied to their
+active rides. Other databases leave the column empty and join the
+aggregates.
+"""
+from sqlalchemy import DDL, Float, cast, delete, event, func, insert, select, text
+from models import db, Rating, Ride, UserRatingAggregate, DEFAULT_RATING
+from db_utils import upsert_insert
+from spatial_index import INDEXED_STATUSES
+
+def record_rating(user_id, rating_type, rating_value):
+    """Adds one rating to the user's aggregate; runs in the caller's transaction."""
+    aggregate = UserRatingAggregate.__table__
+    stmt = upsert_insert(aggregate).values(
+        user_id=user_id,
+        rating_type=rating_type,
+        rating_sum=rating_value,
+        rating_count=1,
+        avg_rating=float(rating_value)
+    )
+    # Column references in SET see the pre-update values, so the average is
+    # computed from the same row state as the increments.
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[aggregate.c.user_id, aggregate.c.rating_type],
+        set_={
+            'rating_sum': aggregate.c.rating_sum + stmt.excluded.rating_sum,
+            'rating_count': aggregate.c.rating_count + 1,
+            'avg_rating': cast(aggregate.c.rating_sum + stmt.excluded.rating_sum, Float) / (aggregate.c.rating_count + 1),
+        }
+    )
+    db.session.execute(stmt)
+
+def recompute_aggregates(dry_run=False):
+    """
+    Recomputes every aggregate from `ratings`. Returns a list of
+    (user_id, rating_type, stored (sum, count), actual (sum, count)) for the
+    aggregates that had drifted; the table is only rewritten if not `dry_run`.
+    """
+    totals = (
+        select(
+            Rating.reviewee_id, Rating.rating_type,
+            func.sum(Rating.rating_value).label('rating_sum'),
+            func.count().label('rating_count')
+        )
+        .group_by(Rating.reviewee_id, Rating.rating_type)
+    )
+
+    stored = {
+        (row.user_id, row.rating_type): (row.rating_sum, row.rating_count)
+        for row in db.session.execute(select(
+            UserRatingAggregate.user_id, UserRatingAggregate.rating_type,
+            UserRatingAggregate.rating_sum, UserRatingAggregate.rating_count
+        ))
+    }
+    drift = []
+    for row in db.session.execute(totals).yield_per(10_000):
+        key = (row.reviewee_id, row.rating_type)
+        actual = (row.rating_sum, row.rating_count)
+        previous = stored.pop(key, None)
+        if previous != actual:
+            drift.append((*key, previous, actual))
+    # Aggregates with no ratings behind them at all
+    drift += [(*key, value, (0, 0)) for key, value in stored.items()]
+
+    if not dry_run and drift:
+        aggregate = UserRatingAggregate.__table__
+        subquery = totals.subquery()
+        db.session.execute(delete(aggregate))
+        db.session.execute(insert(aggregate).from_select(
+            ['user_id', 'rating_type', 'rating_sum', 'rating_count', 'avg_rating'],
+            select(
+                subquery.c.reviewee_id, subquery.c.rating_type,
+                subquery.c.rating_sum, subquery.c.rating_count,
+                cast(subquery.c.rating_sum, Float) / subquery.c.rating_count
+            )
+        ))
+        db.session.commit()
+    return drift
+
+# --- Driver rating on rides: triggers (SQLite only) ---
+
+def _driver_rating_sql(driver_id):
+    return (
+        f"coalesce((SELECT avg_rating FROM user_rating_aggregates "
+        f"WHERE user_id = {driver_id} AND rating_type = 'driver_rating'), {DEFAULT_RATING})"
+    )
+
+def _ride_statements():
+    statuses = ", ".join(f"'{s}'" for s in INDEXED_STATUSES)
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS rides_driver_rating_ai AFTER INSERT ON rides "
+        f"WHEN new.status IN ({statuses}) "
+        f"BEGIN UPDATE rides SET driver_rating = {_driver_rating_sql('new.driver_id')} WHERE rowid = new.rowid; END",
+        f"CREATE TRIGGER IF NOT EXISTS rides_driver_rating_au AFTER UPDATE OF status, driver_id ON rides "
+        f"BEGIN UPDATE rides SET driver_rating = CASE WHEN new.status IN ({statuses}) "
+        f"THEN {_driver_rating_sql('new.driver_id')} END WHERE rowid = new.rowid; END",
+    ]
+
+def _aggregate_statements():
+    statuses = ", ".join(f"'{s}'" for s in INDEXED_STATUSES)
+    copy_to_rides = (
+        "UPDATE rides SET driver_rating = {rating} "
+        f"WHERE driver_id = {{row}}.user_id AND status IN ({statuses});"
+    )
+    # Upserts fire the insert or the update trigger
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS aggregates_driver_rating_ai AFTER INSERT ON user_rating_aggregates "
+        f"WHEN new.rating_type = 'driver_rating' "
+        f"BEGIN {copy_to_rides.format(rating='new.avg_rating', row='new')} END",
+        f"CREATE TRIGGER IF NOT EXISTS aggregates_driver_rating_au AFTER UPDATE OF avg_rating ON user_rating_aggregates "
+        f"WHEN new.rating_type = 'driver_rating' "
+        f"BEGIN {copy_to_rides.format(rating='new.avg_rating', row='new')} END",
+        f"CREATE TRIGGER IF NOT EXISTS aggregates_driver_rating_ad AFTER DELETE ON user_rating_aggregates "
+        f"WHEN old.rating_type = 'driver_rating' "
+        f"BEGIN {copy_to_rides.format(rating=DEFAULT_RATING, row='old')} END",
+    ]
+
+def _create_statements():
+    return _ride_statements() + _aggregate_statements()
+
+def _drop_statements():
+    triggers = ['rides_driver_rating_ai', 'rides_driver_rating_au',
+                'aggregates_driver_rating_ai', 'aggregates_driver_rating_au', 'aggregates_driver_rating_ad']
+    return [f"DROP TRIGGER IF EXISTS {name}" for name in triggers]
+
+def _backfill_sql():
+    statuses = ", ".join(f"'{s}'" for s in INDEXED_STATUSES)
+    return (
+        f"UPDATE rides SET driver_rating = CASE WHEN status IN ({statuses}) "
+        f"THEN {_driver_rating_sql('rides.driver_id')} END"
+    )
+
+# Trigger bodies are resolved when they run, so each table can get its own as it is created
+for _statement in _ride_statements():
+    event.listen(Ride.__table__, 'after_create', DDL(_statement).execute_if(dialect='sqlite'))
+for _statement in _aggregate_statements():
+    event.listen(UserRatingAggregate.__table__, 'after_create', DDL(_statement).execute_if(dialect='sqlite'))
+
+def rebuild_driver_rating_index():
+    """
+    (Re)creates the driver rating triggers and recopies every active ride's
+    driver rating. Use it on databases created before the copy existed, and
+    after a bulk load that dropped them. Returns the number of rides
+    updated, or None on non-SQLite databases.
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return None
+    for statement in _drop_statements() + _create_statements():
+        db.session.execute(text(statement))
+    updated = db.session.execute(text(_backfill_sql())).rowcount
+    db.session.commit()
+    _index_available.clear()
+    return updated
+
+def drop_driver_rating_index():
+    """
+    Removes the driver rating triggers, e.g. ahead of a bulk load;
+    `rebuild_driver_rating_index` restores them and the copies. No-op on
+    non-SQLite databases.
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return
+    for statement in _drop_statements():
+        db.session.execute(text(statement))
+    _index_available.clear()
+
+_index_available = {}
+
+def driver_rating_indexed():
+    """Whether `rides.driver_rating` is kept in sync on the current database (checked once per engine)."""
+    engine = db.engine
+    if engine.url not in _index_available:
+        available = False
+        if engine.dialect.name == 'sqlite':
+            names = db.session.execute(
+                text("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE '%driver_rating_%'")
+            ).scalars().all()
+            available = len(names) == len(_drop_statements())
+        _index_available[engine.url] = available
+    return _index_available[engine.url]
@@ -0,0 +1,97 @@
+# recommendation_cache.py
+"""
+Per-user cache for pattern-based ride recommendations.
+
+Each entry is computed with one joined query (see routes/features_routes.py)
+and kept for RECOMMENDATION_CACHE_TTL_SECONDS in a bounded LRU. Entries are
+invalidated in-process when:
+  - a ride on one of the user's top routes is created,
+  - a recommended ride changes (fills up, is cancelled, departs...),
+  - the user's trip patterns change.
+The TTL bounds staleness for writes handled by other worker processes.
+"""
+import threading
+import time
+from collections import OrderedDict
+from signals import ride_changed, trip_patterns_changed
+
+class _Entry:
+    __slots__ = ('recommendations', 'routes', 'ride_ids', 'expires_at')
+
+    def __init__(self, recommendations, routes, ride_ids, expires_at):
+        self.recommendations = recommendations
+        self.routes = routes
+        self.ride_ids = ride_ids
+        self.expires_at = expires_at
+
+class RecommendationCache:
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # user id -> _Entry, least recently used first
+        self._by_route = {}  # (origin_name, destination_name) -> user ids
+        self._by_ride = {}  # ride id -> user ids
+        self.ttl = 300
+        self.max_entries = 10000
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.ttl = app.config.get('RECOMMENDATION_CACHE_TTL_SECONDS', 300)
+        self.max_entries = app.config.get('RECOMMENDATION_CACHE_MAX_ENTRIES', 10000)
+        ride_changed.connect(self._on_ride_changed, sender=app, weak=False)
+        trip_patterns_changed.connect(self._on_patterns_changed, sender=app, weak=False)
+
+    def get(self, user_id):
+        """The cached recommendations for a user, or None."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            if entry.expires_at < time.monotonic():
+                self._remove(user_id)
+                return None
+            self._entries.move_to_end(user_id)
+            return entry.recommendations
+
+    def set(self, user_id, recommendations, routes):
+        """Caches recommendations computed for the user's top `routes`."""
+        ride_ids = {r["id"] for r in recommendations}
+        with self._lock:
+            self._remove(user_id)
+            self._entries[user_id] = _Entry(recommendations, set(routes), ride_ids, time.monotonic() + self.ttl)
+            for route in routes:
+                self._by_route.setdefault(route, set()).add(user_id)
+            for ride_id in ride_ids:
+                self._by_ride.setdefault(ride_id, set()).add(user_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._remove(user_id)
+
+    def _remove(self, user_id):
+        """Drops an entry and its reverse-index references; called with the lock held."""
+        entry = self._entries.pop(user_id, None)
+        if entry is None:
+            return
+        for index, keys in ((self._by_route, entry.routes), (self._by_ride, entry.ride_ids)):
+            for key in keys:
+                users = index.get(key)
+                if users is not None:
+                    users.discard(user_id)
+                    if not users:
+                        del index[key]
+
+    def _on_ride_changed(self, sender, ride_id=None, route=None, **extra):
+        with self._lock:
+            affected = set(self._by_ride.get(ride_id, ()))
+            if route is not None:
+                affected |= self._by_route.get(route, set())
+            for user_id in affected:
+                self._remove(user_id)
+
+    def _on_patterns_changed(self, sender, user_ids=(), **extra):
+        with self._lock:
+            for user_id in user_ids:
+                self._remove(user_id)
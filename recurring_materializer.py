@@ -0,0 +1,144 @@
+# recurring_materializer.py
+"""
+Rolls recurring ride templates forward into concrete `Ride` rows.
+
+`materialize_recurring_rides` walks the active templates in batches and
+inserts every missing occurrence up to the horizon with one bulk INSERT per
+batch. The unique (recurring_id, departure_time) index plus ON CONFLICT DO
+NOTHING keeps it idempotent, so overlapping runs (several worker processes,
+or the worker and the CLI) cannot create duplicates.
+
+`RecurringMaterializer` runs it in a background thread every
+RECURRING_MATERIALIZE_INTERVAL_SECONDS; `wake()` asks for a run now, e.g.
+right after a template is created. The `materialize_recurring_rides` CLI
+command does the same from cron.
+"""
+import logging
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from models import db, Ride, RecurringRide
+from db_utils import upsert_insert
+from signals import notify_ride_changed
+
+logger = logging.getLogger(__name__)
+
+def occurrences(template, start, end):
+    """The departure datetimes of a template in [start, end)."""
+    days = {int(day) for day in template.days_of_week.split(",") if day}
+    current = start.date()
+    while current <= end.date():
+        if current.weekday() in days:
+            departure = datetime.combine(current, template.departure_time_of_day)
+            if start <= departure < end:
+                yield departure
+        current += timedelta(days=1)
+
+def materialize_recurring_rides(horizon_days=1, batch_size=500, now=None):
+    """
+    Generates the missing ride instances of every active template from `now`
+    up to `horizon_days` ahead. Returns the number of rides inserted.
+    """
+    start = now or datetime.now()
+    end = start + timedelta(days=horizon_days)
+    rides = Ride.__table__
+    inserted = 0
+    last_id = ""
+    while True:
+        templates = db.session.execute(
+            select(RecurringRide)
+            .where(RecurringRide.is_active.is_(True), RecurringRide.id > last_id)
+            .order_by(RecurringRide.id)
+            .limit(batch_size)
+        ).scalars().all()
+        if not templates:
+            break
+        last_id = templates[-1].id
+
+        existing = set(db.session.execute(
+            select(Ride.recurring_id, Ride.departure_time)
+            .where(Ride.recurring_id.in_([t.id for t in templates]), Ride.departure_time >= start)
+        ).tuples())
+        new_rides = [
+            {
+                "driver_id": t.driver_id,
+                "origin_name": t.origin_name,
+                "origin_lat": t.origin_lat,
+                "origin_lng": t.origin_lng,
+                "destination_name": t.destination_name,
+                "destination_lat": t.destination_lat,
+                "destination_lng": t.destination_lng,
+                "departure_time": departure,
+                "total_seats": t.total_seats,
+                "available_seats": t.total_seats,
+                "is_recurring": True,
+                "recurring_id": t.id,
+            }
+            for t in templates
+            for departure in occurrences(t, start, end)
+            if (t.id, departure) not in existing
+        ]
+        if new_rides:
+            stmt = upsert_insert(rides).on_conflict_do_nothing(
+                index_elements=[rides.c.recurring_id, rides.c.departure_time]
+            ).returning(rides.c.id, rides.c.origin_name, rides.c.destination_name)
+            created = db.session.execute(stmt, new_rides).all()
+            db.session.commit()
+            inserted += len(created)
+            for ride_id, origin_name, destination_name in created:
+                notify_ride_changed(ride_id, route=(origin_name, destination_name))
+        else:
+            db.session.commit()
+        db.session.expunge_all()
+    return inserted
+
+class RecurringMaterializer:
+    def __init__(self, app=None):
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._app = None
+        self.interval = 3600
+        self.horizon_days = 1
+        self.batch_size = 500
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self._app = app
+        self.interval = app.config.get('RECURRING_MATERIALIZE_INTERVAL_SECONDS', 3600)
+        self.horizon_days = app.config.get('RECURRING_HORIZON_DAYS', 1)
+        self.batch_size = app.config.get('RECURRING_MATERIALIZE_BATCH_SIZE', 500)
+        if self.interval > 0:
+            # Started lazily so CLI commands and scripts don't spawn the worker
+            app.before_request(self._ensure_worker)
+
+    def wake(self):
+        """Asks the worker to run now instead of waiting for the next interval."""
+        if self.interval <= 0:
+            return
+        self._ensure_worker()
+        self._wake.set()
+
+    def run_once(self):
+        with self._app.app_context():
+            try:
+                return materialize_recurring_rides(self.horizon_days, self.batch_size)
+            except Exception:
+                db.session.rollback()
+                logger.exception("Recurring ride materialization failed; will retry")
+                return 0
+
+    def _ensure_worker(self):
+        if self._worker is not None:
+            return
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name='recurring-materializer', daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            self.run_once()
+            self._wake.wait(self.interval)
+            self._wake.clear()
@@ -0,0 +1,243 @@
+# recurring_occurrences.py
+"""
+Virtual rides: occurrences of recurring templates that have no `Ride` row.
+
+Ride search expands the active templates matching the filters over the
+requested window instead of reading one stored row per future occurrence,
+reading templates day by day (or rating batch by batch) only as far as the
+page goes.
+Each occurrence gets a stable id (`rec_<template id>_<YYYYMMDDHHMMSS>`) and only
+becomes a real `Ride` row when someone books it. Occurrences that already
+have a row (materialized by the rolling worker, or booked) are left to the
+normal ride query, and so are cancelled ones.
+"""
+import re
+from datetime import datetime, time, timedelta
+from sqlalchemy import and_, func, or_, select
+from models import db, Ride, RecurringRide, User, UserRatingAggregate, DEFAULT_RATING
+from db_utils import upsert_insert
+from spatial_index import bounding_box, haversine_km
+from recurring_materializer import occurrences
+
+_VIRTUAL_ID = re.compile(r"^rec_(?P<recurring_id>[0-9a-f-]{36})_(?P<departure>\d{14})$")
+
+def virtual_ride_id(recurring_id, departure):
+    return f"rec_{recurring_id}_{departure:%Y%m%d%H%M%S}"
+
+def parse_virtual_ride_id(ride_id):
+    """(recurring_id, departure) for a virtual ride id, or None for any other id."""
+    match = _VIRTUAL_ID.match(ride_id)
+    if match is None:
+        return None
+    try:
+        departure = datetime.strptime(match["departure"], "%Y%m%d%H%M%S")
+    except ValueError:
+        return None
+    return match["recurring_id"], departure
+
+def _point_within(lat_col, lng_col, point, radius_km):
+    lat, lng = point
+    min_lat, max_lat, min_lng, max_lng = bounding_box(lat, lng, radius_km)
+    return and_(
+        lat_col.between(min_lat, max_lat), lng_col.between(min_lng, max_lng),
+        haversine_km(lat_col, lng_col, lat, lng) <= radius_km
+    )
+
+def _on_weekday(weekday):
+    """Templates running on `weekday` (0 = Monday); days_of_week is e.g. "0,1,2,3,4"."""
+    return ("," + RecurringRide.days_of_week + ",").contains(f",{weekday},")
+
+def _schedule_within(start, end):
+    """
+    Filter criterion for templates with an occurrence in [start, end] when the
+    window is shorter than a week (weekday and time of day), else None.
+    """
+    if end - start >= timedelta(days=7):
+        return None
+    spans = []
+    day = start.date()
+    while day <= end.date():
+        first = start.time() if day == start.date() else time.min
+        last = end.time() if day == end.date() else time.max
+        spans.append(and_(_on_weekday(day.weekday()), RecurringRide.departure_time_of_day.between(first, last)))
+        day += timedelta(days=1)
+    return or_(*spans)
+
+def _materialized(template_ids, start, end):
+    return set(db.session.execute(
+        select(Ride.recurring_id, Ride.departure_time).where(
+            Ride.recurring_id.in_(template_ids), Ride.departure_time.between(start, end)
+        )
+    ).tuples())
+
+def _occurrence(template, departure, key):
+    return key, {
+        "id": key[1], "driver_id": template.driver_id, "origin_name": template.origin_name,
+        "destination_name": template.destination_name, "departure_time": departure.isoformat(),
+        "available_seats": template.total_seats
+    }
+
+def _by_departure(query, start, end, batch_size):
+    """
+    Day by day, the templates running that day in time-of-day order, read
+    `batch_size` at a time: a page only reads the days and templates it shows.
+    """
+    departs = RecurringRide.departure_time_of_day
+    idle_weekdays = set()  # no matching template on that weekday at all
+    day = start.date()
+    while day <= end.date():
+        first = start.time() if day == start.date() else time.min
+        last = end.time() if day == end.date() else time.max
+        whole_day = first == time.min and last == time.max
+        after = None
+        while day.weekday() not in idle_weekdays:
+            batch = query.where(_on_weekday(day.weekday()), departs.between(first, last))
+            if after is not None:
+                batch = batch.where(or_(departs > after[0], and_(departs == after[0], RecurringRide.id > after[1])))
+            templates = db.session.execute(batch.order_by(departs, RecurringRide.id).limit(batch_size)).all()
+            if not templates:
+                if after is None and whole_day:
+                    idle_weekdays.add(day.weekday())
+                break
+            materialized = _materialized(
+                [template.id for template, _ in templates],
+                datetime.combine(day, first), datetime.combine(day, last)
+            )
+            for template, _ in templates:
+                departure = datetime.combine(day, template.departure_time_of_day)
+                if (template.id, departure) not in materialized:
+                    yield _occurrence(template, departure, (departure, virtual_ride_id(template.id, departure)))
+            if len(templates) < batch_size:
+                break
+            after = (templates[-1][0].departure_time_of_day, templates[-1][0].id)
+        day += timedelta(days=1)
+
+def _by_rating(query, rating, start, end, batch_size):
+    """
+    Templates by (driver rating, id), read `batch_size` at a time; each one's
+    occurrences are consecutive in that order, so a page stops at the
+    templates it shows. The rating lives in another table, so each batch
+    still sorts every matching template.
+    """
+    after = None
+    while True:
+        batch = query
+        if after is not None:
+            batch = batch.where(or_(rating < after[0], and_(rating == after[0], RecurringRide.id > after[1])))
+        templates = db.session.execute(batch.order_by(rating.desc(), RecurringRide.id).limit(batch_size)).all()
+        if not templates:
+            return
+        materialized = _materialized([template.id for template, _ in templates], start, end)
+        for template, driver_rating in templates:
+            # Each template's occurrences come out in id order too (fixed-width timestamps)
+            for departure in occurrences(template, start, end + timedelta(seconds=1)):
+                if departure > end or (template.id, departure) in materialized:
+                    continue
+                yield _occurrence(template, departure, (-driver_rating, virtual_ride_id(template.id, departure)))
+        if len(templates) < batch_size:
+            return
+        after = (templates[-1][1], templates[-1][0].id)
+
+def search_occurrences(origin=None, destination=None, origin_point=None, destination_point=None,
+                       radius_km=1.0, start_time=None, end_time=None, sort_by=None, batch_size=100,
+                       driver_id=None):
+    """
+    An iterator of (sort key, payload) over the unmaterialized occurrences of
+    matching templates departing in [start_time, end_time], in the same order
+    as the ride search: sort key (departure_time, id), or (-driver rating, id)
+    when sorting by rating. Filters mirror the ride search; `driver_id`
+    restricts them to one driver's templates.
+
+    Templates are read lazily, `batch_size` at a time (pass the page size plus
+    one), so stopping after one page reads about a page of templates rather
+    than all of them.
+    """
+    start = max(start_time, datetime.now()) if start_time else datetime.now()
+    if end_time is None or end_time < start:
+        return iter(())
+
+    rating = func.coalesce(UserRatingAggregate.avg_rating, DEFAULT_RATING).label('driver_rating')
+    query = (
+        select(RecurringRide, rating)
+        .outerjoin(UserRatingAggregate, and_(
+            UserRatingAggregate.user_id == RecurringRide.driver_id,
+            UserRatingAggregate.rating_type == 'driver_rating'
+        ))
+        .where(RecurringRide.is_active.is_(True))
+    )
+    if driver_id is not None:
+        query = query.where(RecurringRide.driver_id == driver_id)
+    if origin_point is not None:
+        query = query.where(_point_within(RecurringRide.origin_lat, RecurringRide.origin_lng, origin_point, radius_km))
+    elif origin:
+        query = query.where(RecurringRide.origin_name.icontains(origin, autoescape=True))
+    if destination_point is not None:
+        query = query.where(_point_within(RecurringRide.destination_lat, RecurringRide.destination_lng, destination_point, radius_km))
+    elif destination:
+        query = query.where(RecurringRide.destination_name.icontains(destination, autoescape=True))
+
+    if sort_by == 'rating':
+        schedule = _schedule_within(start, end_time)
+        if schedule is not None:
+            query = query.where(schedule)
+        return _by_rating(query, rating, start, end_time, batch_size)
+    return _by_departure(query, start, end_time, batch_size)
+
+def _template_for(recurring_id, departure):
+    """The active template if `departure` is one of its future occurrences."""
+    template = db.session.get(RecurringRide, recurring_id)
+    if template is None or not template.is_active or departure < datetime.now():
+        return None
+    if departure not in occurrences(template, departure, departure + timedelta(seconds=1)):
+        return None
+    return template
+
+def materialized_ride_id(recurring_id, departure):
+    """The id of the occurrence's `Ride` row, or None if it has none."""
+    return db.session.scalar(
+        select(Ride.id).where(Ride.recurring_id == recurring_id, Ride.departure_time == departure)
+    )
+
+def materialize_occurrence(recurring_id, departure):
+    """
+    Returns the id of the occurrence's `Ride` row, inserting it if needed.
+    The insert joins the caller's transaction, so it is discarded if the
+    caller rolls back. Returns None if this is not a valid future occurrence.
+    """
+    ride_id = materialized_ride_id(recurring_id, departure)
+    if ride_id is not None:
+        return ride_id
+    template = _template_for(recurring_id, departure)
+    if template is None:
+        return None
+    rides = Ride.__table__
+    db.session.execute(upsert_insert(rides).values(
+        driver_id=template.driver_id,
+        origin_name=template.origin_name,
+        origin_lat=template.origin_lat,
+        origin_lng=template.origin_lng,
+        destination_name=template.destination_name,
+        destination_lat=template.destination_lat,
+        destination_lng=template.destination_lng,
+        departure_time=departure,
+        total_seats=template.total_seats,
+        available_seats=template.total_seats,
+        is_recurring=True,
+        recurring_id=template.id
+    ).on_conflict_do_nothing(index_elements=[rides.c.recurring_id, rides.c.departure_time]))
+    return materialized_ride_id(recurring_id, departure)
+
+def virtual_ride_details(recurring_id, departure):
+    """Ride detail payload for an unmaterialized occurrence, or None."""
+    template = _template_for(recurring_id, departure)
+    if template is None:
+        return None
+    driver = db.session.get(User, template.driver_id)
+    return {
+        "id": virtual_ride_id(recurring_id, departure), "origin_name": template.origin_name,
+        "destination_name": template.destination_name, "departure_time": departure.isoformat(),
+        "total_seats": template.total_seats, "available_seats": template.total_seats, "status": "scheduled",
+        "driver": {"id": driver.id, "full_name": driver.full_name, "avg_driver_rating": driver.avg_driver_rating},
+        "bookings": [],
+        "ratings_given_by_me": []
+    }
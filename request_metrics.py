@@ -0,0 +1,227 @@
+# request_metrics.py
+"""
+Per-endpoint request and SQL metrics, exported in Prometheus text format.
+
+Every request is timed from `before_request` to `teardown_request`, and the
+statements it runs are timed with SQLAlchemy cursor events. Per Flask
+endpoint we keep:
+  - a request latency histogram and a request counter by method and status,
+  - a histogram of SQL statements per request (N+1 patterns show up as a
+    high count on one endpoint),
+  - total SQL time and the slowest statement seen so far.
+`render()` produces the /metrics payload. Counters live in this process,
+so with several workers each one reports its own.
+
+Requests slower than SLOW_REQUEST_THRESHOLD_MS are logged as warnings with
+their statements (SQL only, never the bound parameters).
+"""
+import logging
+import threading
+import time
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+# Slowest statements are exported as a label; keep series short
+_STATEMENT_LABEL_LENGTH = 200
+
+class _Trace:
+    """SQL run by one request."""
+    __slots__ = ('started', 'count', 'sql_seconds', 'slowest', 'statements', 'max_statements')
+
+    def __init__(self, max_statements):
+        self.started = time.perf_counter()
+        self.count = 0
+        self.sql_seconds = 0.0
+        self.slowest = (0.0, None)
+        self.statements = []  # (seconds, statement), the first max_statements
+        self.max_statements = max_statements
+
+    def add(self, statement, seconds):
+        self.count += 1
+        self.sql_seconds += seconds
+        if seconds > self.slowest[0]:
+            self.slowest = (seconds, statement)
+        if len(self.statements) < self.max_statements:
+            self.statements.append((seconds, statement))
+
+class _Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+class _EndpointStats:
+    __slots__ = ('latency', 'statements', 'requests', 'sql_seconds', 'slowest')
+
+    def __init__(self):
+        self.latency = {}  # method -> _Histogram
+        self.statements = _Histogram(STATEMENT_BUCKETS)
+        self.requests = {}  # (method, status) -> count
+        self.sql_seconds = 0.0
+        self.slowest = (0.0, None)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _labels(**labels):
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+def _format_bound(bound):
+    return repr(float(bound)) if isinstance(bound, float) else str(bound)
+
+class RequestMetrics:
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._endpoints = {}  # endpoint -> _EndpointStats
+        self._collectors = []  # callables returning extra exposition lines
+        self.enabled = True
+        self.slow_threshold = 0.5
+        self.max_logged_statements = 50
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('METRICS_ENABLED', True)
+        self.slow_threshold = app.config.get('SLOW_REQUEST_THRESHOLD_MS', 500) / 1000
+        self.max_logged_statements = app.config.get('SLOW_REQUEST_MAX_STATEMENTS', 50)
+        if not self.enabled:
+            return
+        app.before_request(self._start_request)
+        app.after_request(self._record_status)
+        app.teardown_request(self._finish_request)
+        # Listening on the Engine class covers every engine, including ones created later
+        if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+    # --- Request hooks ---
+
+    def _start_request(self):
+        g._metrics_trace = _Trace(self.max_logged_statements)
+
+    def _record_status(self, response):
+        g._metrics_status = response.status_code
+        return response
+
+    def _finish_request(self, exc):
+        trace = g.pop('_metrics_trace', None)
+        if trace is None:
+            return
+        elapsed = time.perf_counter() - trace.started
+        status = 500 if exc is not None else g.pop('_metrics_status', 500)
+        endpoint = request.endpoint or 'unmatched'
+        self.observe(endpoint, request.method, status, elapsed, trace)
+        if self.slow_threshold > 0 and elapsed >= self.slow_threshold:
+            self._log_slow_request(endpoint, elapsed, status, trace)
+
+    def observe(self, endpoint, method, status, elapsed, trace):
+        with self._lock:
+            stats = self._endpoints.get(endpoint)
+            if stats is None:
+                stats = self._endpoints[endpoint] = _EndpointStats()
+            latency = stats.latency.get(method)
+            if latency is None:
+                latency = stats.latency[method] = _Histogram(LATENCY_BUCKETS)
+            latency.observe(elapsed)
+            stats.requests[(method, status)] = stats.requests.get((method, status), 0) + 1
+            stats.statements.observe(trace.count)
+            stats.sql_seconds += trace.sql_seconds
+            if trace.slowest[0] > stats.slowest[0]:
+                stats.slowest = trace.slowest
+
+    def _log_slow_request(self, endpoint, elapsed, status, trace):
+        lines = [f"  {seconds * 1000:8.2f} ms  {' '.join(statement.split())}" for seconds, statement in trace.statements]
+        if trace.count > len(trace.statements):
+            lines.append(f"  ... and {trace.count - len(trace.statements)} more statements")
+        logger.warning(
+            "Slow request %s %s (%s) -> %s: %.1f ms, %d SQL statements, %.1f ms in SQL\n%s",
+            request.method, request.path, endpoint, status, elapsed * 1000, trace.count,
+            trace.sql_seconds * 1000, "\n".join(lines)
+        )
+
+    # --- Export ---
+
+    def add_collector(self, collect):
+        """Adds `collect()`, returning Prometheus text lines, to the /metrics output."""
+        self._collectors.append(collect)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            endpoints = sorted(self._endpoints.items())
+            out = []
+
+            out.append("# HELP carpool_http_requests_total Requests handled, by endpoint, method and status.")
+            out.append("# TYPE carpool_http_requests_total counter")
+            for endpoint, stats in endpoints:
+                for (method, status), count in sorted(stats.requests.items()):
+                    out.append(f"carpool_http_requests_total{_labels(endpoint=endpoint, method=method, status=status)} {count}")
+
+            out.append("# HELP carpool_http_request_duration_seconds Request latency, by endpoint and method.")
+            out.append("# TYPE carpool_http_request_duration_seconds histogram")
+            for endpoint, stats in endpoints:
+                for method, histogram in sorted(stats.latency.items()):
+                    self._render_histogram(out, "carpool_http_request_duration_seconds", histogram,
+                                           endpoint=endpoint, method=method)
+
+            out.append("# HELP carpool_sql_statements_per_request SQL statements executed per request.")
+            out.append("# TYPE carpool_sql_statements_per_request histogram")
+            for endpoint, stats in endpoints:
+                self._render_histogram(out, "carpool_sql_statements_per_request", stats.statements, endpoint=endpoint)
+
+            out.append("# HELP carpool_sql_duration_seconds_total Time spent executing SQL, by endpoint.")
+            out.append("# TYPE carpool_sql_duration_seconds_total counter")
+            for endpoint, stats in endpoints:
+                out.append(f"carpool_sql_duration_seconds_total{_labels(endpoint=endpoint)} {stats.sql_seconds!r}")
+
+            out.append("# HELP carpool_sql_slowest_statement_seconds Slowest SQL statement seen, by endpoint.")
+            out.append("# TYPE carpool_sql_slowest_statement_seconds gauge")
+            for endpoint, stats in endpoints:
+                seconds, statement = stats.slowest
+                if statement is None:
+                    continue
+                statement = " ".join(statement.split())[:_STATEMENT_LABEL_LENGTH]
+                out.append(f"carpool_sql_slowest_statement_seconds{_labels(endpoint=endpoint, statement=statement)} {seconds!r}")
+        for collect in self._collectors:
+            out.extend(collect())
+        return "\n".join(out) + "\n"
+
+    @staticmethod
+    def _render_histogram(out, name, histogram, **labels):
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            out.append(f"{name}_bucket{_labels(**labels, le=_format_bound(bound))} {count}")
+        out.append(f"{name}_bucket{_labels(**labels, le='+Inf')} {histogram.count}")
+        out.append(f"{name}_sum{_labels(**labels)} {histogram.sum!r}")
+        out.append(f"{name}_count{_labels(**labels)} {histogram.count}")
+
+# --- SQLAlchemy cursor events ---
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._metrics_started = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_metrics_started', None)
+    if started is None or not has_request_context():
+        return
+    trace = g.get('_metrics_trace')
+    if trace is not None:
+        trace.add(statement, time.perf_counter() - started)
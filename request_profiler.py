@@ -0,0 +1,191 @@
+# request_profiler.py
+"""
+On-demand sampling profiler for individual requests.
+
+A request is profiled when it carries the PROFILER_HEADER header with the
+admin token as its value, or at random with probability
+PROFILER_SAMPLE_RATE. While it runs, a sampler thread reads the request
+thread's Python stack every PROFILER_INTERVAL_MS. The profile spans
+before_request to teardown_request, so it includes JWT decoding, the role
+decorators, the view, ORM hydration and jsonify. Stacks are recorded as
+`module:qualname` frames, root first.
+
+Finished profiles are kept in memory (the last PROFILER_MAX_PROFILES, served
+by the admin endpoints in routes/admin_routes.py) and, when
+PROFILER_OUTPUT_DIR is set, also written there as files. Both are in the
+collapsed-stack format that flamegraph.pl and speedscope read. The response
+of a profiled request carries its id in X-Profile-Id.
+
+With PROFILER_ENABLED off (the default) no hooks are registered and no
+thread is started, so requests pay nothing.
+
+Samples land when the sampler thread gets the GIL, so CPU-bound code is
+sampled about every sys.getswitchinterval() (5 ms by default) at best, and
+very short requests may have no samples.
+"""
+import hmac
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from datetime import datetime
+from flask import g, request
+
+logger = logging.getLogger(__name__)
+
+class Profile:
+    def __init__(self, endpoint, method, path):
+        self.id = uuid.uuid4().hex[:12]
+        self.endpoint = endpoint
+        self.method = method
+        self.path = path
+        self.started_at = datetime.utcnow()
+        self.started = time.perf_counter()
+        self.duration_ms = None
+        self.status = None
+        self.stacks = Counter()  # tuple of frames, root first -> samples
+
+    def collapsed(self):
+        """Collapsed-stack text: one `frame;frame;... count` line per distinct stack."""
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self):
+        return {
+            "id": self.id, "endpoint": self.endpoint, "method": self.method, "path": self.path,
+            "status": self.status, "started_at": self.started_at.isoformat(), "duration_ms": self.duration_ms,
+            "samples": sum(self.stacks.values())
+        }
+
+def _stack(frame):
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append(f"{frame.f_globals.get('__name__', '?')}:{getattr(code, 'co_qualname', code.co_name)}")
+        frame = frame.f_back
+    frames.reverse()
+    return tuple(frames)
+
+class RequestProfiler:
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._active = {}  # thread id -> Profile being sampled
+        self._profiles = deque()  # finished profiles, oldest first
+        self._wake = threading.Event()
+        self._sampler = None
+        self.enabled = False
+        self.header = 'X-Profile-Request'
+        self.token = None
+        self.sample_rate = 0.0
+        self.interval = 0.005
+        self.max_profiles = 20
+        self.output_dir = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('PROFILER_ENABLED', False)
+        self.header = app.config.get('PROFILER_HEADER', 'X-Profile-Request')
+        self.token = app.config.get('ADMIN_TOKEN')
+        self.sample_rate = app.config.get('PROFILER_SAMPLE_RATE', 0.0)
+        self.interval = app.config.get('PROFILER_INTERVAL_MS', 5) / 1000
+        self.max_profiles = app.config.get('PROFILER_MAX_PROFILES', 20)
+        self.output_dir = app.config.get('PROFILER_OUTPUT_DIR')
+        if not self.enabled:
+            return
+        if self.output_dir:
+            os.makedirs(self.output_dir, exist_ok=True)
+        app.before_request(self._start_request)
+        app.after_request(self._tag_response)
+        app.teardown_request(self._finish_request)
+
+    # --- Request hooks ---
+
+    def _wants_profile(self):
+        requested = request.headers.get(self.header)
+        if requested is not None and self.token and hmac.compare_digest(requested.encode(), self.token.encode()):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def _start_request(self):
+        if not self._wants_profile():
+            return
+        profile = Profile(request.endpoint or 'unmatched', request.method, request.path)
+        g._profile = profile
+        with self._lock:
+            self._active[threading.get_ident()] = profile
+            self._wake.set()
+        self._ensure_sampler()
+
+    def _tag_response(self, response):
+        profile = g.get('_profile')
+        if profile is not None:
+            profile.status = response.status_code
+            response.headers['X-Profile-Id'] = profile.id
+        return response
+
+    def _finish_request(self, exc):
+        profile = g.pop('_profile', None)
+        if profile is None:
+            return
+        with self._lock:
+            self._active.pop(threading.get_ident(), None)
+        profile.duration_ms = round((time.perf_counter() - profile.started) * 1000, 3)
+        if exc is not None:
+            profile.status = 500
+        with self._lock:
+            self._profiles.append(profile)
+            while len(self._profiles) > self.max_profiles:
+                self._profiles.popleft()
+        if self.output_dir:
+            self._write(profile)
+
+    def _write(self, profile):
+        name = f"{profile.started_at:%Y%m%dT%H%M%S}_{profile.endpoint}_{profile.id}.collapsed"
+        try:
+            with open(os.path.join(self.output_dir, name), "w") as f:
+                f.write(profile.collapsed())
+        except OSError:
+            logger.exception("Could not write profile %s", profile.id)
+
+    # --- Reading ---
+
+    def profiles(self):
+        """Summaries of the kept profiles, newest first."""
+        with self._lock:
+            return [profile.summary() for profile in reversed(self._profiles)]
+
+    def get(self, profile_id):
+        with self._lock:
+            return next((profile for profile in self._profiles if profile.id == profile_id), None)
+
+    # --- Sampling ---
+
+    def _ensure_sampler(self):
+        if self._sampler is not None:
+            return
+        with self._lock:
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample, name='request-profiler', daemon=True)
+                self._sampler.start()
+
+    def _sample(self):
+        while True:
+            self._wake.wait()
+            frames = sys._current_frames()
+            with self._lock:
+                if not self._active:
+                    # Cleared under the lock, so a request starting now sets it again after us
+                    self._wake.clear()
+                    frames = None
+                    continue
+                # Under the lock, so a finished profile never gets another sample
+                for thread_id, profile in self._active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        profile.stacks[_stack(frame)] += 1
+            del frames
+            time.sleep(self.interval)
@@ -0,0 +1,152 @@
+# response_cache.py
+"""
+Response cache for the anonymous read endpoints: ride search and public
+profiles.
+
+Entries are keyed on the normalized request (see the views) and kept for
+RESPONSE_CACHE_TTL_SECONDS in a bounded LRU, so a hit returns the stored body
+without touching the database. Entries are invalidated in-process when:
+  - a ride on a cached search page, or its bookings, changed,
+  - a ride was created whose route matches a cached search's text filters
+    (searches by coordinates or without filters match every new ride),
+  - the public profile of a cached user, or of a driver on a cached search
+    page (rating sort), changed.
+The TTL bounds staleness for writes handled by other worker processes, for
+new recurring templates, and for the passing of time (search windows are
+relative to now).
+"""
+import threading
+import time
+from flask import current_app
+from lru import LRUCache
+from signals import ride_changed, user_changed
+
+class _Entry:
+    __slots__ = ('body', 'status', 'headers', 'expires_at', 'ride_ids', 'user_ids', 'route_filter')
+
+    def __init__(self, body, status, headers, expires_at, ride_ids, user_ids, route_filter):
+        self.body = body
+        self.status = status
+        self.headers = headers
+        self.expires_at = expires_at
+        self.ride_ids = ride_ids
+        self.user_ids = user_ids
+        self.route_filter = route_filter
+
+def _route_matches(route_filter, route):
+    origin, destination = route
+    origin_filter, destination_filter = route_filter
+    return (origin_filter is None or origin_filter in origin.lower()) and \
+        (destination_filter is None or destination_filter in destination.lower())
+
+class ResponseCache:
+    # Only these response headers are replayed on a hit
+    HEADERS = ('Content-Type', 'X-Next-Cursor')
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._entries = LRUCache('response_cache', 5000)  # key -> _Entry
+        self._by_ride = {}  # ride id -> keys
+        self._by_user = {}  # user id -> keys
+        self._route_filters = {}  # key -> (origin substring, destination substring) for search entries
+        self.invalidations = 0
+        self.enabled = True
+        self.ttl = 10
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('RESPONSE_CACHE_ENABLED', True)
+        self.ttl = app.config.get('RESPONSE_CACHE_TTL_SECONDS', 10)
+        self._entries.max_entries = app.config.get('RESPONSE_CACHE_MAX_ENTRIES', 5000)
+        if self.enabled:
+            ride_changed.connect(self._on_ride_changed, sender=app, weak=False)
+            user_changed.connect(self._on_user_changed, sender=app, weak=False)
+
+    def get(self, key):
+        """A fresh response for the cached entry, or None."""
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key, fresh=lambda entry: entry.expires_at >= now)
+            if entry is None:
+                self._remove(key)  # expired, if present
+                return None
+        return current_app.response_class(entry.body, status=entry.status, headers=entry.headers)
+
+    def set(self, key, response, ride_ids=(), user_ids=(), route_filter=None):
+        """
+        Caches a successful response. It is dropped when one of `ride_ids` or
+        `user_ids` changes, or, with a `route_filter` of (origin, destination)
+        lowercase substrings (None matches anything), when a ride whose route
+        matches is created.
+        """
+        if not self.enabled or response.status_code != 200:
+            return response
+        headers = [(name, response.headers[name]) for name in self.HEADERS if name in response.headers]
+        entry = _Entry(response.get_data(), response.status_code, headers, time.monotonic() + self.ttl,
+                       set(ride_ids), set(user_ids), route_filter)
+        with self._lock:
+            self._remove(key)
+            for evicted_key, evicted in self._entries.put(key, entry):
+                self._unindex(evicted_key, evicted)
+            for ride_id in entry.ride_ids:
+                self._by_ride.setdefault(ride_id, set()).add(key)
+            for user_id in entry.user_ids:
+                self._by_user.setdefault(user_id, set()).add(key)
+            if route_filter is not None:
+                self._route_filters[key] = route_filter
+        return response
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_ride.clear()
+            self._by_user.clear()
+            self._route_filters.clear()
+
+    def _remove(self, key):
+        """Drops an entry and its reverse-index references; called with the lock held."""
+        entry = self._entries.pop(key)
+        if entry is None:
+            return False
+        self._unindex(key, entry)
+        return True
+
+    def _unindex(self, key, entry):
+        """Drops the reverse-index references of a removed entry; called with the lock held."""
+        for index, ids in ((self._by_ride, entry.ride_ids), (self._by_user, entry.user_ids)):
+            for id_ in ids:
+                keys = index.get(id_)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del index[id_]
+        self._route_filters.pop(key, None)
+
+    def _invalidate(self, keys):
+        """Called with the lock held."""
+        for key in keys:
+            if self._remove(key):
+                self.invalidations += 1
+
+    def _on_ride_changed(self, sender, ride_id=None, route=None, **extra):
+        with self._lock:
+            affected = set(self._by_ride.get(ride_id, ()))
+            if route is not None:
+                affected.update(key for key, route_filter in self._route_filters.items()
+                                if _route_matches(route_filter, route))
+            self._invalidate(affected)
+
+    def _on_user_changed(self, sender, user_ids=(), **extra):
+        with self._lock:
+            affected = set()
+            for user_id in user_ids:
+                affected.update(self._by_user.get(user_id, ()))
+            self._invalidate(affected)
+
+    def metrics(self):
+        """Hit/miss/invalidation counters as Prometheus text lines."""
+        with self._lock:
+            return self._entries.metrics(invalidations=self.invalidations)
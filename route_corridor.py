@@ -0,0 +1,241 @@
+# route_corridor.py
+"""
+En-route ("corridor") matching for ride search.
+
+A ride matches a rider when both the pickup and the drop-off lie within
+`corridor_km` of its route, the pickup coming first along the route. The
+route is the ride's `route_polyline` (encoded polyline format, precision 5),
+or the straight origin -> destination segment when it has none. Matches are
+ranked by the detour the driver makes to serve the rider, estimated as the
+out-and-back distance to both points.
+
+Routes are decoded once per process into compact `array('d')` buffers of
+lat, lng pairs, with their bounding box, kept in `RouteGeometryCache`, a
+bounded LRU keyed on ride id. A polyline is only set when its ride is
+created, so entries never go stale. Per query, candidates come from the
+route bounding-box index (see spatial_index.ride_route_near), so only rides
+whose box reaches both the pickup and the drop-off are decoded; their routes
+are concatenated and the point-to-segment distances are computed at once,
+using an equirectangular projection around the pickup (well under 1% error at
+city scale).
+
+Needs NumPy, which is optional: without it `available()` is False.
+"""
+import math
+import threading
+from array import array
+from sqlalchemy import select
+from lru import LRUCache
+from models import db, Ride
+from spatial_index import EARTH_RADIUS_KM, INDEXED_STATUSES, bounding_box, ride_route_near
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is an optional dependency
+    np = None
+
+# Polylines are loaded for this many cache misses per query
+_LOAD_CHUNK = 500
+
+class InvalidPolyline(ValueError):
+    pass
+
+def decode_polyline(encoded, precision=5):
+    """Decodes an encoded polyline into an `array('d')` of lat, lng pairs."""
+    factor = 10 ** precision
+    values = array('d')
+    current = [0, 0]
+    index, length = 0, len(encoded)
+    while index < length:
+        for axis in (0, 1):
+            shift = result = 0
+            while True:
+                if index >= length:
+                    raise InvalidPolyline("Truncated polyline")
+                chunk = ord(encoded[index]) - 63
+                index += 1
+                if not 0 <= chunk < 64:
+                    raise InvalidPolyline("Invalid polyline character")
+                result |= (chunk & 0x1f) << shift
+                shift += 5
+                if chunk < 0x20:
+                    break
+            current[axis] += ~(result >> 1) if result & 1 else result >> 1
+            values.append(current[axis] / factor)
+    return values
+
+def route_bounds(points):
+    """(min_lat, max_lat, min_lng, max_lng) of decoded lat, lng pairs; stored with the polyline."""
+    lats, lngs = points[0::2], points[1::2]
+    return min(lats), max(lats), min(lngs), max(lngs)
+
+def available():
+    return np is not None
+
+class _Route:
+    """A decoded route: lat, lng pairs and their bounding box."""
+    __slots__ = ('points', 'min_lat', 'max_lat', 'min_lng', 'max_lng')
+
+    def __init__(self, points):
+        self.points = points
+        lats, lngs = points[0::2], points[1::2]
+        self.min_lat, self.max_lat = min(lats), max(lats)
+        self.min_lng, self.max_lng = min(lngs), max(lngs)
+
+    def near(self, box):
+        """Whether the route's bounding box overlaps `box` (min_lat, max_lat, min_lng, max_lng)."""
+        return box[0] <= self.max_lat and self.min_lat <= box[1] and box[2] <= self.max_lng and self.min_lng <= box[3]
+
+def _decode_route(polyline, origin, destination):
+    """
+    The route of a ride, with at least two points, or None when it has no
+    usable geometry. An undecodable polyline falls back to the straight
+    segment.
+    """
+    points = None
+    if polyline:
+        try:
+            points = decode_polyline(polyline)
+        except InvalidPolyline:
+            points = None
+    if not points:
+        if None in origin or None in destination:
+            return None
+        points = array('d', (*origin, *destination))
+    elif len(points) == 2:
+        points.extend(points)
+    return _Route(points)
+
+class RouteGeometryCache:
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._entries = LRUCache('route_geometry_cache', 100000)  # ride id -> _Route, or None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self._entries.max_entries = app.config.get('ROUTE_GEOMETRY_CACHE_MAX_ENTRIES', 100000)
+
+    def routes(self, ride_ids):
+        """
+        The `_Route` of each ride in `ride_ids`, in order; None for rides
+        without geometry. Misses are decoded from `route_polyline` and cached.
+        """
+        found, missing = [], []
+        with self._lock:
+            for ride_id in ride_ids:
+                route = self._entries.get(ride_id, False)
+                if route is False:
+                    missing.append(ride_id)
+                found.append(route)
+        if not missing:
+            return found
+
+        loaded = {}
+        for start in range(0, len(missing), _LOAD_CHUNK):
+            rows = db.session.query(
+                Ride.id, Ride.route_polyline,
+                Ride.origin_lat, Ride.origin_lng, Ride.destination_lat, Ride.destination_lng
+            ).filter(Ride.id.in_(missing[start:start + _LOAD_CHUNK]))
+            for row in rows:
+                loaded[row.id] = _decode_route(
+                    row.route_polyline,
+                    (row.origin_lat, row.origin_lng), (row.destination_lat, row.destination_lng)
+                )
+        with self._lock:
+            for ride_id, route in loaded.items():
+                self._entries.put(ride_id, route)
+        return [loaded.get(ride_id) if route is False else route for ride_id, route in zip(ride_ids, found)]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def metrics(self):
+        """Hit/miss counters as Prometheus text lines."""
+        with self._lock:
+            return self._entries.metrics()
+
+def _nearest_on_routes(px, py, ax, ay, bx, by, owner, starts, boundary):
+    """
+    For each route, the distance from (px, py) to the nearest of its segments
+    and the position of that nearest point along the concatenated routes
+    (only comparable within one route). Route i owns the segments from
+    `starts[i]`; `boundary` marks the ones joining two routes.
+    """
+    dx, dy = bx - ax, by - ay
+    lengths_sq = dx * dx + dy * dy
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = np.clip(((px - ax) * dx + (py - ay) * dy) / lengths_sq, 0.0, 1.0)
+    t[lengths_sq == 0] = 0.0
+    distance = np.hypot(ax + t * dx - px, ay + t * dy - py)
+    distance[boundary] = np.inf
+
+    lengths = np.sqrt(lengths_sq)
+    lengths[boundary] = 0.0
+    position = np.cumsum(lengths) - lengths + t * lengths
+
+    # The first segment of each route at its minimum distance
+    nearest = np.minimum.reduceat(distance, starts)
+    hits = np.flatnonzero(distance == nearest[owner])
+    _, first = np.unique(owner[hits], return_index=True)
+    return nearest, position[hits[first]]
+
+def match_rides(geometry_cache, pickup, dropoff, corridor_km, start_time=None, end_time=None):
+    """
+    Active rides departing in [start_time, end_time] whose route passes within
+    `corridor_km` of `pickup` and then `dropoff` (lat, lng pairs), as
+    (detour km, pickup distance km, drop-off distance km, ride) tuples
+    ordered by detour, then ride id. Routes come from `geometry_cache`.
+    """
+    # A point within corridor_km of a route lies in its bounding box grown by corridor_km
+    pickup_box = bounding_box(*pickup, corridor_km)
+    dropoff_box = bounding_box(*dropoff, corridor_km)
+    query = select(Ride.id).where(Ride.status.in_(INDEXED_STATUSES), ride_route_near(pickup_box, dropoff_box))
+    if start_time is not None:
+        query = query.where(Ride.departure_time.between(start_time, end_time))
+    ride_ids = db.session.execute(query).scalars().all()
+
+    # Polylines indexed without a stored box (the whole world) are checked against their decoded one
+    candidates = [
+        (ride_id, route) for ride_id, route in zip(ride_ids, geometry_cache.routes(ride_ids))
+        if route is not None and route.near(pickup_box) and route.near(dropoff_box)
+    ]
+    if not candidates:
+        return []
+
+    counts = np.fromiter((len(route.points) // 2 for _, route in candidates), dtype=np.int64, count=len(candidates))
+    flat = np.concatenate([np.frombuffer(route.points, dtype=np.float64) for _, route in candidates])
+    # Project to km around the pickup
+    km_per_degree = math.pi / 180 * EARTH_RADIUS_KM
+    x_scale = km_per_degree * math.cos(math.radians(pickup[0]))
+    xs, ys = flat[1::2] * x_scale, flat[0::2] * km_per_degree
+
+    # Segment i joins points i and i + 1; the last point of a route starts no real segment
+    ends = np.cumsum(counts)
+    starts = np.concatenate(([0], ends[:-1]))
+    boundary = np.zeros(len(xs) - 1, dtype=bool)
+    boundary[ends[:-1] - 1] = True
+    owner = np.repeat(np.arange(len(candidates)), counts)[:-1]
+    segments = (xs[:-1], ys[:-1], xs[1:], ys[1:], owner, starts, boundary)
+
+    pickup_km, pickup_at = _nearest_on_routes(pickup[1] * x_scale, pickup[0] * km_per_degree, *segments)
+    dropoff_km, dropoff_at = _nearest_on_routes(dropoff[1] * x_scale, dropoff[0] * km_per_degree, *segments)
+
+    matched = np.flatnonzero((pickup_km <= corridor_km) & (dropoff_km <= corridor_km) & (pickup_at <= dropoff_at))
+    if not len(matched):
+        return []
+    detour = 2 * (pickup_km + dropoff_km)
+    rides = {}
+    matched_ids = [candidates[i][0] for i in matched]
+    for start in range(0, len(matched_ids), _LOAD_CHUNK):
+        rides.update((ride.id, ride) for ride in db.session.query(
+            Ride.id, Ride.driver_id, Ride.origin_name, Ride.destination_name,
+            Ride.departure_time, Ride.available_seats
+        ).filter(Ride.id.in_(matched_ids[start:start + _LOAD_CHUNK])))
+    results = [
+        (float(detour[i]), float(pickup_km[i]), float(dropoff_km[i]), rides[ride_id])
+        for i, ride_id in zip(matched, matched_ids) if ride_id in rides
+    ]
+    results.sort(key=lambda match: (match[0], match[3].id))
+    return results
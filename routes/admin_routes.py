@@ -0,0 +1,47 @@
+# routes/admin_routes.py
+from flask import Blueprint, current_app, jsonify, request
+from auth_decorators import admin_required
+from extensions import request_profiler
+import batch_matcher
+
+admin_bp = Blueprint('admin_bp', __name__)
+
+@admin_bp.route("/admin/profiles", methods=["GET"])
+@admin_required
+def list_profiles():
+    return jsonify({"enabled": request_profiler.enabled, "profiles": request_profiler.profiles()})
+
+@admin_bp.route("/admin/profiles/<string:id>", methods=["GET"])
+@admin_required
+def get_profile(id):
+    profile = request_profiler.get(id)
+    if profile is None:
+        return jsonify({"error": "Profile not found"}), 404
+    # Collapsed stacks, ready for flamegraph.pl or speedscope
+    return profile.collapsed(), 200, {'Content-Type': 'text/plain; charset=utf-8'}
+
+@admin_bp.route("/admin/batch-match", methods=["POST"])
+@admin_required
+def batch_match():
+    """
+    Assigns a batch of rider requests to scheduled rides and books them
+    (or only reports the assignment with "dry_run": true).
+    """
+    if not batch_matcher.available():
+        return jsonify({"error": "Batch matching is not available on this server."}), 501
+    data = request.get_json() or {}
+    config = current_app.config
+    try:
+        requests = batch_matcher.parse_requests(data.get('requests') or [])
+        max_detour_km = float(data.get('max_detour_km', config['BATCH_MATCH_MAX_DETOUR_KM']))
+    except batch_matcher.InvalidRequest as e:
+        return jsonify({"error": str(e)}), 400
+    except (TypeError, ValueError):
+        return jsonify({"error": "max_detour_km must be a number"}), 400
+    return jsonify(batch_matcher.run_batch(
+        requests,
+        max_detour_km=max_detour_km,
+        km_per_minute=config['BATCH_MATCH_KM_PER_MINUTE'],
+        candidates=config['BATCH_MATCH_CANDIDATES'],
+        dry_run=bool(data.get('dry_run', False))
+    ))
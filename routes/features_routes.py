@@ -2,38 +2,44 @@
 from flask import Blueprint, request, jsonify
 from models import db, Rating, User, Ride, Booking, UserTripPattern
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from sqlalchemy import desc
+from sqlalchemy import and_, desc, func, select
+from db_utils import upsert_insert
+import uuid
+from ratings import record_rating
+from place_index import ride_name_contains
+from extensions import recommendation_cache, journey_estimator
+from signals import notify_user_changed
 
 features_bp = Blueprint('features_bp', __name__)
 
 def _update_trip_patterns(completed_ride: Ride):
     """
     Called when a ride is completed. Logs the trip for the driver and all
-    riders to build their frequent trip patterns.
+    riders to build their frequent trip patterns, with a single upsert keyed
+    on _user_trip_uc. Returns the ids of the users whose patterns changed.
     """
-    users_on_ride = [completed_ride.driver]
-    confirmed_bookings = Booking.query.filter_by(ride_id=completed_ride.id, status='confirmed').all()
-    for booking in confirmed_bookings:
-        users_on_ride.append(booking.rider)
-    
-    for user in users_on_ride:
-        if not user: continue
-        
-        pattern = UserTripPattern.query.filter_by(
-            user_id=user.id,
-            origin_name=completed_ride.origin_name,
-            destination_name=completed_ride.destination_name
-        ).first()
-
-        if pattern:
-            pattern.trip_count += 1
-        else:
-            new_pattern = UserTripPattern(
-                user_id=user.id,
-                origin_name=completed_ride.origin_name,
-                destination_name=completed_ride.destination_name
-            )
-            db.session.add(new_pattern)
+    rider_ids = db.session.execute(
+        select(Booking.rider_id).filter_by(ride_id=completed_ride.id, status='confirmed')
+    ).scalars().all()
+    # dict.fromkeys de-duplicates while keeping order; one row per user per statement
+    participants = list(dict.fromkeys([completed_ride.driver_id, *rider_ids]))
+
+    patterns = UserTripPattern.__table__
+    stmt = upsert_insert(patterns).values([
+        {
+            "id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "origin_name": completed_ride.origin_name,
+            "destination_name": completed_ride.destination_name,
+            "trip_count": 1
+        } for user_id in participants
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[patterns.c.user_id, patterns.c.origin_name, patterns.c.destination_name],
+        set_={"trip_count": patterns.c.trip_count + 1}
+    )
+    db.session.execute(stmt)
+    return participants
 
 @features_bp.route("/ratings", methods=["POST"])
 @jwt_required()
@@ -71,17 +77,12 @@ def submit_rating():
         review_text=data.get('review_text')
     )
 
-    if rating_type == 'driver_rating':
-        old_total = reviewee.avg_driver_rating * reviewee.driver_rating_count
-        reviewee.driver_rating_count += 1
-        reviewee.avg_driver_rating = (old_total + rating_value) / reviewee.driver_rating_count
-    else:
-        old_total = reviewee.avg_rider_rating * reviewee.rider_rating_count
-        reviewee.rider_rating_count += 1
-        reviewee.avg_rider_rating = (old_total + rating_value) / reviewee.rider_rating_count
-
     db.session.add(new_rating)
+    record_rating(reviewee_id, rating_type, rating_value)
+    # ratings_given_by_me and the average ratings in the ride detail changed
+    ride.version = Ride.version + 1
     db.session.commit()
+    notify_user_changed([reviewee_id])
     
     return jsonify({"message": "Rating submitted successfully"}), 201
 
@@ -94,7 +95,7 @@ def submit_rating():
 @features_bp.route("/ai/recommendations", methods=["GET"])
 @jwt_required()
 def get_recommendations():
-    rides = Ride.query.filter(Ride.destination_name.ilike('%FCCU%'), Ride.status=='scheduled').limit(5).all()
+    rides = Ride.query.filter(ride_name_contains('destination', 'FCCU'), Ride.status=='scheduled').limit(5).all()
     return jsonify([{
         "id": r.id, "origin_name": r.origin_name, "destination_name": r.destination_name,
         "departure_time": r.departure_time.isoformat(), "available_seats": r.available_seats
@@ -102,14 +103,27 @@ def get_recommendations():
 
 @features_bp.route("/ai/estimate-journey", methods=["GET"])
 def estimate_journey():
-    origin = request.args.get('origin')
-    destination = request.args.get('destination')
-    if not origin or not destination:
-        return jsonify({"error": "Origin and destination are required"}), 400
-        
+    # Each end is given by coordinates, or by a place name resolved from past rides
+    ends = []
+    for name_arg, lat_arg, lng_arg in (('origin', 'origin_lat', 'origin_lng'), ('destination', 'dest_lat', 'dest_lng')):
+        lat = request.args.get(lat_arg, type=float)
+        lng = request.args.get(lng_arg, type=float)
+        name = request.args.get(name_arg)
+        if (lat is None or lng is None) and not name:
+            return jsonify({"error": "Origin and destination are required"}), 400
+        ends.append((name_arg, name, (lat, lng) if lat is not None and lng is not None else None))
+
+    points = [point if point is not None else journey_estimator.place(name) for _, name, point in ends]
+    if None in points:
+        # A name no past ride used (or not loaded yet): the typical journey, from no specific rides
+        distance_km, duration_minutes = journey_estimator.typical()
+        samples = 0
+    else:
+        distance_km, duration_minutes, samples = journey_estimator.estimate(*points)
     return jsonify({
-        "estimated_duration_minutes": 25,
-        "estimated_distance_km": 10.5
+        "estimated_duration_minutes": round(duration_minutes, 1),
+        "estimated_distance_km": round(distance_km, 1),
+        "based_on_rides": samples
     })
 
 # --- AI ENDPOINT FOR PATTERN-BASED RECOMMENDATIONS ---
@@ -117,30 +131,47 @@ def estimate_journey():
 @jwt_required()
 def get_pattern_recommendations():
     user_id = get_jwt_identity()
-    
-    frequent_patterns = UserTripPattern.query.filter_by(user_id=user_id)\
+
+    cached = recommendation_cache.get(user_id)
+    if cached is not None:
+        return jsonify(cached)
+
+    # The user's top 3 routes and the next 2 open rides on each, in one query
+    top_patterns = select(UserTripPattern.origin_name, UserTripPattern.destination_name, UserTripPattern.trip_count)\
+        .where(UserTripPattern.user_id == user_id)\
         .order_by(desc(UserTripPattern.trip_count))\
-        .limit(3).all()
-
-    if not frequent_patterns:
-        return jsonify([])
-
-    recommendations = []
-    for pattern in frequent_patterns:
-        matching_rides = Ride.query.filter(
-            Ride.origin_name == pattern.origin_name,
-            Ride.destination_name == pattern.destination_name,
-            Ride.status == 'scheduled',
-            Ride.driver_id != user_id
-        ).order_by(Ride.departure_time).limit(2).all()
-        
-        for ride in matching_rides:
-            recommendations.append({
-                "id": ride.id,
-                "origin_name": ride.origin_name,
-                "destination_name": ride.destination_name,
-                "departure_time": ride.departure_time.isoformat(),
-                "reason": f"Matches your frequent trip from {pattern.origin_name} to {pattern.destination_name}"
-            })
-
-    return jsonify(recommendations)
\ No newline at end of file
+        .limit(3).subquery()
+    ranked_rides = select(
+        Ride.id, Ride.origin_name, Ride.destination_name, Ride.departure_time,
+        top_patterns.c.trip_count,
+        func.row_number().over(
+            partition_by=(Ride.origin_name, Ride.destination_name),
+            order_by=(Ride.departure_time, Ride.id)
+        ).label('route_rank')
+    ).join(top_patterns, and_(
+        Ride.origin_name == top_patterns.c.origin_name,
+        Ride.destination_name == top_patterns.c.destination_name
+    )).where(
+        Ride.status == 'scheduled',
+        Ride.available_seats > 0,
+        Ride.driver_id != user_id
+    ).subquery()
+    matching_rides = db.session.execute(
+        select(ranked_rides)
+        .where(ranked_rides.c.route_rank <= 2)
+        .order_by(desc(ranked_rides.c.trip_count), ranked_rides.c.origin_name,
+                  ranked_rides.c.destination_name, ranked_rides.c.route_rank)
+    ).all()
+
+    recommendations = [{
+        "id": ride.id,
+        "origin_name": ride.origin_name,
+        "destination_name": ride.destination_name,
+        "departure_time": ride.departure_time.isoformat(),
+        "reason": f"Matches your frequent trip from {ride.origin_name} to {ride.destination_name}"
+    } for ride in matching_rides]
+
+    # Routes are cached too, so a new ride on any of them invalidates the entry
+    routes = db.session.execute(select(top_patterns.c.origin_name, top_patterns.c.destination_name)).all()
+    recommendation_cache.set(user_id, recommendations, [tuple(route) for route in routes])
+    return jsonify(recommendations)
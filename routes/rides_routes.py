@@ -1,11 +1,27 @@
 # routes/rides_routes.py
-from flask import Blueprint, request, jsonify
-from models import db, Ride, Booking, User, Rating, RecurringRide
+from flask import Blueprint, request, jsonify, abort, current_app, stream_with_context
+from models import db, Ride, Booking, User, Rating, RecurringRide, UserRatingAggregate, DEFAULT_RATING
 from flask_jwt_extended import get_jwt_identity, jwt_required
-from auth_decorators import driver_required, rider_required
-from datetime import datetime, timedelta, date, time
-from sqlalchemy import desc, func
+from auth_decorators import driver_required, rider_required, current_role
+from datetime import datetime, timedelta, time
+from sqlalchemy import and_, desc, func, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, selectinload
+import hashlib
+import heapq
+import json
 import math
+from itertools import islice
+from time import monotonic
+from spatial_index import ride_point_within
+from place_index import autocomplete_places, ride_name_contains
+import route_corridor
+from pickup_order import order_stops
+from extensions import ride_snapshot, route_geometry_cache, pickup_order_cache, location_buffer, recurring_materializer, response_cache
+from recurring_occurrences import materialize_occurrence, materialized_ride_id, parse_virtual_ride_id, search_occurrences, virtual_ride_details
+from signals import notify_ride_changed, notify_trip_patterns_changed, notify_user_changed
+from ratings import driver_rating_indexed, record_rating
+from pagination import InvalidCursor, decode_cursor, encode_cursor, page_size
 
 # Import the helper function from features_routes
 # Use a relative import within the package
@@ -15,10 +31,6 @@ rides_bp = Blueprint('rides_bp', __name__)
 
 # Helper function for penalty ratings
 def _apply_penalty_rating(user_id, ride_id, penalty_rating, rating_type, review_text):
-    user = User.query.get(user_id)
-    if not user:
-        return
-
     new_rating = Rating(
         ride_id=ride_id,
         reviewer_id=None, # System-generated
@@ -27,17 +39,8 @@ def _apply_penalty_rating(user_id, ride_id, penalty_rating, rating_type, review_
         rating_value=penalty_rating,
         review_text=review_text
     )
-    
-    if rating_type == 'driver_rating':
-        old_total = user.avg_driver_rating * user.driver_rating_count
-        user.driver_rating_count += 1
-        user.avg_driver_rating = (old_total + penalty_rating) / user.driver_rating_count
-    else: # rider_rating
-        old_total = user.avg_rider_rating * user.rider_rating_count
-        user.rider_rating_count += 1
-        user.avg_rider_rating = (old_total + penalty_rating) / user.rider_rating_count
-        
     db.session.add(new_rating)
+    record_rating(user_id, rating_type, penalty_rating)
 
 @rides_bp.route("/rides", methods=["POST"])
 @driver_required
@@ -49,6 +52,14 @@ def create_ride():
     if not (6 <= departure_time.hour <= 22):
         return jsonify({"error": "Rides can only be scheduled between 6:00 AM and 10:00 PM."}), 400
 
+    route_polyline = data.get('route_polyline') or None
+    route_box = (None, None, None, None)
+    if route_polyline is not None:
+        try:
+            route_box = route_corridor.route_bounds(route_corridor.decode_polyline(route_polyline))
+        except (route_corridor.InvalidPolyline, TypeError):
+            return jsonify({"error": "Invalid route_polyline. Use the encoded polyline format."}), 400
+
     new_ride = Ride(
         driver_id=driver_id,
         origin_name=data['origin_name'],
@@ -59,10 +70,16 @@ def create_ride():
         destination_lng=data.get('destination_lng'),
         departure_time=departure_time,
         total_seats=data['total_seats'],
-        available_seats=data['total_seats']
+        available_seats=data['total_seats'],
+        route_polyline=route_polyline,
+        route_min_lat=route_box[0],
+        route_max_lat=route_box[1],
+        route_min_lng=route_box[2],
+        route_max_lng=route_box[3]
     )
     db.session.add(new_ride)
     db.session.commit()
+    notify_ride_changed(new_ride.id, route=(data['origin_name'], data['destination_name']))
     return jsonify({"message": "Ride created", "ride_id": new_ride.id}), 201
 
 @rides_bp.route("/rides", methods=["GET"])
@@ -72,6 +89,8 @@ def search_rides():
     time_str = request.args.get('time')
     window_minutes = request.args.get('window_minutes', 30, type=int)
     sort_by = request.args.get('sort_by')
+    limit = page_size(request.args.get('limit', type=int))
+    cursor = request.args.get('cursor')
     
     # Coordinate-based search parameters
     origin_lat = request.args.get('origin_lat', type=float)
@@ -79,87 +98,230 @@ def search_rides():
     dest_lat = request.args.get('dest_lat', type=float)
     dest_lng = request.args.get('dest_lng', type=float)
     radius_km = 1.0
+    # En-route mode: rides passing near both points, ranked by detour
+    en_route = request.args.get('match') == 'corridor'
+    corridor_km = request.args.get('corridor_km', current_app.config['ROUTE_CORRIDOR_KM'], type=float)
+
+    start_time = end_time = None
+    if time_str:
+        try:
+            center_time = datetime.fromisoformat(time_str)
+        except ValueError:
+            return jsonify({"error": "Invalid time format. Please use ISO 8601 format."}), 400
+        start_time = center_time - timedelta(minutes=window_minutes)
+        end_time = center_time + timedelta(minutes=window_minutes)
+
+    # Pages are keyed on (departure_time, id), (driver rating, id) when sorting by
+    # rating, or (detour, id) en route
+    after = None
+    if cursor:
+        try:
+            after = decode_cursor(cursor, float if sort_by == 'rating' or en_route else datetime, str)
+        except InvalidCursor:
+            return jsonify({"error": "Invalid cursor"}), 400
+
+    has_origin_point = origin_lat is not None and origin_lng is not None
+    has_dest_point = dest_lat is not None and dest_lng is not None
+
+    if en_route:
+        if not (has_origin_point and has_dest_point):
+            return jsonify({"error": "En-route search needs origin_lat, origin_lng, dest_lat and dest_lng."}), 400
+        if not (math.isfinite(corridor_km) and corridor_km > 0):
+            return jsonify({"error": "corridor_km must be a positive number."}), 400
+        max_corridor_km = current_app.config['ROUTE_CORRIDOR_MAX_KM']
+        if corridor_km > max_corridor_km:
+            return jsonify({"error": f"corridor_km must be at most {max_corridor_km:g}."}), 400
+        if not route_corridor.available():
+            return jsonify({"error": "En-route search is not available on this server."}), 501
+
+    by_rating = sort_by == 'rating' and not en_route
+
+    # Anonymous searches repeat a lot; the key holds only what the results depend on
+    # (text filters are case-insensitive and ignored when coordinates are given)
+    origin_filter = None if has_origin_point else (origin.lower() if origin else None)
+    dest_filter = None if has_dest_point else (dest.lower() if dest else None)
+    cache_key = (
+        'rides', origin_filter, dest_filter,
+        (origin_lat, origin_lng) if has_origin_point else None,
+        (dest_lat, dest_lng) if has_dest_point else None,
+        start_time, end_time, by_rating, corridor_km if en_route else None, limit, cursor
+    )
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    # New rides can only land on this page if their route matches the text filters
+    route_filter = (origin_filter, dest_filter)
+
+    if en_route:
+        matches = route_corridor.match_rides(
+            route_geometry_cache, (origin_lat, origin_lng), (dest_lat, dest_lng), corridor_km,
+            start_time=start_time, end_time=end_time
+        )
+        results = []
+        for detour, pickup_km, dropoff_km, r in matches:
+            if after and (detour, r.id) <= (after[0], after[1]):
+                continue
+            results.append(((detour, r.id), {
+                "id": r.id, "driver_id": r.driver_id, "origin_name": r.origin_name,
+                "destination_name": r.destination_name, "departure_time": r.departure_time.isoformat(),
+                "available_seats": r.available_seats, "detour_km": round(detour, 3),
+                "pickup_distance_km": round(pickup_km, 3), "dropoff_distance_km": round(dropoff_km, 3)
+            }))
+            if len(results) > limit:
+                break
+        # Recurring templates have no route geometry, so occurrences are not matched en route
+        return _ride_page(results, (), limit, False, cache_key, route_filter)
+
+    # Occurrences of recurring templates that have no ride row yet
+    occurrence_start = start_time
+    if after and not by_rating and (start_time is None or after[0] > start_time):
+        occurrence_start = after[0]
+    occurrence_end = end_time or datetime.now() + timedelta(days=current_app.config['RECURRING_SEARCH_HORIZON_DAYS'])
+    occurrences = search_occurrences(
+        origin=origin, destination=dest,
+        origin_point=(origin_lat, origin_lng) if has_origin_point else None,
+        destination_point=(dest_lat, dest_lng) if has_dest_point else None,
+        radius_km=radius_km, sort_by=sort_by, start_time=occurrence_start, end_time=occurrence_end,
+        batch_size=limit + 1
+    )
+    if after:
+        after_key = (-after[0], after[1]) if by_rating else (after[0], after[1])
+        occurrences = (entry for entry in occurrences if entry[0] > after_key)
+
+    # --- Serve from the in-process snapshot when enabled ---
+    if ride_snapshot.enabled:
+        results = ride_snapshot.search(
+            origin=origin, destination=dest,
+            origin_point=(origin_lat, origin_lng) if has_origin_point else None,
+            destination_point=(dest_lat, dest_lng) if has_dest_point else None,
+            radius_km=radius_km, start_time=start_time, end_time=end_time, sort_by=sort_by,
+            after=after, limit=limit
+        )
+        return _ride_page(results, occurrences, limit, by_rating, cache_key, route_filter)
 
     query = Ride.query.filter(Ride.status.in_(['scheduled', 'in_progress']))
 
     # --- Coordinate-based search takes precedence ---
-    if origin_lat is not None and origin_lng is not None:
-        # Haversine formula to find rides with origin within 1km radius
-        origin_lat_rad = math.radians(origin_lat)
-        
-        ride_origin_lat_rad = Ride.origin_lat * (math.pi / 180.0)
-        dlat_origin = ride_origin_lat_rad - origin_lat_rad
-        dlng_origin = (Ride.origin_lng * (math.pi / 180.0)) - math.radians(origin_lng)
-        
-        # FIX: Use multiplication instead of the power operator (**)
-        a_origin = func.sin(dlat_origin / 2) * func.sin(dlat_origin / 2) + \
-                   func.cos(origin_lat_rad) * func.cos(ride_origin_lat_rad) * \
-                   func.sin(dlng_origin / 2) * func.sin(dlng_origin / 2)
-        c_origin = 2 * func.atan2(func.sqrt(a_origin), func.sqrt(1 - a_origin))
-        distance_km_origin = 6371 * c_origin # Earth radius in km
-        
-        query = query.filter(Ride.origin_lat != None, Ride.origin_lng != None, distance_km_origin <= radius_km)
+    # Candidates are narrowed with the spatial index before the exact haversine check
+    if has_origin_point:
+        query = query.filter(ride_point_within('origin', origin_lat, origin_lng, radius_km))
     elif origin:
         # Fallback to text search if no origin coordinates
-        query = query.filter(Ride.origin_name.ilike(f"%{origin}%"))
+        query = query.filter(ride_name_contains('origin', origin))
 
-    if dest_lat is not None and dest_lng is not None:
-        # Haversine formula for destination
-        dest_lat_rad = math.radians(dest_lat)
-        
-        ride_dest_lat_rad = Ride.destination_lat * (math.pi / 180.0)
-        dlat_dest = ride_dest_lat_rad - dest_lat_rad
-        dlng_dest = (Ride.destination_lng * (math.pi / 180.0)) - math.radians(dest_lng)
-
-        # FIX: Use multiplication instead of the power operator (**)
-        a_dest = func.sin(dlat_dest / 2) * func.sin(dlat_dest / 2) + \
-                 func.cos(dest_lat_rad) * func.cos(ride_dest_lat_rad) * \
-                 func.sin(dlng_dest / 2) * func.sin(dlng_dest / 2)
-        c_dest = 2 * func.atan2(func.sqrt(a_dest), func.sqrt(1 - a_dest))
-        distance_km_dest = 6371 * c_dest
-
-        query = query.filter(Ride.destination_lat != None, Ride.destination_lng != None, distance_km_dest <= radius_km)
+    if has_dest_point:
+        query = query.filter(ride_point_within('destination', dest_lat, dest_lng, radius_km))
     elif dest:
         # Fallback to text search if no destination coordinates
-        query = query.filter(Ride.destination_name.ilike(f"%{dest}%"))
+        query = query.filter(ride_name_contains('destination', dest))
     
-    if time_str:
-        try:
-            center_time = datetime.fromisoformat(time_str)
-            start_time = center_time - timedelta(minutes=window_minutes)
-            end_time = center_time + timedelta(minutes=window_minutes)
-            query = query.filter(Ride.departure_time.between(start_time, end_time))
-        except ValueError:
-            return jsonify({"error": "Invalid time format. Please use ISO 8601 format."}), 400
-
-    if sort_by == 'rating':
-        query = query.join(User, Ride.driver_id == User.id).order_by(desc(User.avg_driver_rating))
+    if start_time is not None:
+        query = query.filter(Ride.departure_time.between(start_time, end_time))
+
+    if by_rating:
+        if driver_rating_indexed():
+            # Active rides carry their driver's rating; read ix_rides_driver_rating in order
+            rating = Ride.driver_rating
+        else:
+            rating = func.coalesce(UserRatingAggregate.avg_rating, DEFAULT_RATING)
+            query = query.outerjoin(UserRatingAggregate, and_(
+                UserRatingAggregate.user_id == Ride.driver_id,
+                UserRatingAggregate.rating_type == 'driver_rating'
+            ))
+        query = query.add_columns(rating)
+        if after:
+            # The first condition bounds the index range, the second breaks ties
+            query = query.filter(rating <= after[0], or_(rating < after[0], Ride.id > after[1]))
+        query = query.order_by(desc(rating), Ride.id)
     else:
-        query = query.order_by(Ride.departure_time)
-
-    rides = query.all()
-    
-    return jsonify([{
-        "id": r.id, "driver_id": r.driver_id, "origin_name": r.origin_name,
-        "destination_name": r.destination_name, "departure_time": r.departure_time.isoformat(),
-        "available_seats": r.available_seats
-    } for r in rides])
+        if after:
+            query = query.filter(or_(
+                Ride.departure_time > after[0],
+                and_(Ride.departure_time == after[0], Ride.id > after[1])
+            ))
+        query = query.order_by(Ride.departure_time, Ride.id)
+
+    # Fetch one extra row to know whether there is a next page
+    rows = query.limit(limit + 1).all()
+    results = []
+    for row in rows:
+        r = row[0] if by_rating else row
+        key = (-row[1], r.id) if by_rating else (r.departure_time, r.id)
+        results.append((key, {
+            "id": r.id, "driver_id": r.driver_id, "origin_name": r.origin_name,
+            "destination_name": r.destination_name, "departure_time": r.departure_time.isoformat(),
+            "available_seats": r.available_seats
+        }))
+    return _ride_page(results, occurrences, limit, by_rating, cache_key, route_filter)
+
+def _ride_page(results, occurrences, limit, by_rating, cache_key, route_filter):
+    """
+    Merges up to `limit` + 1 sorted (sort key, ride) pairs with the sorted
+    recurring occurrences into one page. Search results stay a plain list;
+    the cursor for the next page goes in a header. The page is cached under
+    `cache_key`, tagged with its rides and drivers.
+    """
+    # Rides past the first limit + 1 of `results` all sort after them, so
+    # the first limit + 1 merged entries are the true head of both sources.
+    merged = list(islice(heapq.merge(results, occurrences, key=lambda entry: entry[0]), limit + 1))
+    rides = [ride for _, ride in merged[:limit]]
+    response = jsonify(rides)
+    if len(merged) > limit:
+        primary, ride_id = merged[limit - 1][0]
+        response.headers['X-Next-Cursor'] = encode_cursor(-primary if by_rating else primary, ride_id)
+    return response_cache.set(cache_key, response, ride_ids=[ride["id"] for ride in rides],
+                              user_ids=[ride["driver_id"] for ride in rides], route_filter=route_filter)
+
+@rides_bp.route("/places/autocomplete", methods=["GET"])
+def autocomplete_place_names():
+    term = request.args.get('q', '').strip()
+    limit = min(request.args.get('limit', 10, type=int), current_app.config['MAX_PAGE_SIZE'])
+    return jsonify([
+        {"name": name, "popularity": popularity}
+        for name, popularity in autocomplete_places(term, max(limit, 1))
+    ])
 
 @rides_bp.route("/rides/<string:id>", methods=["GET"])
 @jwt_required(optional=True)
 def get_ride_details(id):
-    ride = Ride.query.get_or_404(id)
-    driver = User.query.get(ride.driver_id)
-    bookings = Booking.query.filter_by(ride_id=id).all()
+    current_user_id = get_jwt_identity()
+
+    # Recurring occurrences without a ride row are described from their template
+    occurrence = parse_virtual_ride_id(id)
+    if occurrence is not None:
+        id = materialized_ride_id(*occurrence)
+        if id is None:
+            details = virtual_ride_details(*occurrence)
+            if details is None:
+                abort(404)
+            return jsonify(details)
+
+    # Answer polling clients from the version column and the participants'
+    # user and rating rows when nothing changed
+    version = db.session.query(Ride.version).filter_by(id=id).scalar()
+    if version is None:
+        abort(404)
+    etag = _ride_etag(id, version, current_user_id, _participant_rows(id))
+    if request.if_none_match.contains_weak(etag):
+        response = current_app.response_class(status=304)
+        response.set_etag(etag, weak=True)
+        return response
+
+    # Ride + driver and bookings + riders are loaded with one query each, plus
+    # one per level for the users' rating aggregates
+    ride = Ride.query.options(
+        joinedload(Ride.driver).selectinload(User.rating_aggregates),
+        selectinload(Ride.bookings).joinedload(Booking.rider).selectinload(User.rating_aggregates)
+    ).filter_by(id=id).first_or_404()
+    driver = ride.driver
     
     # Check which users the current user has already rated for this ride
     ratings_given_by_me = []
-    current_user_id = get_jwt_identity()
     if current_user_id:
-        ratings = Rating.query.filter_by(ride_id=id, reviewer_id=current_user_id).all()
+        ratings = db.session.query(Rating.reviewee_id).filter_by(ride_id=id, reviewer_id=current_user_id).all()
         ratings_given_by_me = [r.reviewee_id for r in ratings]
         
-    return jsonify({
+    response = jsonify({
         "id": ride.id, "origin_name": ride.origin_name, "destination_name": ride.destination_name,
         "departure_time": ride.departure_time.isoformat(), "total_seats": ride.total_seats,
         "available_seats": ride.available_seats, "status": ride.status,
@@ -173,10 +335,94 @@ def get_ride_details(id):
                     "full_name": b.rider.full_name,
                     "avg_rider_rating": b.rider.avg_rider_rating
                 }
-            } for b in bookings
+            } for b in ride.bookings
         ],
         "ratings_given_by_me": ratings_given_by_me
     })
+    # Clients must revalidate, which costs two small lookups when unchanged
+    participants = {driver.id: driver, **{b.rider.id: b.rider for b in ride.bookings}}
+    rows = [
+        (user.id, user.full_name, *((a.rating_type, a.rating_sum, a.rating_count) if a else (None, None, None)))
+        for user in participants.values() for a in (user.rating_aggregates or [None])
+    ]
+    response.set_etag(_ride_etag(id, ride.version, current_user_id, rows), weak=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def _participant_rows(ride_id):
+    """
+    (user id, full name, rating type, rating sum, rating count) of the ride's
+    driver and riders, one row per rating aggregate (None for users without).
+    Renames and ratings from other rides change these without bumping the
+    ride's version.
+    """
+    participants = select(Ride.driver_id).where(Ride.id == ride_id).union(
+        select(Booking.rider_id).where(Booking.ride_id == ride_id)
+    )
+    return db.session.execute(
+        select(User.id, User.full_name, UserRatingAggregate.rating_type,
+               UserRatingAggregate.rating_sum, UserRatingAggregate.rating_count)
+        .outerjoin(UserRatingAggregate, UserRatingAggregate.user_id == User.id)
+        .where(User.id.in_(participants))
+    ).all()
+
+def _ride_etag(ride_id, version, user_id, participant_rows):
+    """Weak ETag for the ride detail payload as seen by `user_id`."""
+    participants = sorted(tuple(row) for row in participant_rows)
+    return hashlib.sha1(f"{ride_id}:{version}:{user_id or ''}:{participants!r}".encode()).hexdigest()[:20]
+
+@rides_bp.route("/rides/<string:id>/pickup-order", methods=["GET"])
+@driver_required
+def get_pickup_order(id):
+    """The order in which the driver should pick up the ride's confirmed riders."""
+    ride = db.session.query(Ride.version, Ride.driver_id).filter_by(id=id).first()
+    if ride is None:
+        abort(404)
+    if ride.driver_id != get_jwt_identity():
+        return jsonify({"error": "You are not the driver of this ride"}), 403
+    payload = pickup_order_cache.get(id, ride.version)
+    if payload is None:
+        payload = _pickup_order(id)
+        # Cached under the version read first: a booking committed meanwhile bumps it
+        pickup_order_cache.set(id, ride.version, payload)
+    return jsonify(payload)
+
+def _pickup_order(ride_id):
+    ride = Ride.query.filter_by(id=ride_id).first_or_404()
+    bookings = Booking.query.options(joinedload(Booking.rider)).filter_by(
+        ride_id=ride_id, status='confirmed'
+    ).order_by(Booking.created_at, Booking.id).all()
+    located = [b for b in bookings if b.pickup_point_lat is not None and b.pickup_point_lng is not None]
+
+    start = (ride.origin_lat, ride.origin_lng) if None not in (ride.origin_lat, ride.origin_lng) else None
+    end = (ride.destination_lat, ride.destination_lng) \
+        if None not in (ride.destination_lat, ride.destination_lng) else None
+    if start is None or end is None:
+        route = route_geometry_cache.routes([ride_id])[0]
+        if route is not None:
+            start = start or (route.points[0], route.points[1])
+            end = end or (route.points[-2], route.points[-1])
+
+    order, legs = order_stops(start, [(b.pickup_point_lat, b.pickup_point_lng) for b in located], end)
+
+    def stop(booking):
+        return {
+            "booking_id": booking.id,
+            "rider": {"id": booking.rider.id, "full_name": booking.rider.full_name},
+            "pickup_point_name": booking.pickup_point_name,
+            "pickup_point_lat": booking.pickup_point_lat, "pickup_point_lng": booking.pickup_point_lng,
+        }
+
+    return {
+        "ride_id": ride_id,
+        "start": {"lat": start[0], "lng": start[1]} if start else None,
+        "end": {"lat": end[0], "lng": end[1]} if end else None,
+        # leg_km is the distance from the previous stop (or the start)
+        "stops": [{**stop(located[i]), "leg_km": round(leg, 3)} for i, leg in zip(order, legs)],
+        "total_km": round(sum(legs), 3),
+        # Bookings without pickup coordinates, in booking order
+        "unlocated": [stop(b) for b in bookings if b not in located],
+    }
 
 @rides_bp.route("/rides/<string:id>", methods=["PUT"])
 @driver_required
@@ -187,21 +433,31 @@ def update_ride(id):
     
     data = request.get_json()
     new_status = data.get('status')
+    participants = []
     
     if new_status:
         # Prevent moving backwards from a final state
         if ride.status in ['completed', 'cancelled']:
             return jsonify({"error": f"Cannot change status from '{ride.status}'"}), 400
         
+        # Timings feed the journey estimator
+        if new_status == 'in_progress' and ride.status == 'scheduled':
+            ride.started_at = datetime.utcnow()
+
         # When ride is completed, log trip patterns for all participants
         if new_status == 'completed' and ride.status != 'completed':
-            _update_trip_patterns(ride)
+            participants = _update_trip_patterns(ride)
             # Also update booking statuses to 'completed'
             Booking.query.filter_by(ride_id=ride.id, status='confirmed').update({'status': 'completed'})
+            ride.completed_at = datetime.utcnow()
             
         ride.status = new_status
+        ride.version = Ride.version + 1
         
     db.session.commit()
+    notify_ride_changed(ride.id)
+    if participants:
+        notify_trip_patterns_changed(participants)
     return jsonify({"message": "Ride updated"})
 
 @rides_bp.route("/rides/<string:id>", methods=["DELETE"])
@@ -216,39 +472,77 @@ def cancel_ride(id):
         return jsonify({"error": "Only scheduled rides can be cancelled."}), 400
 
     ride.status = 'cancelled'
+    ride.version = Ride.version + 1
     _apply_penalty_rating(
         driver_id, ride.id, 1, 'driver_rating', 'Automatic 1-star rating for cancelling a ride.'
     )
     db.session.commit()
+    notify_ride_changed(ride.id)
+    notify_user_changed([driver_id])
     return jsonify({"message": "Ride cancelled and penalty applied"})
 
 @rides_bp.route("/rides/<string:id>/bookings", methods=["POST"])
 @jwt_required()
 def book_seat(id):
+    # Booking a recurring occurrence creates its ride row, in this transaction
+    occurrence = parse_virtual_ride_id(id)
+    if occurrence is not None:
+        id = materialize_occurrence(*occurrence)
+        if id is None:
+            abort(404)
     ride = Ride.query.get_or_404(id)
     rider_id = get_jwt_identity()
-    user = User.query.get(rider_id)
 
     if ride.driver_id == rider_id:
         return jsonify({"error": "Driver cannot book their own ride"}), 400
 
-    if not user or user.role not in ['rider', 'both']:
+    if current_role() not in ['rider', 'both']:
         return jsonify({"error": "Access forbidden: Your role does not permit booking rides."}), 403
 
+    # Fast fail without taking the write lock; the conditional UPDATE below is authoritative
     if ride.available_seats <= 0:
-        return jsonify({"error": "No available seats"}), 400
-    if Booking.query.filter_by(ride_id=id, rider_id=rider_id).first():
-        return jsonify({"error": "You have already booked this ride"}), 409
+        return jsonify({"error": "No available seats"}), 409
 
     data = request.get_json()
+    # Optional pickup coordinates, used to order the driver's pickups
+    pickup_lat, pickup_lng = data.get('pickup_point_lat'), data.get('pickup_point_lng')
+    if (pickup_lat is None) != (pickup_lng is None):
+        return jsonify({"error": "Provide both pickup_point_lat and pickup_point_lng, or neither."}), 400
+    if pickup_lat is not None:
+        try:
+            pickup_lat, pickup_lng = float(pickup_lat), float(pickup_lng)
+        except (TypeError, ValueError):
+            return jsonify({"error": "pickup_point_lat and pickup_point_lng must be numbers."}), 400
+        if not (-90 <= pickup_lat <= 90 and -180 <= pickup_lng <= 180):
+            return jsonify({"error": "Pickup coordinates are out of range."}), 400
+
+    # Reserve the seat with a single conditional UPDATE in the same transaction
+    # as the booking insert, so concurrent requests can never oversell.
+    reserved = db.session.execute(
+        update(Ride)
+        .where(Ride.id == id, Ride.available_seats > 0)
+        .values(available_seats=Ride.available_seats - 1, version=Ride.version + 1)
+    ).rowcount
+    if not reserved:
+        db.session.rollback()
+        return jsonify({"error": "No available seats"}), 409
+
     new_booking = Booking(
         ride_id=id,
         rider_id=rider_id,
-        pickup_point_name=data['pickup_point_name']
+        pickup_point_name=data['pickup_point_name'],
+        pickup_point_lat=pickup_lat,
+        pickup_point_lng=pickup_lng
     )
-    ride.available_seats -= 1
     db.session.add(new_booking)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # _ride_rider_uc: the seat reservation is rolled back with the insert
+        db.session.rollback()
+        return jsonify({"error": "You have already booked this ride"}), 409
+    # A booked occurrence replaces its virtual ride in search results
+    notify_ride_changed(id, route=(ride.origin_name, ride.destination_name) if occurrence else None)
     return jsonify({"message": "Booking confirmed", "booking_id": new_booking.id}), 201
 
 @rides_bp.route("/bookings/<string:id>", methods=["DELETE"])
@@ -263,18 +557,36 @@ def cancel_booking(id):
     
     if ride.status != 'scheduled':
         return jsonify({"error": "Cannot cancel a booking for a ride that is not scheduled."}), 400
+
+    # Only the request that actually moves the booking out of 'confirmed' releases the seat
+    cancelled = db.session.execute(
+        update(Booking)
+        .where(Booking.id == id, Booking.status == 'confirmed')
+        .values(status='cancelled_by_rider')
+    ).rowcount
+    if not cancelled:
+        db.session.rollback()
+        return jsonify({"error": "This booking is not active"}), 409
         
     message = "Booking cancelled"
+    penalized = False
     time_until_departure = ride.departure_time - datetime.utcnow()
     if time_until_departure < timedelta(hours=1) and ride.status == 'scheduled':
             _apply_penalty_rating(
             current_user_id, ride.id, 2, 'rider_rating', 'Automatic 2-star rating for late cancellation (<1 hour before departure).'
         )
             message = "Booking cancelled with penalty for late cancellation"
+            penalized = True
 
-    booking.status = 'cancelled_by_rider'
-    ride.available_seats += 1
+    db.session.execute(
+        update(Ride)
+        .where(Ride.id == ride.id, Ride.available_seats < Ride.total_seats)
+        .values(available_seats=Ride.available_seats + 1, version=Ride.version + 1)
+    )
     db.session.commit()
+    notify_ride_changed(ride.id)
+    if penalized:
+        notify_user_changed([current_user_id])
     return jsonify({"message": message})
 
 @rides_bp.route("/rides/<string:id>/driver-location", methods=["GET"])
@@ -297,17 +609,91 @@ def get_driver_location(id):
     if ride.status != 'in_progress':
         return jsonify({"error": "Live location is only available for rides that are in progress."}), 404
 
-    driver = User.query.get(ride.driver_id)
-    if not driver or driver.current_lat is None or driver.current_lng is None:
+    # A position this process has not flushed yet, else the last one flushed by any process
+    position = location_buffer.get(ride.driver_id)
+    if position is None:
+        driver = User.query.get(ride.driver_id)
+        if driver:
+            position = (driver.current_lat, driver.current_lng, driver.last_location_update)
+    if position is None or position[0] is None or position[1] is None:
         return jsonify({"error": "Driver location is not available at the moment."}), 404
 
+    lat, lng, last_update = position
     return jsonify({
-        "lat": driver.current_lat,
-        "lng": driver.current_lng,
-        "last_update": driver.last_location_update.isoformat() if driver.last_location_update else None
+        "lat": lat,
+        "lng": lng,
+        "last_update": last_update.isoformat() if last_update else None
     })
 
 
+@rides_bp.route("/rides/<string:id>/driver-location/stream", methods=["GET"])
+@jwt_required(locations=['headers', 'query_string'])  # EventSource cannot send headers
+def stream_driver_location(id):
+    """
+    Server-Sent Events stream of the driver's position. Authorization runs
+    once per connection; afterwards positions are pushed as the driver's pings
+    arrive, without further DB reads. The ride's status is only re-read when a
+    write to the ride wakes the stream; rides finished by another worker end
+    the stream at the next reconnect. Clients reconnect when the stream ends.
+    """
+    ride = Ride.query.get_or_404(id)
+    current_user_id = get_jwt_identity()
+
+    is_confirmed_rider = Booking.query.filter_by(
+        ride_id=id,
+        rider_id=current_user_id,
+        status='confirmed'
+    ).first()
+
+    if not is_confirmed_rider:
+        return jsonify({"error": "You are not authorized to view this ride's location."}), 403
+
+    if ride.status != 'in_progress':
+        return jsonify({"error": "Live location is only available for rides that are in progress."}), 404
+
+    driver_id = ride.driver_id
+    # Listen before reading the position, so a ping in between is not lost
+    listener = location_buffer.listen(driver_id, ride_id=id)
+    position = location_buffer.get(driver_id)
+    if position is None:
+        driver = User.query.get(driver_id)
+        if driver and driver.current_lat is not None:
+            position = (driver.current_lat, driver.current_lng, driver.last_location_update)
+    # Don't hold a pooled connection for the lifetime of the stream
+    db.session.close()
+
+    heartbeat = current_app.config['LOCATION_STREAM_HEARTBEAT_SECONDS']
+    max_duration = current_app.config['LOCATION_STREAM_MAX_SECONDS']
+
+    def location_event(position):
+        lat, lng, last_update = position
+        payload = {"lat": lat, "lng": lng, "last_update": last_update.isoformat() if last_update else None}
+        return f"event: location\ndata: {json.dumps(payload)}\n\n"
+
+    def events():
+        if position is not None:
+            yield location_event(position)
+        deadline = monotonic() + max_duration
+        while monotonic() < deadline:
+            latest, ride_changed = listener.wait(heartbeat)
+            if ride_changed:
+                # Woken by a write to the ride (e.g. completed or cancelled): stop once it is over
+                status = db.session.query(Ride.status).filter_by(id=id).scalar()
+                db.session.close()
+                if status != 'in_progress':
+                    yield "event: end\ndata: {}\n\n"
+                    return
+            # Without a new position, keep the connection alive
+            yield location_event(latest) if latest is not None else ": keep-alive\n\n"
+
+    response = current_app.response_class(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    response.call_on_close(listener.close)
+    return response
+
 @rides_bp.route("/rides/recurring", methods=["POST"])
 @driver_required
 def create_recurring_ride():
@@ -334,36 +720,10 @@ def create_recurring_ride():
         total_seats=data['total_seats']
     )
     db.session.add(new_recurring_ride)
-    db.session.flush()
-
-    today = date.today()
-    generated_rides_count = 0
-    for i in range(7):
-        current_date = today + timedelta(days=i)
-        if str(current_date.weekday()) in days_of_week_list:
-            departure_datetime = datetime.combine(current_date, departure_time_obj)
-            if departure_datetime < datetime.now():
-                continue
-            ride_instance = Ride(
-                driver_id=driver_id,
-                origin_name=new_recurring_ride.origin_name,
-                origin_lat=new_recurring_ride.origin_lat,
-                origin_lng=new_recurring_ride.origin_lng,
-                destination_name=new_recurring_ride.destination_name,
-                destination_lat=new_recurring_ride.destination_lat,
-                destination_lng=new_recurring_ride.destination_lng,
-                departure_time=departure_datetime,
-                total_seats=data['total_seats'],
-                available_seats=data['total_seats'],
-                is_recurring=True,
-                recurring_id=new_recurring_ride.id
-            )
-            db.session.add(ride_instance)
-            generated_rides_count += 1
-            
     db.session.commit()
+    # Instances are generated by the background materializer
+    recurring_materializer.wake()
     return jsonify({
-        "message": "Recurring ride created", 
-        "recurring_ride_id": new_recurring_ride.id,
-        "generated_rides_count": generated_rides_count
+        "message": "Recurring ride created",
+        "recurring_ride_id": new_recurring_ride.id
     }), 201
\ No newline at end of file
@@ -1,15 +1,22 @@
 # routes/users_routes.py
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, current_app, request, jsonify
 from models import db, User, TokenBlocklist, Ride, Booking
 from flask_jwt_extended import (
     create_access_token, create_refresh_token, jwt_required,
     get_jwt_identity, get_jwt
 )
 from werkzeug.security import check_password_hash
+import heapq
 import re
-from extensions import limiter
-from auth_decorators import driver_required
-from datetime import datetime
+from itertools import islice
+from extensions import limiter, revocation_cache, location_buffer, response_cache
+from signals import notify_user_changed
+from auth_decorators import driver_required, current_user
+from token_revocation import next_token_version
+from datetime import datetime, timedelta
+from sqlalchemy import and_, or_
+from pagination import InvalidCursor, decode_cursor, encode_cursor, page_size
+from recurring_occurrences import search_occurrences
 
 users_bp = Blueprint('users_bp', __name__)
 
@@ -58,25 +65,37 @@ def login():
         return jsonify({"error": "Invalid credentials"}), 401
 
     # Create both access and refresh tokens for the user
-    access_token = create_access_token(identity=user.id)
-    refresh_token = create_refresh_token(identity=user.id)
-    return jsonify(access_token=access_token, refresh_token=refresh_token)
+    return jsonify(**_issue_tokens(user))
+
+def _issue_tokens(user):
+    """Access and refresh tokens carrying the user's role and token version as claims."""
+    claims = {"role": user.role, "ver": user.token_version}
+    return {
+        "access_token": create_access_token(identity=user.id, additional_claims=claims),
+        "refresh_token": create_refresh_token(identity=user.id, additional_claims=claims),
+    }
 
 @users_bp.route("/auth/refresh", methods=["POST"])
 @jwt_required(refresh=True) # This route requires a valid refresh token
 def refresh():
     current_user_id = get_jwt_identity()
-    new_access_token = create_access_token(identity=current_user_id)
+    # The refresh token passed the version check, so its role claim is still current
+    claims = get_jwt()
+    new_access_token = create_access_token(
+        identity=current_user_id,
+        additional_claims={"role": claims.get("role"), "ver": claims.get("ver", 0)}
+    )
     return jsonify(access_token=new_access_token)
 
 @users_bp.route("/auth/logout", methods=["POST"])
 @jwt_required()
 def logout():
     # To properly log out, we add the token's JTI (JWT ID) to the blocklist.
-    jti = get_jwt()["jti"]
-    revoked_token = TokenBlocklist(jti=jti)
+    claims = get_jwt()
+    revoked_token = TokenBlocklist(jti=claims["jti"], expires_at=datetime.utcfromtimestamp(claims["exp"]))
     db.session.add(revoked_token)
     db.session.commit()
+    revocation_cache.add(revoked_token.jti, revoked_token.expires_at)
     # The client is responsible for discarding the refresh token upon logout.
     return jsonify({"message": "Access token has been revoked."})
 
@@ -84,10 +103,13 @@ def logout():
 @users_bp.route("/users/me", methods=["GET"])
 @jwt_required()
 def get_my_profile():
-    current_user_id = get_jwt_identity()
-    user = User.query.get(current_user_id)
+    user = current_user()
     if not user:
         return jsonify({"error": "User not found"}), 404
+
+    # A buffered position may be newer than the one stored on the row
+    lat, lng, last_update = location_buffer.get(user.id) or \
+        (user.current_lat, user.current_lng, user.last_location_update)
         
     return jsonify({
         "id": user.id, "email": user.email, "full_name": user.full_name,
@@ -96,16 +118,15 @@ def get_my_profile():
         "driver_rating_count": user.driver_rating_count,
         "avg_rider_rating": user.avg_rider_rating,
         "rider_rating_count": user.rider_rating_count,
-        "current_lat": user.current_lat,
-        "current_lng": user.current_lng,
-        "last_location_update": user.last_location_update.isoformat() if user.last_location_update else None
+        "current_lat": lat,
+        "current_lng": lng,
+        "last_location_update": last_update.isoformat() if last_update else None
     })
 
 @users_bp.route("/users/me", methods=["PUT"])
 @jwt_required()
 def update_my_profile():
-    current_user_id = get_jwt_identity()
-    user = User.query.get(current_user_id)
+    user = current_user()
     if not user:
         return jsonify({"error": "User not found"}), 404
     
@@ -114,19 +135,26 @@ def update_my_profile():
     user.major = data.get('major', user.major)
     user.year = data.get('year', user.year)
     user.phone_number = data.get('phone_number', user.phone_number)
-    user.role = data.get('role', user.role)
+
+    # Tokens carry the role as a claim, so a role change revokes every
+    # existing token of the user and the response carries fresh ones.
+    new_role = data.get('role', user.role)
+    role_changed = new_role != user.role
+    if role_changed:
+        user.role = new_role
+        user.token_version = next_token_version(user)
     
     db.session.commit()
-    return jsonify({"message": "Profile updated successfully"})
+    notify_user_changed([user.id])
+    if not role_changed:
+        return jsonify({"message": "Profile updated successfully"})
+
+    revocation_cache.bump_user(user.id, user.token_version)
+    return jsonify(message="Profile updated successfully", **_issue_tokens(user))
 
 @users_bp.route("/users/me/location", methods=["PUT"])
 @driver_required
 def update_my_location():
-    current_user_id = get_jwt_identity()
-    user = User.query.get(current_user_id)
-    if not user:
-        return jsonify({"error": "User not found"}), 404
-    
     data = request.get_json()
     lat = data.get('lat')
     lng = data.get('lng')
@@ -135,63 +163,120 @@ def update_my_location():
         return jsonify({"error": "Latitude (lat) and longitude (lng) are required"}), 400
     
     try:
-        user.current_lat = float(lat)
-        user.current_lng = float(lng)
-        user.last_location_update = datetime.utcnow()
+        lat, lng = float(lat), float(lng)
     except (ValueError, TypeError):
         return jsonify({"error": "Invalid latitude or longitude format"}), 400
 
-    db.session.commit()
+    # Buffered in memory and persisted by the background flusher (see location_buffer.py)
+    location_buffer.update(get_jwt_identity(), lat, lng, datetime.utcnow())
     return jsonify({"message": "Location updated successfully"})
 
 @users_bp.route("/users/<string:id>", methods=["GET"])
 def get_user_profile(id):
+    cached = response_cache.get(('user', id))
+    if cached is not None:
+        return cached
     user = User.query.get(id)
     if not user:
         return jsonify({"error": "User not found"}), 404
         
     # Return only public information
-    return jsonify({
+    return response_cache.set(('user', id), jsonify({
         "id": user.id, "full_name": user.full_name,
         "major": user.major, "year": user.year, "role": user.role,
         "avg_driver_rating": user.avg_driver_rating,
         "driver_rating_count": user.driver_rating_count,
         "avg_rider_rating": user.avg_rider_rating,
         "rider_rating_count": user.rider_rating_count,
-    })
+    }), user_ids=[id])
 
 # --- NEW ENDPOINT ---
 @users_bp.route("/users/me/rides", methods=["GET"])
 @jwt_required()
 def get_my_rides():
     current_user_id = get_jwt_identity()
+    limit = page_size(request.args.get('limit', type=int))
+
+    # Each list is paged independently with its own (departure_time, id) cursor
+    try:
+        driving_after = _decode_ride_cursor(request.args.get('driving_cursor'))
+        riding_after = _decode_ride_cursor(request.args.get('riding_cursor'))
+    except InvalidCursor:
+        return jsonify({"error": "Invalid cursor"}), 400
     
     # Rides where the user is the driver
-    driving_rides = Ride.query.filter(
+    driving_query = Ride.query.filter(
         Ride.driver_id == current_user_id,
         Ride.status.in_(['scheduled', 'in_progress'])
-    ).order_by(Ride.departure_time).all()
+    )
 
     # Rides where the user is a passenger
-    riding_bookings = Booking.query.join(Ride).filter(
+    riding_query = Ride.query.join(Booking).filter(
         Booking.rider_id == current_user_id,
         Booking.status == 'confirmed',
         Ride.status.in_(['scheduled', 'in_progress'])
-    ).order_by(Ride.departure_time).all()
-    
-    riding_rides = [b.ride for b in riding_bookings]
-
-    def serialize_ride(r):
-        return {
-            "id": r.id, 
-            "origin_name": r.origin_name, 
-            "destination_name": r.destination_name,
-            "departure_time": r.departure_time.isoformat(), 
-            "available_seats": r.available_seats,
-            "status": r.status
-        }
+    )
+
+    # The driver's recurring templates only have ride rows for the next
+    # RECURRING_HORIZON_DAYS; later occurrences are merged in from the templates
+    driving = heapq.merge(
+        _ride_entries(driving_query, driving_after, limit),
+        _driver_occurrences(current_user_id, driving_after, limit),
+        key=lambda entry: entry[0]
+    )
+    driving_rides, next_driving = _page(driving, limit)
+    riding_rides, next_riding = _page(_ride_entries(riding_query, riding_after, limit), limit)
 
     return jsonify({
-        "driving": [serialize_ride(r) for r in driving_rides],
-        "riding": [serialize_ride(r) for r in riding_rides]
-    })
\ No newline at end of file
+        "driving": driving_rides,
+        "riding": riding_rides,
+        "next_cursor": {"driving": next_driving, "riding": next_riding}
+    })
+
+def _decode_ride_cursor(cursor):
+    return decode_cursor(cursor, datetime, str) if cursor else None
+
+def _serialize_ride(r):
+    return {
+        "id": r.id,
+        "origin_name": r.origin_name,
+        "destination_name": r.destination_name,
+        "departure_time": r.departure_time.isoformat(),
+        "available_seats": r.available_seats,
+        "status": r.status
+    }
+
+def _ride_entries(query, after, limit):
+    """Up to `limit` + 1 rides ordered by (departure_time, id), as (sort key, ride) pairs."""
+    if after:
+        query = query.filter(or_(
+            Ride.departure_time > after[0],
+            and_(Ride.departure_time == after[0], Ride.id > after[1])
+        ))
+    rides = query.order_by(Ride.departure_time, Ride.id).limit(limit + 1).all()
+    return [((r.departure_time, r.id), _serialize_ride(r)) for r in rides]
+
+def _driver_occurrences(driver_id, after, limit):
+    """The driver's recurring occurrences without a ride row, as (sort key, ride) pairs."""
+    end = datetime.now() + timedelta(days=current_app.config['RECURRING_SEARCH_HORIZON_DAYS'])
+    occurrences = search_occurrences(driver_id=driver_id, start_time=after[0] if after else None,
+                                     end_time=end, batch_size=limit + 1)
+    for key, occurrence in occurrences:
+        if after and key <= tuple(after):
+            continue
+        yield key, {
+            "id": occurrence["id"],
+            "origin_name": occurrence["origin_name"],
+            "destination_name": occurrence["destination_name"],
+            "departure_time": occurrence["departure_time"],
+            "available_seats": occurrence["available_seats"],
+            "status": "scheduled"
+        }
+
+def _page(entries, limit):
+    """One keyset page from (sort key, ride) pairs in order, plus the next cursor."""
+    entries = list(islice(entries, limit + 1))
+    rides = [ride for _, ride in entries[:limit]]
+    if len(entries) <= limit:
+        return rides, None
+    return rides, encode_cursor(*entries[limit - 1][0])
@@ -0,0 +1,227 @@
+# search_snapshot.py
+"""
+Optional in-process read engine for GET /rides.
+
+Keeps a columnar NumPy snapshot of active rides (origin/destination lat-lng,
+departure epoch, seats, driver rating) and answers radius + time-window + sort
+queries with vectorized math instead of a SQL round trip. Rides touched by the
+write paths are refreshed incrementally through the `ride_changed` signal; a
+background thread rebuilds the whole snapshot every staleness interval, which
+also picks up writes made by other worker processes. Rebuilds load outside the
+lock and swap the new columns in, so searches never wait on a full load.
+
+Enable with SEARCH_SNAPSHOT_ENABLED=true. NumPy is only needed when enabled.
+"""
+import logging
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+from sqlalchemy import and_, func
+from models import db, Ride, UserRatingAggregate, DEFAULT_RATING
+from signals import ride_changed
+from spatial_index import INDEXED_STATUSES, great_circle_km
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is an optional dependency
+    np = None
+
+logger = logging.getLogger(__name__)
+
+_EPOCH = datetime(1970, 1, 1)
+
+def _to_epoch(dt):
+    return (dt - _EPOCH).total_seconds()
+
+_Columns = namedtuple('_Columns', [
+    'ids', 'origin_names', 'destination_names',
+    'origin_lat', 'origin_lng', 'destination_lat', 'destination_lng',
+    'departure', 'seats', 'rating', 'payload',
+])
+
+def _serialize(row):
+    return {
+        "id": row.id, "driver_id": row.driver_id, "origin_name": row.origin_name,
+        "destination_name": row.destination_name, "departure_time": row.departure_time.isoformat(),
+        "available_seats": row.available_seats
+    }
+
+class RideSearchSnapshot:
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._rebuild_lock = threading.RLock()
+        self._columns = None
+        self._dirty = set()
+        # Rides changed while a full rebuild is loading; None when idle
+        self._pending = None
+        self._worker = None
+        self.enabled = False
+        self.max_staleness = 30
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self._app = app
+        self.enabled = app.config.get('SEARCH_SNAPSHOT_ENABLED', False)
+        self.max_staleness = app.config.get('SEARCH_SNAPSHOT_MAX_STALENESS_SECONDS', 30)
+        if self.enabled and np is None:
+            app.logger.warning("SEARCH_SNAPSHOT_ENABLED is set but numpy is not installed; using SQL search.")
+            self.enabled = False
+        if self.enabled:
+            ride_changed.connect(self._on_ride_changed, sender=app, weak=False)
+            # Started lazily so CLI commands and scripts don't spawn the worker
+            app.before_request(self._ensure_worker)
+
+    def _on_ride_changed(self, sender, ride_id=None, **extra):
+        with self._lock:
+            self._dirty.add(ride_id)
+            if self._pending is not None:
+                self._pending.add(ride_id)
+
+    # --- Loading ---
+
+    def _load_rows(self, ride_ids=None):
+        query = db.session.query(
+            Ride.id, Ride.driver_id, Ride.origin_name, Ride.destination_name,
+            Ride.origin_lat, Ride.origin_lng, Ride.destination_lat, Ride.destination_lng,
+            Ride.departure_time, Ride.available_seats, Ride.status,
+            func.coalesce(UserRatingAggregate.avg_rating, DEFAULT_RATING).label('driver_rating')
+        ).outerjoin(UserRatingAggregate, and_(
+            UserRatingAggregate.user_id == Ride.driver_id,
+            UserRatingAggregate.rating_type == 'driver_rating'
+        ))
+        if ride_ids is None:
+            query = query.filter(Ride.status.in_(INDEXED_STATUSES))
+        else:
+            query = query.filter(Ride.id.in_(ride_ids))
+        return query.all()
+
+    def _build(self, rows):
+        def floats(values):
+            return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+
+        return _Columns(
+            ids=np.array([r.id for r in rows], dtype=str),
+            origin_names=np.array([r.origin_name.lower() for r in rows], dtype=str),
+            destination_names=np.array([r.destination_name.lower() for r in rows], dtype=str),
+            origin_lat=floats(r.origin_lat for r in rows),
+            origin_lng=floats(r.origin_lng for r in rows),
+            destination_lat=floats(r.destination_lat for r in rows),
+            destination_lng=floats(r.destination_lng for r in rows),
+            departure=np.array([_to_epoch(r.departure_time) for r in rows], dtype=np.float64),
+            seats=np.array([r.available_seats for r in rows], dtype=np.int64),
+            rating=floats(r.driver_rating for r in rows),
+            payload=np.array([_serialize(r) for r in rows], dtype=object),
+        )
+
+    def rebuild(self):
+        """
+        Reloads every active ride. The load runs without holding the search
+        lock; rides changed meanwhile are replayed incrementally afterwards.
+        """
+        with self._rebuild_lock:
+            with self._lock:
+                self._pending = set()
+            try:
+                columns = self._build(self._load_rows())
+            except Exception:
+                with self._lock:
+                    self._pending = None
+                raise
+            with self._lock:
+                self._columns = columns
+                self._dirty, self._pending = self._pending, None
+
+    def _refresh(self):
+        """Applies rides changed since the last refresh; called with the lock held."""
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        changed = [r for r in self._load_rows(list(dirty)) if r.status in INDEXED_STATUSES]
+        old = self._columns
+        keep = ~np.isin(old.ids, list(dirty))
+        if changed:
+            new = self._build(changed)
+            self._columns = _Columns(*(np.concatenate([o[keep], n]) for o, n in zip(old, new)))
+        else:
+            self._columns = _Columns(*(o[keep] for o in old))
+
+    def _current(self):
+        if self._columns is None:
+            with self._rebuild_lock:
+                if self._columns is None:
+                    self.rebuild()
+        with self._lock:
+            self._refresh()
+            return self._columns
+
+    # --- Background rebuild ---
+
+    def run_once(self):
+        with self._app.app_context():
+            try:
+                self.rebuild()
+            except Exception:
+                db.session.rollback()
+                logger.exception("Ride search snapshot rebuild failed; will retry")
+
+    def _ensure_worker(self):
+        if self._worker is not None:
+            return
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name='search-snapshot', daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        # The first search builds the snapshot; the worker keeps it fresh
+        while True:
+            time.sleep(max(self.max_staleness, 1))
+            self.run_once()
+
+    # --- Querying ---
+
+    def search(self, origin=None, destination=None, origin_point=None, destination_point=None,
+               radius_km=1.0, start_time=None, end_time=None, sort_by=None, after=None, limit=None):
+        """
+        Mirrors the SQL search: coordinates take precedence over the name
+        substring filters, and `after` is the (departure_time | rating, id)
+        key of the previous page. Returns up to `limit` + 1 (sort key, payload)
+        pairs, the sort key being (departure_time, id) or (-rating, id).
+        """
+        cols = self._current()
+        mask = np.ones(len(cols.ids), dtype=bool)
+
+        if origin_point is not None:
+            mask &= great_circle_km(cols.origin_lat, cols.origin_lng, *origin_point, xp=np) <= radius_km
+        elif origin:
+            mask &= np.char.find(cols.origin_names, origin.lower()) >= 0
+
+        if destination_point is not None:
+            mask &= great_circle_km(cols.destination_lat, cols.destination_lng, *destination_point, xp=np) <= radius_km
+        elif destination:
+            mask &= np.char.find(cols.destination_names, destination.lower()) >= 0
+
+        if start_time is not None:
+            mask &= cols.departure >= _to_epoch(start_time)
+        if end_time is not None:
+            mask &= cols.departure <= _to_epoch(end_time)
+
+        # Sort ascending on (primary, id); rating is negated so higher ratings come first
+        by_rating = sort_by == 'rating'
+        primary = -cols.rating if by_rating else cols.departure
+        ids = cols.ids
+        if after is not None:
+            key = -after[0] if by_rating else _to_epoch(after[0])
+            mask &= (primary > key) | ((primary == key) & (ids > after[1]))
+
+        hits = np.flatnonzero(mask)
+        order = hits[np.lexsort((ids[hits], primary[hits]))]
+        if limit is not None:
+            order = order[:limit + 1]
+        if by_rating:
+            keys = [(-float(cols.rating[i]), str(ids[i])) for i in order]
+        else:
+            keys = [(datetime.fromisoformat(cols.payload[i]["departure_time"]), str(ids[i])) for i in order]
+        return list(zip(keys, cols.payload[order]))
@@ -0,0 +1,349 @@
+# seed_data.py
+"""
+Bulk synthetic data generator for profiling, benchmarks and local testing.
+
+Generates users, rides, bookings, ratings and recurring templates around
+Lahore: most trips run between a residential area and campus, departures
+follow morning and evening peaks, past rides are completed (or sometimes
+cancelled) with start and completion times that follow the traffic, and ratings lean towards 4 and 5 stars. Output is fully
+determined by the seed, including ids.
+
+Rows are written with executemany inside one large transaction (plain
+DB-API executemany on SQLite, Core inserts elsewhere). Secondary indexes,
+the R*Tree, the place index and the driver rating triggers are dropped for
+the load and rebuilt once at the end. Rating aggregates and trip patterns
+are accumulated while generating, so they match the generated ratings and
+completed rides exactly.
+
+Expect about 30k rows/s on SQLite (500k rows for 100k rides in ~17s of CPU),
+short of the 100k rows/s once aimed for. Of that, executemany takes ~7s
+(random UUID keys keep it near 80k rows/s, and journal or locking mode make
+no difference), generating the rows ~5s, recreating the secondary indexes
+~2s and rebuilding the R*Tree, place index and driver rating copy ~4s.
+`--skip-search-indexes` leaves that last part to the rebuild_* commands
+(about 36k rows/s).
+
+    flask generate_data --users 200000 --rides 1000000 --seed 7
+"""
+import random
+import time as timer
+import uuid
+from datetime import datetime, time, timedelta
+from sqlalchemy import DateTime, Float, insert
+from werkzeug.security import generate_password_hash
+from models import db, User, Ride, Booking, Rating, RecurringRide, UserRatingAggregate, UserTripPattern
+from spatial_index import drop_spatial_index, great_circle_km, rebuild_spatial_index
+from place_index import drop_place_index, rebuild_place_index
+from ratings import drop_driver_rating_index, rebuild_driver_rating_index
+
+CAMPUS = ("FCC Main Gate", 31.5226, 74.3336)
+
+# (name, lat, lng, relative popularity) of the areas trips start from or go to
+PLACES = [
+    ("Liberty Market", 31.5105, 74.3440, 4), ("Model Town", 31.4840, 74.3260, 8),
+    ("DHA Phase 5", 31.4630, 74.4080, 7), ("Johar Town", 31.4697, 74.2728, 9),
+    ("Gulberg III", 31.5120, 74.3480, 6), ("Bahria Town", 31.3660, 74.1850, 3),
+    ("Township", 31.4490, 74.3050, 5), ("Iqbal Town", 31.5100, 74.2900, 6),
+    ("Cantt", 31.5390, 74.3800, 4), ("Shadman", 31.5370, 74.3290, 3),
+    ("Garden Town", 31.5000, 74.3200, 5), ("Faisal Town", 31.4780, 74.3030, 5),
+    ("Wapda Town", 31.4330, 74.2670, 4), ("Valencia", 31.4040, 74.2480, 2),
+    ("Allama Iqbal Airport", 31.5216, 74.4036, 1), ("Anarkali", 31.5660, 74.3100, 2),
+    ("Data Darbar", 31.5790, 74.3040, 1), ("Shalimar Gardens", 31.5860, 74.3820, 1),
+    ("Emporium Mall", 31.4670, 74.2660, 2), ("Samanabad", 31.5330, 74.2980, 3),
+]
+
+# Weight of each departure hour (6:00-22:00) with morning and evening peaks
+_HOUR_WEIGHTS = {6: 2, 7: 9, 8: 12, 9: 6, 10: 3, 11: 2, 12: 3, 13: 4, 14: 4,
+                 15: 5, 16: 8, 17: 9, 18: 6, 19: 3, 20: 2, 21: 1, 22: 1}
+# Trip timings: road km per great-circle km, and average speed in and out of the peaks
+_ROAD_FACTOR = 1.35
+_PEAK_SPEED_KMH, _OFF_PEAK_SPEED_KMH = 18, 28
+_PEAK_HOURS = {7, 8, 16, 17}
+_RATING_WEIGHTS = (2, 3, 10, 35, 50)  # 1..5 stars
+_MAJORS = ("Computer Science", "Economics", "Biology", "Mathematics", "Business", "Psychology", "Physics")
+
+def _iso_datetime(value):
+    return None if value is None else value.isoformat(' ', 'microseconds')
+
+class _Writer:
+    """Buffers rows of one table and writes them in chunks on `conn`."""
+
+    def __init__(self, conn, table, columns, chunk):
+        self.conn, self.table, self.columns, self.chunk = conn, table, columns, chunk
+        self.rows = []
+        self.written = 0
+        dialect = conn.dialect
+        self.raw = dialect.name == 'sqlite'
+        # Bind-time conversions (datetimes, booleans...), memoized since values repeat a lot
+        self.processors = []
+        for i, name in enumerate(columns):
+            column_type = table.c[name].type
+            processor = column_type.dialect_impl(dialect).bind_processor(dialect)
+            # SQLite's default datetime format is isoformat's, which is much cheaper to produce
+            sample = datetime(2000, 1, 2, 3, 4, 5, 6)
+            if isinstance(column_type, DateTime) and processor is not None and processor(sample) == _iso_datetime(sample):
+                processor = _iso_datetime
+            if processor is not None and not isinstance(column_type, Float):
+                self.processors.append((i, processor, {}))
+        self.sql = f"INSERT INTO {table.name} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+
+    def add(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.chunk:
+            self.flush()
+
+    def flush_if_full(self):
+        if len(self.rows) >= self.chunk:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        if self.raw:
+            for i, processor, cache in self.processors:
+                for row in self.rows:
+                    value = row[i]
+                    converted = cache.get(value)
+                    if converted is None:
+                        converted = cache[value] = processor(value)
+                    row[i] = converted
+            # Straight to the DB-API cursor, in the connection's transaction
+            self.conn.connection.cursor().executemany(self.sql, self.rows)
+        else:
+            self.conn.execute(insert(self.table), [dict(zip(self.columns, row)) for row in self.rows])
+        self.written += len(self.rows)
+        self.rows.clear()
+
+def _uuid_factory(rng, batch=4096):
+    """
+    Deterministic version-4 UUID strings drawn from `rng`, formatted `batch`
+    at a time from one large random number rather than one call per id.
+    """
+    def batches():
+        while True:
+            h = rng.getrandbits(128 * batch).to_bytes(16 * batch, 'big').hex()
+            yield from [f"{h[i:i + 8]}-{h[i + 8:i + 12]}-4{h[i + 13:i + 16]}-a{h[i + 17:i + 20]}-{h[i + 20:i + 32]}"
+                        for i in range(0, 32 * batch, 32)]
+    return batches().__next__
+
+def generate(users=1000, rides=5000, seed=42, password="Password123", test_users=(), chunk=50_000,
+             search_indexes=True):
+    """
+    Generates `users` users and `rides` rides (with their bookings, ratings,
+    rating aggregates, trip patterns and some recurring templates) into an
+    empty schema. `test_users` are extra (email, full_name, role, password)
+    accounts to create first. With `search_indexes` false the R*Tree, place
+    index and driver rating copy are left dropped for the rebuild_* commands
+    to restore later; searches fall back to the base tables meanwhile.
+    Returns the number of rows written per table.
+    """
+    rng = random.Random(seed)
+    random_float = rng.random
+    new_id = _uuid_factory(rng)
+    now = datetime.utcnow().replace(second=0, microsecond=0)
+    password_hash = generate_password_hash(password)
+
+    tables = (User.__table__, Ride.__table__, Booking.__table__, Rating.__table__,
+              RecurringRide.__table__, UserRatingAggregate.__table__, UserTripPattern.__table__)
+    drop_spatial_index()
+    drop_place_index()
+    drop_driver_rating_index()
+    db.session.commit()
+    counts = {}
+    with db.engine.connect() as conn:
+        if conn.dialect.name == 'sqlite':
+            conn.exec_driver_sql("PRAGMA synchronous = OFF")
+            conn.exec_driver_sql("PRAGMA cache_size = -262144")
+            conn.commit()
+        with conn.begin():
+            # Secondary indexes are rebuilt once at the end, which beats maintaining them row by row
+            indexes = [index for table in tables for index in table.indexes]
+            for index in indexes:
+                index.drop(conn, checkfirst=True)
+
+            user_rows = _Writer(conn, User.__table__, (
+                'id', 'email', 'full_name', 'major', 'year', 'password_hash', 'role', 'token_version', 'created_at'
+            ), chunk)
+            drivers, riders = [], []
+            for email, full_name, role, test_password in test_users:
+                user_rows.add([new_id(), email, full_name, None, None,
+                               generate_password_hash(test_password), role, 0, now])
+            signup_days = [now - timedelta(days=day) for day in range(366)]
+            for i in range(users):
+                user_id = new_id()
+                roll = random_float()
+                role = 'rider' if roll < 0.65 else 'driver' if roll < 0.9 else 'both'
+                user_rows.add([user_id, f"user{i}@fccollege.edu.pk", f"Student {i}",
+                               _MAJORS[int(random_float() * len(_MAJORS))], 1 + int(random_float() * 4),
+                               password_hash, role, 0, signup_days[int(random_float() * 366)]])
+                if role != 'rider':
+                    drivers.append(user_id)
+                if role != 'driver':
+                    riders.append(user_id)
+            user_rows.flush()
+            counts['users'] = user_rows.written
+            if rides and not (drivers and riders):
+                raise ValueError("Rides need at least one driver and one rider; generate more users")
+
+            ride_rows = _Writer(conn, Ride.__table__, (
+                'id', 'driver_id', 'origin_name', 'origin_lat', 'origin_lng', 'destination_name',
+                'destination_lat', 'destination_lng', 'departure_time', 'total_seats', 'available_seats',
+                'status', 'is_recurring', 'version', 'created_at', 'started_at', 'completed_at'
+            ), chunk)
+            booking_rows = _Writer(conn, Booking.__table__, (
+                'id', 'ride_id', 'rider_id', 'pickup_point_name', 'pickup_point_lat', 'pickup_point_lng',
+                'status', 'created_at'
+            ), chunk)
+            rating_rows = _Writer(conn, Rating.__table__, (
+                'id', 'ride_id', 'reviewer_id', 'reviewee_id', 'rating_type', 'rating_value', 'created_at'
+            ), chunk)
+            aggregates = {}  # (user_id, rating_type) -> [sum, count]
+            trips = {}  # (user_id, origin_name, destination_name) -> completed trips
+
+            def rate(ride_id, reviewer_id, reviewee_id, rating_type, rated_at):
+                value = stars[int(random_float() * star_count)]
+                add_rating([new_id(), ride_id, reviewer_id, reviewee_id, rating_type, value, rated_at])
+                aggregate = aggregates.get((reviewee_id, rating_type))
+                if aggregate is None:
+                    aggregates[reviewee_id, rating_type] = [value, 1]
+                else:
+                    aggregate[0] += value
+                    aggregate[1] += 1
+
+            # Lookup tables and bulk draws: per-row rng.choices / randint calls dominate otherwise
+            stars = [value for value, weight in enumerate(_RATING_WEIGHTS, 1) for _ in range(weight)]
+            star_count = len(stars)
+            rated_after = timedelta(hours=2)
+            day_starts = [datetime.combine((now + timedelta(days=day)).date(), time()) for day in range(-60, 31)]
+            minutes = [timedelta(hours=hour, minutes=minute) for hour in range(24) for minute in range(0, 60, 5)]
+            areas = rng.choices(PLACES, [p[3] for p in PLACES], k=rides)
+            hours = rng.choices(list(_HOUR_WEIGHTS), list(_HOUR_WEIGHTS.values()), k=rides)
+            in_progress_after = now - timedelta(hours=1)
+            driver_count, rider_count = len(drivers), len(riders)
+            # Appended to directly in the hot loop, which flushes them itself
+            add_ride, add_booking, add_rating = ride_rows.rows.append, booking_rows.rows.append, rating_rows.rows.append
+            for area, hour in zip(areas, hours):
+                roll = random_float()
+                if roll < 0.4:
+                    origin, destination = area, CAMPUS
+                elif roll < 0.75:
+                    origin, destination = CAMPUS, area
+                else:
+                    destination = PLACES[int(random_float() * len(PLACES))]
+                    origin, destination = area, CAMPUS if destination is area else destination
+                departure = day_starts[int(random_float() * len(day_starts))] + minutes[hour * 12 + int(random_float() * 12)]
+                if departure > now:
+                    status = 'scheduled'
+                elif departure > in_progress_after:
+                    status = 'in_progress'
+                else:
+                    status = 'completed' if random_float() < 0.9 else 'cancelled'
+                origin_lat, origin_lng = origin[1] + (random_float() - 0.5) * 0.02, origin[2] + (random_float() - 0.5) * 0.02
+                destination_lat = destination[1] + (random_float() - 0.5) * 0.02
+                destination_lng = destination[2] + (random_float() - 0.5) * 0.02
+                started_at = completed_at = None
+                if status in ('in_progress', 'completed'):
+                    started_at = departure + timedelta(minutes=int(random_float() * 10))
+                if status == 'completed':
+                    speed = _PEAK_SPEED_KMH if departure.hour in _PEAK_HOURS else _OFF_PEAK_SPEED_KMH
+                    road_km = great_circle_km(origin_lat, origin_lng, destination_lat, destination_lng) * _ROAD_FACTOR
+                    completed_at = started_at + timedelta(minutes=3 + road_km / speed * 60 * (0.85 + random_float() * 0.45))
+                driver_id = drivers[int(random_float() * driver_count)]
+                total = 1 + int(random_float() * 4)
+                passengers = ()
+                if status != 'cancelled':
+                    # Fuller rides are more likely
+                    booked = min(total, rider_count, int(rng.triangular(0, total + 1, total)))
+                    # dict, not set: iteration order must not depend on string hashing
+                    passengers = dict.fromkeys(riders[int(random_float() * rider_count)] for _ in range(booked))
+                    passengers.pop(driver_id, None)
+                ride_id = new_id()
+                add_ride([
+                    ride_id, driver_id, origin[0], origin_lat, origin_lng, destination[0], destination_lat, destination_lng,
+                    departure, total, total - len(passengers), status, False, 1, departure - timedelta(days=int(random_float() * 7)),
+                    started_at, completed_at
+                ])
+                completed = status == 'completed'
+                rated_at = departure + rated_after
+                for rider_id in passengers:
+                    add_booking([
+                        new_id(), ride_id, rider_id, origin[0],
+                        origin[1] + (random_float() - 0.5) * 0.01, origin[2] + (random_float() - 0.5) * 0.01,
+                        'completed' if completed else 'confirmed', departure - timedelta(hours=1 + int(random_float() * 48))
+                    ])
+                    if completed:
+                        key = (rider_id, origin[0], destination[0])
+                        trips[key] = trips.get(key, 0) + 1
+                        if random_float() < 0.6:
+                            rate(ride_id, rider_id, driver_id, 'driver_rating', rated_at)
+                        if random_float() < 0.4:
+                            rate(ride_id, driver_id, rider_id, 'rider_rating', rated_at)
+                if completed:
+                    key = (driver_id, origin[0], destination[0])
+                    trips[key] = trips.get(key, 0) + 1
+                if len(booking_rows.rows) >= chunk or len(ride_rows.rows) >= chunk:
+                    ride_rows.flush()
+                    booking_rows.flush()
+                    rating_rows.flush_if_full()
+            for writer, name in ((ride_rows, 'rides'), (booking_rows, 'bookings'), (rating_rows, 'ratings')):
+                writer.flush()
+                counts[name] = writer.written
+
+            aggregate_rows = _Writer(conn, UserRatingAggregate.__table__, (
+                'user_id', 'rating_type', 'rating_sum', 'rating_count', 'avg_rating'
+            ), chunk)
+            aggregate_rows.rows.extend(
+                [user_id, rating_type, total, count, total / count]
+                for (user_id, rating_type), (total, count) in aggregates.items()
+            )
+            aggregate_rows.flush()
+            counts['user_rating_aggregates'] = aggregate_rows.written
+
+            pattern_rows = _Writer(conn, UserTripPattern.__table__, (
+                'id', 'user_id', 'origin_name', 'destination_name', 'trip_count'
+            ), chunk)
+            pattern_rows.rows.extend(
+                [new_id(), user_id, origin_name, destination_name, trip_count]
+                for (user_id, origin_name, destination_name), trip_count in trips.items()
+            )
+            pattern_rows.flush()
+            counts['trip_patterns'] = pattern_rows.written
+
+            template_rows = _Writer(conn, RecurringRide.__table__, (
+                'id', 'driver_id', 'origin_name', 'origin_lat', 'origin_lng', 'destination_name',
+                'destination_lat', 'destination_lng', 'departure_time_of_day', 'days_of_week',
+                'total_seats', 'is_active', 'created_at'
+            ), chunk)
+            for driver_id in drivers:
+                if random_float() >= 0.1:
+                    continue
+                area = rng.choices(PLACES, [p[3] for p in PLACES])[0]
+                origin, destination = (area, CAMPUS) if random_float() < 0.5 else (CAMPUS, area)
+                days = sorted(rng.sample(range(5), rng.randint(2, 5)))
+                template_rows.add([
+                    new_id(), driver_id, origin[0], origin[1], origin[2], destination[0], destination[1],
+                    destination[2], time(rng.choice((7, 8, 8, 9, 16, 17)), rng.randrange(0, 60, 15)),
+                    ",".join(map(str, days)), rng.randint(2, 4), True, now
+                ])
+            template_rows.flush()
+            counts['recurring_rides'] = template_rows.written
+
+            for index in indexes:
+                index.create(conn)
+
+    if search_indexes:
+        rebuild_spatial_index()
+        rebuild_place_index()
+        rebuild_driver_rating_index()
+    return counts
+
+def generate_with_report(**options):
+    """Runs `generate` and prints row counts and throughput."""
+    started = timer.perf_counter()
+    counts = generate(**options)
+    elapsed = timer.perf_counter() - started
+    total = sum(counts.values())
+    for table, written in counts.items():
+        print(f"  - {table}: {written}")
+    print(f"Generated {total} rows in {elapsed:.1f}s ({total / elapsed:,.0f} rows/s).")
+    return counts
@@ -0,0 +1,31 @@
+# signals.py
+from blinker import Namespace
+from flask import current_app
+
+# Signals sent by the write paths after they commit, so in-process read caches
+# can refresh or invalidate the affected entries. Receivers are called with the
+# Flask app as sender.
+_signals = Namespace()
+
+# Sent with `ride_id=` whenever a ride or its bookings changed, and with
+# `route=(origin_name, destination_name)` when the ride was just created.
+ride_changed = _signals.signal('ride-changed')
+
+# Sent with `user_ids=` when those users' trip patterns changed.
+trip_patterns_changed = _signals.signal('trip-patterns-changed')
+
+# Sent with `user_ids=` when those users' public profile changed (name, role,
+# rating averages).
+user_changed = _signals.signal('user-changed')
+
+def notify_ride_changed(ride_id, route=None):
+    """Call after committing a change to a ride or its bookings."""
+    ride_changed.send(current_app._get_current_object(), ride_id=ride_id, route=route)
+
+def notify_trip_patterns_changed(user_ids):
+    """Call after committing trip pattern updates for `user_ids`."""
+    trip_patterns_changed.send(current_app._get_current_object(), user_ids=list(user_ids))
+
+def notify_user_changed(user_ids):
+    """Call after committing changes to the public profile of `user_ids`."""
+    user_changed.send(current_app._get_current_object(), user_ids=list(user_ids))
@@ -0,0 +1,299 @@
+# spatial_index.py
+"""
+Bounding-box index over ride origin/destination points.
+
+On SQLite the points of active rides (scheduled / in progress) are mirrored
+into two R*Tree virtual tables that are kept in sync with the `rides` table by
+triggers, so every write path (ORM or bulk Core inserts) maintains them. A
+radius search first narrows candidates with an indexed bounding-box lookup and
+only then runs the exact haversine check on those rows.
+
+A third R*Tree holds the bounding box of each active ride's route, for en-route
+matching: the stored `route_*` box of its polyline, else the box of the
+origin -> destination segment. A polyline without a stored box (rows written
+before the columns existed) gets the whole world, so it stays a candidate.
+
+Other databases fall back to a plain bounding-box filter on the lat/lng
+columns ahead of the haversine check.
+"""
+import logging
+import math
+import threading
+from sqlalchemy import DDL, and_, column, event, func, literal_column, or_, select, table, text
+from models import db, Ride
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0
+
+# Only rides that can still show up in a search are kept in the index
+INDEXED_STATUSES = ('scheduled', 'in_progress')
+
+_POINT_COLUMNS = {
+    'origin': ('origin_lat', 'origin_lng'),
+    'destination': ('destination_lat', 'destination_lng'),
+}
+
+def _rtree_name(point):
+    return f"ride_{point}_rtree"
+
+def _rtree_table(point):
+    return table(
+        _rtree_name(point),
+        column('id'), column('min_lat'), column('max_lat'), column('min_lng'), column('max_lng')
+    )
+
+_RTREES = {point: _rtree_table(point) for point in _POINT_COLUMNS}
+_RTREES['route'] = _rtree_table('route')
+
+# (stored route bound, bound of the origin/destination pair, bound for an unboxed polyline)
+_ROUTE_BOUNDS = [
+    ('route_min_lat', 'min({row}.origin_lat, {row}.destination_lat)', '-90'),
+    ('route_max_lat', 'max({row}.origin_lat, {row}.destination_lat)', '90'),
+    ('route_min_lng', 'min({row}.origin_lng, {row}.destination_lng)', '-180'),
+    ('route_max_lng', 'max({row}.origin_lng, {row}.destination_lng)', '180'),
+]
+
+# --- Schema: virtual tables + triggers (SQLite only) ---
+
+def _index_insert_sql(point, row='new'):
+    lat, lng = _POINT_COLUMNS[point]
+    statuses = ", ".join(f"'{s}'" for s in INDEXED_STATUSES)
+    return (
+        f"INSERT INTO {_rtree_name(point)} (id, min_lat, max_lat, min_lng, max_lng) "
+        f"SELECT {row}.rowid, {row}.{lat}, {row}.{lat}, {row}.{lng}, {row}.{lng} "
+        f"WHERE {row}.status IN ({statuses}) AND {row}.{lat} IS NOT NULL AND {row}.{lng} IS NOT NULL;"
+    )
+
+def _route_insert_sql(row='new', source=''):
+    statuses = ", ".join(f"'{s}'" for s in INDEXED_STATUSES)
+    bounds = ", ".join(
+        f"CASE WHEN {row}.{stored} IS NOT NULL THEN {row}.{stored} "
+        f"WHEN {row}.route_polyline IS NOT NULL THEN {unboxed} ELSE {segment.format(row=row)} END"
+        for stored, segment, unboxed in _ROUTE_BOUNDS
+    )
+    endpoints = " AND ".join(
+        f"{row}.{name} IS NOT NULL" for point in _POINT_COLUMNS for name in _POINT_COLUMNS[point]
+    )
+    return (
+        f"INSERT INTO {_rtree_name('route')} (id, min_lat, max_lat, min_lng, max_lng) "
+        f"SELECT {row}.rowid, {bounds}{source} "
+        f"WHERE {row}.status IN ({statuses}) AND ({row}.route_polyline IS NOT NULL OR ({endpoints}));"
+    )
+
+def _index_delete_sql(point, row='old'):
+    return f"DELETE FROM {_rtree_name(point)} WHERE id = {row}.rowid;"
+
+def _create_statements():
+    statements = [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {_rtree_name(point)} "
+        f"USING rtree(id, min_lat, max_lat, min_lng, max_lng)"
+        for point in _RTREES
+    ]
+    inserts = " ".join(_index_insert_sql(point) for point in _POINT_COLUMNS) + " " + _route_insert_sql()
+    deletes = " ".join(_index_delete_sql(point) for point in _RTREES)
+    watched = ("status, origin_lat, origin_lng, destination_lat, destination_lng, route_polyline, "
+               + ", ".join(stored for stored, _, _ in _ROUTE_BOUNDS))
+    statements += [
+        f"CREATE TRIGGER IF NOT EXISTS rides_spatial_ai AFTER INSERT ON rides BEGIN {inserts} END",
+        f"CREATE TRIGGER IF NOT EXISTS rides_spatial_au AFTER UPDATE OF {watched} ON rides "
+        f"BEGIN {deletes} {inserts} END",
+        f"CREATE TRIGGER IF NOT EXISTS rides_spatial_ad AFTER DELETE ON rides BEGIN {deletes} END",
+    ]
+    return statements
+
+def _drop_statements():
+    statements = [f"DROP TRIGGER IF EXISTS rides_spatial_{suffix}" for suffix in ('ai', 'au', 'ad')]
+    statements += [f"DROP TABLE IF EXISTS {_rtree_name(point)}" for point in _RTREES]
+    return statements
+
+for _statement in _create_statements():
+    event.listen(Ride.__table__, 'after_create', DDL(_statement).execute_if(dialect='sqlite'))
+for _statement in _drop_statements():
+    event.listen(Ride.__table__, 'before_drop', DDL(_statement).execute_if(dialect='sqlite'))
+
+def rebuild_spatial_index():
+    """
+    (Re)creates the R*Tree tables and triggers and repopulates them from
+    `rides`. Use it on databases created before the index existed; after a
+    VACUUM, which may renumber the rowids the index is keyed on,
+    `verify_spatial_index` runs it by itself.
+    Returns the number of ride points and routes indexed, or None on
+    non-SQLite databases.
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return None
+    for statement in _drop_statements() + _create_statements():
+        db.session.execute(text(statement))
+    indexed = 0
+    for point in _POINT_COLUMNS:
+        lat, lng = _POINT_COLUMNS[point]
+        statuses = ", ".join(f"'{s}'" for s in INDEXED_STATUSES)
+        result = db.session.execute(text(
+            f"INSERT INTO {_rtree_name(point)} (id, min_lat, max_lat, min_lng, max_lng) "
+            f"SELECT rowid, {lat}, {lat}, {lng}, {lng} FROM rides "
+            f"WHERE status IN ({statuses}) AND {lat} IS NOT NULL AND {lng} IS NOT NULL"
+        ))
+        indexed += result.rowcount
+    indexed += db.session.execute(text(_route_insert_sql('rides', source=' FROM rides'))).rowcount
+    db.session.commit()
+    _rtree_available.clear()
+    return indexed
+
+def drop_spatial_index():
+    """
+    Removes the R*Tree tables and triggers, e.g. ahead of a bulk load;
+    `rebuild_spatial_index` restores them. No-op on non-SQLite databases.
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return
+    for statement in _drop_statements():
+        db.session.execute(text(statement))
+    _rtree_available.clear()
+
+# Entries per R*Tree compared with `rides` when checking the rowids still line up
+_ROWID_SAMPLE = 100
+
+def _rowids_out_of_step():
+    """Whether sampled origin/destination entries no longer point at the ride they were made from."""
+    statuses = ", ".join(f"'{s}'" for s in INDEXED_STATUSES)
+    for point, (lat, lng) in _POINT_COLUMNS.items():
+        stale = db.session.execute(text(
+            f"SELECT count(*) FROM (SELECT * FROM {_rtree_name(point)} LIMIT {_ROWID_SAMPLE}) AS entry "
+            f"WHERE NOT EXISTS (SELECT 1 FROM rides WHERE rides.rowid = entry.id AND rides.status IN ({statuses}) "
+            f"AND rides.{lat} BETWEEN entry.min_lat AND entry.max_lat "
+            f"AND rides.{lng} BETWEEN entry.min_lng AND entry.max_lng)"
+        )).scalar()
+        if stale:
+            return True
+    return False
+
+_verified = set()
+_verify_lock = threading.Lock()
+
+def verify_spatial_index():
+    """
+    Rebuilds the R*Trees if they are out of step with `rides`: the table has
+    no INTEGER PRIMARY KEY, so a VACUUM may renumber the rowids they are
+    keyed on. Samples a few entries, once per engine; run it before the
+    session has pending changes (it is a before_request hook).
+    """
+    engine = db.engine
+    if engine.url in _verified:
+        return
+    with _verify_lock:
+        if engine.url in _verified:
+            return
+        if _has_rtree() and _rowids_out_of_step():
+            logger.warning("Spatial index entries no longer match ride rowids (after a VACUUM?); rebuilding it")
+            rebuild_spatial_index()
+        _verified.add(engine.url)
+
+# --- Query helpers ---
+
+_rtree_available = {}
+
+def _has_rtree(*indexes):
+    """
+    Whether the current database has the R*Tree tables of `indexes` (default:
+    the origin and destination ones); looked up once per engine.
+    """
+    engine = db.engine
+    if engine.url not in _rtree_available:
+        names = set()
+        if engine.dialect.name == 'sqlite':
+            tables = ", ".join(f"'{_rtree_name(index)}'" for index in _RTREES)
+            names = set(db.session.execute(
+                text(f"SELECT name FROM sqlite_master WHERE type = 'table' AND name IN ({tables})")
+            ).scalars())
+        _rtree_available[engine.url] = names
+    return all(_rtree_name(index) in _rtree_available[engine.url] for index in indexes or _POINT_COLUMNS)
+
+def bounding_box(lat, lng, radius_km):
+    """Smallest lat/lng box containing every point within `radius_km` of (lat, lng)."""
+    angular = radius_km / EARTH_RADIUS_KM
+    dlat = math.degrees(angular)
+    cos_lat = math.cos(math.radians(lat))
+    if angular >= math.pi / 2 or cos_lat <= math.sin(angular):
+        # The circle reaches a pole, so it spans every longitude
+        dlng = 180.0
+    else:
+        dlng = math.degrees(math.asin(math.sin(angular) / cos_lat))
+    return (max(lat - dlat, -90.0), min(lat + dlat, 90.0), lng - dlng, lng + dlng)
+
+def great_circle_km(lat1, lng1, lat2, lng2, xp=math):
+    """
+    Haversine distance in km between two points. With `xp=numpy` the
+    arguments may be arrays and the distances are computed elementwise.
+    """
+    lat1_rad, lat2_rad = xp.radians(lat1), xp.radians(lat2)
+    a = xp.sin((lat2_rad - lat1_rad) / 2) ** 2 + \
+        xp.cos(lat1_rad) * xp.cos(lat2_rad) * xp.sin(xp.radians(lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * xp.atan2(xp.sqrt(a), xp.sqrt(1 - a))
+
+def haversine_km(lat_col, lng_col, lat, lng):
+    """SQL expression for the great-circle distance between a lat/lng column pair and a point."""
+    lat_rad = math.radians(lat)
+    col_lat_rad = lat_col * (math.pi / 180.0)
+    dlat = col_lat_rad - lat_rad
+    dlng = (lng_col * (math.pi / 180.0)) - math.radians(lng)
+    # Use multiplication instead of the power operator (**), which SQLite lacks
+    a = func.sin(dlat / 2) * func.sin(dlat / 2) + \
+        func.cos(lat_rad) * func.cos(col_lat_rad) * \
+        func.sin(dlng / 2) * func.sin(dlng / 2)
+    c = 2 * func.atan2(func.sqrt(a), func.sqrt(1 - a))
+    return EARTH_RADIUS_KM * c
+
+def ride_point_within(point, lat, lng, radius_km):
+    """
+    Filter criterion for rides whose `point` ('origin' or 'destination') lies
+    within `radius_km` of (lat, lng): an indexed bounding-box lookup followed
+    by the exact haversine check.
+    """
+    lat_col = getattr(Ride, _POINT_COLUMNS[point][0])
+    lng_col = getattr(Ride, _POINT_COLUMNS[point][1])
+    min_lat, max_lat, min_lng, max_lng = bounding_box(lat, lng, radius_km)
+
+    if _has_rtree():
+        rtree = _RTREES[point]
+        candidates = select(rtree.c.id).where(
+            rtree.c.max_lat >= min_lat, rtree.c.min_lat <= max_lat,
+            rtree.c.max_lng >= min_lng, rtree.c.min_lng <= max_lng
+        )
+        box = literal_column("rides.rowid").in_(candidates)
+    else:
+        box = and_(lat_col.between(min_lat, max_lat), lng_col.between(min_lng, max_lng))
+
+    return and_(lat_col != None, lng_col != None, box, haversine_km(lat_col, lng_col, lat, lng) <= radius_km)
+
+def ride_route_near(*boxes):
+    """
+    Filter criterion for rides whose route bounding box overlaps every one of
+    `boxes` (min_lat, max_lat, min_lng, max_lng): the candidates for en-route
+    matching, before the exact distance to the route geometry. Rides without
+    a polyline or both endpoints never match.
+    """
+    if _has_rtree('route'):
+        rtree = _RTREES['route']
+        candidates = select(rtree.c.id)
+        for min_lat, max_lat, min_lng, max_lng in boxes:
+            candidates = candidates.where(
+                rtree.c.max_lat >= min_lat, rtree.c.min_lat <= max_lat,
+                rtree.c.max_lng >= min_lng, rtree.c.min_lng <= max_lng
+            )
+        return literal_column("rides.rowid").in_(candidates)
+
+    def segment_overlaps(first, second, low, high):
+        return and_(or_(first >= low, second >= low), or_(first <= high, second <= high))
+
+    criteria = []
+    for min_lat, max_lat, min_lng, max_lng in boxes:
+        criteria.append(or_(
+            and_(Ride.route_min_lat != None, Ride.route_max_lat >= min_lat, Ride.route_min_lat <= max_lat,
+                 Ride.route_max_lng >= min_lng, Ride.route_min_lng <= max_lng),
+            and_(Ride.route_polyline != None, Ride.route_min_lat == None),
+            and_(Ride.route_polyline == None,
+                 segment_overlaps(Ride.origin_lat, Ride.destination_lat, min_lat, max_lat),
+                 segment_overlaps(Ride.origin_lng, Ride.destination_lng, min_lng, max_lng))
+        ))
+    return and_(*criteria)
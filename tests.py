@@ -1,6 +1,8 @@
 import requests
 import json
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, date, time as time_obj
 
 # --- Configuration ---
@@ -50,7 +52,11 @@ def test_auth_flow():
 def test_profile_and_role_management():
     print_test_case("User Profile and Role Management")
     driver_headers = {"Authorization": f"Bearer {state['driver_tokens']['access_token']}"}
-    test_endpoint("Update user role to 'driver'", "PUT", f"{BASE_URL}/users/me", 200, headers=driver_headers, data={"role": "driver"})
+    role_res = test_endpoint("Update user role to 'driver'", "PUT", f"{BASE_URL}/users/me", 200, headers=driver_headers, data={"role": "driver"})
+    # A role change revokes existing tokens and returns fresh ones carrying the new role
+    test_endpoint("Fail to use token issued before role change", "GET", f"{BASE_URL}/users/me", 401, headers=driver_headers)
+    if role_res: state['driver_tokens'] = {"access_token": role_res['access_token'], "refresh_token": role_res['refresh_token']}
+    driver_headers = {"Authorization": f"Bearer {state['driver_tokens']['access_token']}"}
 
     # Test driver location update
     location_data = {"lat": 31.478, "lng": 74.39}
@@ -70,7 +76,8 @@ def test_ride_management_and_booking():
     print_test_case("Ride Creation, Search, and Booking")
     driver_headers = {"Authorization": f"Bearer {state['driver_tokens']['access_token']}"}
     rider_headers = {"Authorization": f"Bearer {state['rider_tokens']['access_token']}"}
-    ride_data = {"origin_name": "DHA Phase 5", "destination_name": "FCCU", "departure_time": (datetime.utcnow() + timedelta(days=1)).isoformat(), "total_seats": 3}
+    # Route: DHA Phase 5 (31.46, 74.41) -> (31.50, 74.40) -> FCCU (31.52, 74.33)
+    ride_data = {"origin_name": "DHA Phase 5", "destination_name": "FCCU", "departure_time": (datetime.utcnow() + timedelta(days=1)).isoformat(), "total_seats": 3, "route_polyline": "_p__EoedeM_yFn}@_|BntL"}
     ride_res = test_endpoint("Driver creates a ride", "POST", f"{BASE_URL}/rides", 201, headers=driver_headers, data=ride_data)
     if ride_res: state['ride_id'] = ride_res['ride_id']
     
@@ -83,7 +90,19 @@ def test_ride_management_and_booking():
     else:
         print_result(False, "Ride was NOT found in search results")
 
-    test_endpoint("Rider books a seat", "POST", f"{BASE_URL}/rides/{state['ride_id']}/bookings", 201, headers=rider_headers, data={"pickup_point_name": "Midway"})
+    # Picked up and dropped off along the route, away from its origin
+    en_route_res = test_endpoint("Search for rides passing by", "GET", f"{BASE_URL}/rides?match=corridor&origin_lat=31.49&origin_lng=74.405&dest_lat=31.515&dest_lng=74.35", 200)
+    if en_route_res and any(r['id'] == state['ride_id'] for r in en_route_res):
+        print_result(True, "Ride was found by en-route search")
+    else:
+        print_result(False, "Ride was NOT found by en-route search")
+
+    test_endpoint("Rider books a seat", "POST", f"{BASE_URL}/rides/{state['ride_id']}/bookings", 201, headers=rider_headers, data={"pickup_point_name": "Midway", "pickup_point_lat": 31.50, "pickup_point_lng": 74.40})
+    order_res = test_endpoint("Driver gets the pickup order", "GET", f"{BASE_URL}/rides/{state['ride_id']}/pickup-order", 200, headers=driver_headers)
+    if order_res and [s['pickup_point_name'] for s in order_res['stops']] == ["Midway"]:
+        print_result(True, "Pickup order lists the booked pickup point")
+    else:
+        print_result(False, "Pickup order does not list the booked pickup point")
 
 def test_policies_and_safety():
     print_test_case("Policies, Penalties, and Safety")
@@ -98,7 +117,7 @@ def test_recurring_rides_and_advanced_search():
     weekdays = [0, 1, 2, 3, 4]  # Mon-Fri
     recurring_data = {"origin_name": "Recurring Origin", "destination_name": "Recurring Destination", "departure_time_of_day": "09:30:00", "days_of_week": weekdays, "total_seats": 2}
     res = test_endpoint("Create a recurring ride", "POST", f"{BASE_URL}/rides/recurring", 201, headers=driver_headers, data=recurring_data)
-    assert res and res.get('generated_rides_count', 0) > 0, "No ride instances were generated"
+    assert res and res.get('recurring_ride_id'), "Recurring ride was not created"
 
     # --- FIX: Find the next valid weekday to make the test robust ---
     first_valid_date = None
@@ -120,6 +139,11 @@ def test_recurring_rides_and_advanced_search():
     search_res = test_endpoint(f"Search with time window on {search_time_iso}", "GET", f"{BASE_URL}/rides?time={search_time_iso}&destination=Recurring Destination", 200)
     assert search_res is not None and len(search_res) > 0, "Time-window search failed"
 
+    # Occurrences without a ride row yet are listed virtually and materialized on booking
+    rider_headers = {"Authorization": f"Bearer {state['rider_tokens']['access_token']}"}
+    booking_res = test_endpoint("Rider books a recurring ride occurrence", "POST", f"{BASE_URL}/rides/{search_res[0]['id']}/bookings", 201, headers=rider_headers, data={"pickup_point_name": "Main Gate"})
+    assert booking_res is not None, "Booking a recurring occurrence failed"
+
 def test_pattern_recognition_and_recommendations():
     print_test_case("Pattern Recognition and AI Recommendations")
     driver_headers = {"Authorization": f"Bearer {state['driver_tokens']['access_token']}"}
@@ -135,6 +159,51 @@ def test_pattern_recognition_and_recommendations():
     reco_res = test_endpoint("Rider gets pattern-based recommendations", "GET", f"{BASE_URL}/ai/recommendations/patterns", 200, headers=rider_headers)
     assert reco_res is not None and len(reco_res) > 0, "No pattern-based recommendations found"
 
+    estimate_res = test_endpoint("Estimate a journey between coordinates", "GET", f"{BASE_URL}/ai/estimate-journey?origin_lat=31.46&origin_lng=74.41&dest_lat=31.52&dest_lng=74.33", 200)
+    assert estimate_res is not None and estimate_res['estimated_distance_km'] > 0, "Journey estimate failed"
+
+def test_concurrent_booking():
+    print_test_case("Concurrent Seat Booking")
+    driver_headers = {"Authorization": f"Bearer {state['driver_tokens']['access_token']}"}
+    seats, rider_count, attempts_per_rider = 10, 40, 5
+
+    # Fixed 10:00 departure so the ride is inside the allowed scheduling hours
+    departure = datetime.combine(date.today() + timedelta(days=1), time_obj(10, 0)).isoformat()
+    ride = test_endpoint("Create a ride for the booking rush", "POST", f"{BASE_URL}/rides", 201, headers=driver_headers, data={"origin_name": "Rush Origin", "destination_name": "Rush Destination", "departure_time": departure, "total_seats": seats})
+    assert ride, "Could not create the ride for the concurrency test"
+
+    def register_and_login(i):
+        rider = {"email": f"rush{i}.{int(time.time())}@fccollege.edu.pk", "fullName": f"Rush Rider {i}", "password": "RushPassword123"}
+        requests.post(f"{BASE_URL}/auth/register", json=rider)
+        tokens = requests.post(f"{BASE_URL}/auth/login", json={"email": rider['email'], "password": rider['password']}).json()
+        return {"Authorization": f"Bearer {tokens['access_token']}"}
+
+    with ThreadPoolExecutor(max_workers=20) as pool:
+        rider_headers = list(pool.map(register_and_login, range(rider_count)))
+
+    # Every rider fires several booking requests at once, all released together
+    attempts = [(i, headers) for i, headers in enumerate(rider_headers) for _ in range(attempts_per_rider)]
+    start = threading.Barrier(len(attempts))
+    def book(attempt):
+        i, headers = attempt
+        start.wait()
+        res = requests.post(f"{BASE_URL}/rides/{ride['ride_id']}/bookings", headers=headers, json={"pickup_point_name": "Rush Stop"})
+        return i, res.status_code
+
+    with ThreadPoolExecutor(max_workers=len(attempts)) as pool:
+        results = list(pool.map(book, attempts))
+
+    statuses = [status for _, status in results]
+    successes = [i for i, status in results if status == 201]
+    print_result(statuses.count(201) == seats, f"{statuses.count(201)} of {len(attempts)} simultaneous bookings succeeded for {seats} seats")
+    print_result(all(status in (201, 409) for status in statuses), f"Losing requests were rejected with 409 (statuses seen: {sorted(set(statuses))})")
+    print_result(len(successes) == len(set(successes)), "No rider holds more than one booking")
+
+    details = test_endpoint("Fetch ride after the booking rush", "GET", f"{BASE_URL}/rides/{ride['ride_id']}", 200)
+    if details:
+        confirmed = [b for b in details['bookings'] if b['status'] == 'confirmed']
+        print_result(details['available_seats'] == 0 and len(confirmed) == seats, f"Final seat count is consistent (available: {details['available_seats']}, confirmed bookings: {len(confirmed)})")
+
 def test_token_revocation():
     print_test_case("Token Refresh and Logout")
     refresh_headers = {"Authorization": f"Bearer {state['driver_tokens']['refresh_token']}"}
@@ -144,6 +213,18 @@ def test_token_revocation():
     test_endpoint("Logout (revoke token)", "POST", f"{BASE_URL}/auth/logout", 200, headers=logout_headers)
     test_endpoint("Fail to use revoked token", "GET", f"{BASE_URL}/users/me", 401, headers=logout_headers)
 
+def test_metrics():
+    print_test_case("Metrics Endpoint")
+    try:
+        response = requests.get(f"{BASE_URL}/metrics")
+        body = response.text
+        print_result(response.status_code == 200 and response.headers.get('Content-Type', '').startswith('text/plain'), f"(GET {BASE_URL}/metrics) - Metrics served as Prometheus text [Status: {response.status_code}]")
+        print_result('carpool_http_request_duration_seconds_bucket{endpoint="rides_bp.search_rides"' in body, "Ride search latency histogram is exported")
+        print_result('carpool_sql_statements_per_request_count{endpoint="rides_bp.search_rides"}' in body, "Ride search SQL statement counts are exported")
+        print_result('carpool_response_cache_hits_total' in body, "Response cache hit/miss counters are exported")
+    except requests.exceptions.RequestException as e:
+        print_result(False, f"(GET {BASE_URL}/metrics) - Metrics served as Prometheus text [Request failed: {e}]")
+
 if __name__ == "__main__":
     print("🚀 Starting API Integration Test Suite 🚀")
     test_auth_flow()
@@ -153,7 +234,9 @@ if __name__ == "__main__":
         test_policies_and_safety()
         test_recurring_rides_and_advanced_search()
         test_pattern_recognition_and_recommendations()
+        test_concurrent_booking()
         test_token_revocation()
+        test_metrics()
     else:
         print("\n❌ Critical failure during authentication flow. Halting tests.")
     print("\n🏁 Test Suite Finished 🏁")
\ No newline at end of file
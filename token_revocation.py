@@ -0,0 +1,163 @@
+# token_revocation.py
+"""
+In-memory revocation cache in front of the `token_blocklist` table.
+
+The per-request blocklist check is answered from a JTI -> expiry map held in
+memory, so the common case costs no DB query. The map is refreshed from the
+table incrementally at most every JWT_BLOCKLIST_REFRESH_SECONDS, which bounds
+how long a logout in another worker process takes to be seen here. Rows are
+polled by `created_at`, re-reading a short overlap, rather than by id: SQLite
+reuses the ids of purged rows. Entries are dropped once the token they revoke
+has expired, and a background thread purges expired rows from the table every
+JWT_BLOCKLIST_PURGE_SECONDS.
+
+The same refresh tracks per-user token versions. Bumping `User.token_version`
+(e.g. on a role change) revokes every token issued with an older `ver` claim.
+Versions are millisecond timestamps, so recent bumps can be polled with an
+indexed range query just like new blocklist rows.
+"""
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import delete, or_, select
+from models import db, TokenBlocklist, User
+
+logger = logging.getLogger(__name__)
+
+# Bumps and revocations committed slightly out of order by concurrent writers
+# are still picked up because each poll re-reads this much history.
+_VERSION_OVERLAP_MS = 60_000
+_REVOCATION_OVERLAP = timedelta(seconds=60)
+
+def next_token_version(user):
+    """A new token version for `user`: now in ms, and always above the current one."""
+    return max(int(time.time() * 1000), (user.token_version or 0) + 1)
+
+def purge_expired_tokens(max_token_lifetime):
+    """
+    Deletes blocklist rows whose token has expired, plus legacy rows without
+    `expires_at` older than the longest token lifetime. Returns the row count.
+    """
+    now = datetime.utcnow()
+    with db.engine.begin() as conn:
+        result = conn.execute(delete(TokenBlocklist).where(or_(
+            TokenBlocklist.expires_at < now,
+            (TokenBlocklist.expires_at == None) & (TokenBlocklist.created_at < now - max_token_lifetime)
+        )))
+    return result.rowcount
+
+def _expiry(expires_at):
+    """Naive UTC datetime -> unix timestamp (None stays None)."""
+    return expires_at.replace(tzinfo=timezone.utc).timestamp() if expires_at else None
+
+class RevocationCache:
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._revoked = {}  # jti -> expiry as a unix timestamp (None if unknown)
+        self._last_created = None  # created_at of the newest blocklist row seen
+        self._user_versions = {}  # user id -> latest token version bumped within the token lifetime
+        self._last_version = None
+        self._last_refresh = None
+        self._worker = None
+        self._app = None
+        self.refresh_interval = 5
+        self.purge_interval = 3600
+        self.max_token_lifetime = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self._app = app
+        self.refresh_interval = app.config.get('JWT_BLOCKLIST_REFRESH_SECONDS', 5)
+        self.purge_interval = app.config.get('JWT_BLOCKLIST_PURGE_SECONDS', 3600)
+        self.max_token_lifetime = max(app.config['JWT_ACCESS_TOKEN_EXPIRES'], app.config['JWT_REFRESH_TOKEN_EXPIRES'])
+        # Started lazily so CLI commands and scripts don't spawn the purge worker
+        if self.purge_interval > 0:
+            app.before_request(self._ensure_worker)
+
+    def is_revoked(self, jti):
+        self._maybe_refresh()
+        return jti in self._revoked
+
+    def is_outdated(self, user_id, token_version):
+        """Whether a token carrying `token_version` was issued before the user's last version bump."""
+        self._maybe_refresh()
+        return self._user_versions.get(user_id, 0) > (token_version or 0)
+
+    def bump_user(self, user_id, token_version):
+        """Records a version bump made by this process; call after committing it."""
+        with self._lock:
+            self._user_versions[user_id] = max(self._user_versions.get(user_id, 0), token_version)
+
+    def add(self, jti, expires_at):
+        """Records a revocation made by this process; call after committing the blocklist row."""
+        with self._lock:
+            self._revoked[jti] = _expiry(expires_at)
+
+    def _maybe_refresh(self):
+        now = time.monotonic()
+        if self._last_refresh is not None and now - self._last_refresh < self.refresh_interval:
+            return
+        with self._lock:
+            if self._last_refresh is not None and now - self._last_refresh < self.refresh_interval:
+                return
+            self._refresh()
+            self._last_refresh = now
+
+    def _refresh(self):
+        polled_at = datetime.utcnow()
+        # A token still alive was revoked within the longest token lifetime
+        since = polled_at - self.max_token_lifetime if self._last_created is None \
+            else self._last_created - _REVOCATION_OVERLAP
+        query = select(TokenBlocklist.jti, TokenBlocklist.expires_at, TokenBlocklist.created_at) \
+            .where(TokenBlocklist.created_at >= since)
+        for row in db.session.execute(query).all():
+            self._revoked[row.jti] = _expiry(row.expires_at)
+            self._last_created = max(self._last_created or row.created_at, row.created_at)
+        if self._last_created is None:
+            self._last_created = polled_at
+
+        # Forget revocations of tokens that have expired on their own
+        now = time.time()
+        expired = [jti for jti, expires in list(self._revoked.items()) if expires is not None and expires < now]
+        for jti in expired:
+            del self._revoked[jti]
+
+        # Bumps older than the longest token lifetime can no longer affect a live token
+        oldest_relevant = int((now - self.max_token_lifetime.total_seconds()) * 1000)
+        since = oldest_relevant if self._last_version is None else max(oldest_relevant, self._last_version - _VERSION_OVERLAP_MS)
+        bumps = db.session.execute(
+            select(User.id, User.token_version).where(User.token_version > since)
+        ).all()
+        for row in bumps:
+            self._user_versions[row.id] = max(self._user_versions.get(row.id, 0), row.token_version)
+            self._last_version = max(self._last_version or 0, row.token_version)
+        if self._last_version is None:
+            self._last_version = since
+        outdated = [user_id for user_id, version in list(self._user_versions.items()) if version < oldest_relevant]
+        for user_id in outdated:
+            del self._user_versions[user_id]
+
+    # --- Background purge ---
+
+    def purge_once(self):
+        with self._app.app_context():
+            try:
+                purged = purge_expired_tokens(self.max_token_lifetime)
+                logger.debug("Purged %d expired blocklist rows", purged)
+            except Exception:
+                logger.exception("Blocklist purge failed; will retry")
+
+    def _ensure_worker(self):
+        if self._worker is not None:
+            return
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name='blocklist-purge', daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.purge_interval)
+            self.purge_once()
@@ -0,0 +1,40 @@
+# trip_patterns.py
+import uuid
+from sqlalchemy import delete, func, insert, select, union_all
+from models import db, Ride, Booking, UserTripPattern
+
+def rebuild_trip_patterns(batch_size=5000):
+    """
+    Rebuilds `user_trip_patterns` from completed rides: one trip for the driver
+    and one for every rider whose booking was completed. The grouped counts
+    are streamed from the database and inserted in batches, all in one
+    transaction. Returns the number of patterns written.
+    """
+    trips = union_all(
+        select(Ride.driver_id.label('user_id'), Ride.origin_name, Ride.destination_name)
+        .where(Ride.status == 'completed'),
+        select(Booking.rider_id.label('user_id'), Ride.origin_name, Ride.destination_name)
+        .join(Ride, Booking.ride_id == Ride.id)
+        .where(Ride.status == 'completed', Booking.status == 'completed')
+    ).subquery()
+    counts = (
+        select(trips.c.user_id, trips.c.origin_name, trips.c.destination_name, func.count().label('trip_count'))
+        .group_by(trips.c.user_id, trips.c.origin_name, trips.c.destination_name)
+    )
+
+    patterns = UserTripPattern.__table__
+    written = 0
+    db.session.execute(delete(patterns))
+    for partition in db.session.execute(counts).yield_per(batch_size).partitions():
+        db.session.execute(insert(patterns), [
+            {
+                "id": str(uuid.uuid4()),
+                "user_id": row.user_id,
+                "origin_name": row.origin_name,
+                "destination_name": row.destination_name,
+                "trip_count": row.trip_count
+            } for row in partition
+        ])
+        written += len(partition)
+    db.session.commit()
+    return written